@@ -1,10 +1,17 @@
-import csv
+import os
+import sqlite3
 import datetime as dt
 import flet as ft
 
 from validators import validar_campos
+from db import insertar_historia, actualizar_historia, borrar_historia, iter_consultas
 from pdf_utils import generar_pdf
-from backup_drive import backup_now, can_backup
+from pdf_batch import generar_pdfs_lote, generar_reporte
+from importer import importar_pacientes
+from exporter import exportar, EXPORT_COLUMNS, FORMATOS
+from backup_drive import backup_now, can_backup, almacen_backup
+import catalogo
+from snapshot import tomar_snapshot
 
 # ---------------- Tabla ----------------
 
@@ -12,7 +19,10 @@ from backup_drive import backup_now, can_backup
 
 # ---------------- CRUD ----------------
 
-def guardar(cur, conn, get_form_data, clear_form, after_refresh, page: ft.Page):
+# after_change(row_id, tipo) recibe el id afectado y "insert" / "update" / "delete",
+# para que la tabla actualice sólo esa fila en vez de recargarse entera.
+
+def guardar(db, get_form_data, clear_form, after_change, page: ft.Page):
     print("[DEBUG] Se toco el boton guardar")
     data = get_form_data()
     ok, msg = validar_campos(data)
@@ -20,24 +30,17 @@ def guardar(cur, conn, get_form_data, clear_form, after_refresh, page: ft.Page):
         print("[DEBUG] no pasa la validacion")
         _notify(f"Validación {msg}", page); return
 
-    ordered = (
-        data["nombre"], data["dni"], data["edad"], data["domicilio"], data["obra_social"],
-        data["numero_beneficio"], data["telefono"], data["email"],
-        data["antecedentes_personales"], data["antecedentes_familiares"],
-        data["examen_fisico"], data["diagnostico_presuntivo"],
-        data["evolucion_seguimiento"], data["motivo_consulta"]
-    )
-    cur.execute("""INSERT INTO historias
-        (nombre,dni,edad,domicilio,obra_social,numero_beneficio,telefono,email,
-         antecedentes_personales,antecedentes_familiares,examen_fisico,diagnostico_presuntivo,
-         evolucion_seguimiento,motivo_consulta)
-        VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", ordered)
-    conn.commit()
-    clear_form(); after_refresh()
+    try:
+        with db.transaction() as cur:
+            row_id = insertar_historia(cur, data)
+    except sqlite3.IntegrityError:
+        _notify("Ya existe una historia clínica con ese DNI", page); return
+    clear_form(); after_change(row_id, "insert")
     print("[DEBUG] Se guardo el nuevo paciente")
     _notify("Historia clínica guardada",page)
+    return row_id
 
-def actualizar(cur, conn, selected_row_values, get_form_data, clear_form, after_refresh, page: ft.Page):
+def actualizar(db, selected_row_values, get_form_data, clear_form, after_change, page: ft.Page):
     values = selected_row_values.get("values")
     if not values:
         _notify( "ATENCIÓN: Seleccioná una historia para actualizar",page); return
@@ -48,22 +51,16 @@ def actualizar(cur, conn, selected_row_values, get_form_data, clear_form, after_
     if not ok:
         _notify(f"Validación {msg}", page); return
 
-    ordered = (
-        data["nombre"], data["dni"], data["edad"], data["domicilio"], data["obra_social"],
-        data["numero_beneficio"], data["telefono"], data["email"],
-        data["antecedentes_personales"], data["antecedentes_familiares"],
-        data["examen_fisico"], data["diagnostico_presuntivo"],
-        data["evolucion_seguimiento"], data["motivo_consulta"], row_id
-    )
-    cur.execute("""UPDATE historias SET
-        nombre=?, dni=?, edad=?, domicilio=?, obra_social=?, numero_beneficio=?, telefono=?, email=?,
-        antecedentes_personales=?, antecedentes_familiares=?, examen_fisico=?, diagnostico_presuntivo=?,
-        evolucion_seguimiento=?, motivo_consulta=? WHERE id=?""", ordered)
-    conn.commit()
-    clear_form(); after_refresh()
+    try:
+        with db.transaction() as cur:
+            actualizar_historia(cur, row_id, data)
+    except sqlite3.IntegrityError:
+        _notify("Ya existe otra historia clínica con ese DNI", page); return
+    clear_form(); after_change(row_id, "update")
     _notify( "Historia clínica actualizada", page)
+    return row_id
 
-def accionBorrar(page,selected_row_values,cur, conn,clear_form,after_refresh):
+def accionBorrar(page,selected_row_values,db,clear_form,after_change):
         page.horizontal_alignment = ft.CrossAxisAlignment.CENTER
         values = selected_row_values.get("values")
         def cerrar_banner(e):
@@ -78,11 +75,11 @@ def accionBorrar(page,selected_row_values,cur, conn,clear_form,after_refresh):
                 return
             try:
                 row_id = int(values[0])
-                cur.execute("DELETE FROM historias WHERE id=?", (row_id,))
-                print("[DEBUG] rowcount after DELETE:", cur.rowcount)
-                conn.commit()
+                with db.transaction() as cur:
+                    deleted = borrar_historia(cur, row_id)
+                print("[DEBUG] rowcount after DELETE:", deleted)
                 clear_form()
-                after_refresh()
+                after_change(row_id, "delete")
                 _notify("Historia clínica eliminada", page)
             except Exception as ex:
                 _notify(f"Error al borrar: {ex}", page)
@@ -105,42 +102,216 @@ def accionBorrar(page,selected_row_values,cur, conn,clear_form,after_refresh):
 
 
 # ---------------- Exportar / PDF / Backup ----------------
+# Todo lo pesado corre en el TaskRunner (tasks.py) de la sesión: la ventana sigue
+# respondiendo, el avance se ve en la barra de tareas y se puede cancelar.
+# Las tareas leen con db.reader() en su propio hilo (las conexiones son por hilo).
 
-def export_csv(cur, page: ft.Page, file_picker: ft.FilePicker):
-    cur.execute("SELECT * FROM historias"); rows = cur.fetchall()
-    headers = [d[0] for d in cur.description]
+def export_csv(runner, db, page: ft.Page, file_picker: ft.FilePicker, filtros: dict | None = None, ids=None):
+    """
+    Exporta pacientes (exporter.exportar, en streaming) a CSV, JSONL o XLSX según la
+    extensión elegida. Con `filtros`/`ids` exporta sólo el listado actual; antes se
+    eligen las columnas.
+    """
     suggested = f"historias_{dt.datetime.now():%Y%m%d_%H%M%S}.csv"
+    elegidas = {"columnas": None}
+    titulo = "Exportar pacientes del listado" if (filtros or ids is not None) else "Exportar pacientes"
+
+    def tarea(job, path):
+        cur = db.reader().cursor()
+        return exportar(cur, path, columnas=elegidas["columnas"], filtros=filtros, ids=ids,
+                        on_progress=lambda n, total: job.progress(n / (total or 1), f"{n} de {total} filas"))
 
     def save_result(e: ft.FilePickerResultEvent):
         if not e.path: return
-        with open(e.path, "w", encoding="utf-8-sig", newline="") as f:
-            w = csv.writer(f, delimiter=";"); w.writerow(headers); w.writerows(rows)
-        _notify(page, f"Se exportaron {len(rows)} filas a:\n{e.path}")
+        path = e.path if os.path.splitext(e.path)[1] else e.path + ".csv"
+        runner.submit(
+            titulo, tarea, path, pasar_job=True,
+            on_done=lambda rep: _notify(f"Se exportaron {rep['filas']} filas ({rep['formato'].upper()}) a:\n"
+                                        f"{rep['path']}", page),
+            on_error=lambda ex: _err(page, "Exportar pacientes", str(ex)),
+        )
+
+    def aceptar(checks):
+        cols = [c.data for c in checks if c.value]
+        if not cols:
+            _notify("Elegí al menos una columna", page); return
+        elegidas["columnas"] = None if len(cols) == len(checks) else cols
+        _close_dialog(page)
+        file_picker.on_result = save_result
+        file_picker.save_file(file_name=suggested, allowed_extensions=list(FORMATOS),
+                              dialog_title="Exportar pacientes (CSV, JSONL o XLSX)")
+
+    checks = [ft.Checkbox(label=c, value=True, data=c) for c in EXPORT_COLUMNS]
+    page.dialog = ft.AlertDialog(
+        modal=True,
+        title=ft.Text(f"{titulo}: columnas"),
+        content=ft.Container(ft.ListView(checks), width=360, height=400),
+        actions=[
+            ft.TextButton("Cancelar", on_click=lambda e: _close_dialog(page)),
+            ft.ElevatedButton("Elegir archivo…", on_click=lambda e: aceptar(checks)),
+        ],
+    )
+    page.dialog.open = True; page.update()
+
+def exportar_bd_action(runner, db, dest: str, page: ft.Page):
+    """Copia consistente y verificada de la BD (snapshot.tomar_snapshot) en segundo plano."""
+    def tarea(job):
+        return tomar_snapshot(db.path, dest, progress=job.progress)["path"]
 
-    file_picker.on_save = save_result
-    file_picker.save_file(file_name=suggested, allowed_extensions=["csv"])
+    runner.submit("Exportar BD", tarea, pasar_job=True,
+                  on_done=lambda out: _notify(f"Copia de seguridad exportada y verificada:\n{out}", page),
+                  on_error=lambda ex: _err(page, "Exportar BD", str(ex)))
 
-def generar_pdf_action(paths, selected_row_values, page: ft.Page):
+def importar_pacientes_action(runner, db, path: str, after_refresh, page: ft.Page):
+    def tarea(job):
+        # on_progress se llama después de cada lote ya guardado: cancelar conserva lo importado
+        return importar_pacientes(db, path, on_progress=lambda n: job.progress(None, f"{n} filas procesadas"))
+
+    def listo(rep):
+        after_refresh()
+        resumen = (f"{rep['insertadas']} nuevas, {rep['actualizadas']} actualizadas, "
+                   f"{len(rep['errores'])} con error ({rep['filas_por_seg']:.0f} filas/s).")
+        if rep["errores"]:
+            detalle = "\n".join(f"Línea {n}: {msg}" for n, msg in rep["errores"][:20])
+            if len(rep["errores"]) > 20:
+                detalle += f"\n… y {len(rep['errores']) - 20} más"
+            _warn(page, "Importación con errores", f"{resumen}\n\n{detalle}")
+        else:
+            _notify(f"Importación completa: {resumen}", page)
+
+    def fallo(ex):
+        after_refresh()
+        _err(page, "Importar pacientes", str(ex))
+
+    return runner.submit(f"Importar {os.path.basename(path)}", tarea, pasar_job=True,
+                         on_done=listo, on_error=fallo)
+
+def generar_pdf_action(runner, paths, selected_row_values, page: ft.Page, db=None):
     values = selected_row_values.get("values")
     if not values:
         _warn(page, "Atención", "Seleccioná una historia para generar PDF"); return
-    try:
-        out = generar_pdf(paths, values)
-        _notify(f"PDF guardado en:\n{out}", page)
-    except Exception as ex:
-        _err(page, "Error PDF", str(ex))
 
-def backup_now_action(paths, page):
+    def tarea(job):
+        job.progress(None, "Leyendo visitas…")
+        consultas = list(iter_consultas(db.reader().cursor(), values[0])) if db is not None else None
+        job.progress(0.3, "Generando PDF…")
+        return generar_pdf(paths, values, consultas)
+
+    return runner.submit(f"PDF de {values[1] or values[0]}", tarea, pasar_job=True,
+                         on_done=lambda out: _notify(f"PDF guardado en:\n{out}", page),
+                         on_error=lambda ex: _err(page, "Error PDF", str(ex)))
+
+def generar_pdfs_lote_action(runner, db, paths, page: ft.Page, ids=None, filtros=None):
+    """PDFs de varias historias (ids o filtro actual) en paralelo, como tarea cancelable."""
+    def tarea(job):
+        return generar_pdfs_lote(
+            db, paths, ids=ids, filtros=filtros,
+            on_progress=lambda hechos, total, errores: job.progress(
+                hechos / total if total else None,
+                f"{hechos} de {total}" + (f" ({errores} con error)" if errores else "")),
+        )
+
+    def listo(rep):
+        resumen = (f"{rep['generados']} de {rep['total']} PDFs en {rep['segundos']:.0f} s "
+                   f"({rep['pdfs_por_seg']:.1f} por segundo).\nCarpeta: {rep['carpeta']}")
+        if rep["errores"]:
+            detalle = "\n".join(f"#{i} {nombre}: {msg}" for i, nombre, msg in rep["errores"][:20])
+            if len(rep["errores"]) > 20:
+                detalle += f"\n… y {len(rep['errores']) - 20} más (ver errores.csv)"
+            _warn(page, "PDFs generados con errores", f"{resumen}\n\n{detalle}")
+        else:
+            _notify(f"PDFs listos: {resumen}", page)
+
+    return runner.submit("PDFs del listado", tarea, pasar_job=True, on_done=listo,
+                         on_error=lambda ex: _err(page, "Error PDFs", str(ex)))
+
+def generar_reporte_action(runner, db, paths, page: ft.Page, ids=None, filtros=None):
+    """Un solo PDF con índice y marcadores (ids o filtro actual), como tarea cancelable."""
+    def tarea(job):
+        return generar_reporte(
+            db, paths, ids=ids, filtros=filtros,
+            on_progress=lambda hechos, total: job.progress(hechos / total, f"{hechos} de {total}"),
+        )
+
+    def listo(rep):
+        archivos = "\n".join(rep["archivos"])
+        partes = f" en {len(rep['archivos'])} partes" if len(rep["archivos"]) > 1 else ""
+        _notify(f"Reporte de {rep['total']} historias ({rep['paginas']} páginas){partes}:\n{archivos}", page)
+
+    return runner.submit("Reporte PDF del listado", tarea, pasar_job=True, on_done=listo,
+                         on_error=lambda ex: _err(page, "Error reporte PDF", str(ex)))
+
+def backup_now_action(runner, paths, page):
     print("[DEBUG] Se toco el boton backup")
     if not can_backup(paths):
         print("[DEBUG] No tiene pydrive2 o client_secrets,json")
-        _notify(page,"Falta PyDrive2 o client_secrets.json"); return
+        _notify("Falta PyDrive2 o client_secrets.json", page); return
+    return runner.submit(
+        "Backup a Google Drive", lambda job: backup_now(paths, progress=job.progress), pasar_job=True,
+        on_done=lambda _: _notify("Copia de seguridad subida a Google Drive", page),
+        on_error=lambda ex: _err(page, "Backup", str(ex)),
+    )
+
+def restaurar_backup_action(runner, paths, page, after_refresh):
+    """
+    Lista los backups (catálogo puesto al día con el destino), pide confirmación y
+    reemplaza la BD por el elegido (catalogo.restaurar_bd) en segundo plano.
+    """
+    if not can_backup(paths):
+        _notify("Falta PyDrive2 o client_secrets.json", page); return
+
+    def buscar(job):
+        job.progress(None, "Buscando backups…")
+        return catalogo.sincronizar(paths, almacen_backup(paths))
+
+    def lanzar(entrada):
+        _close_dialog(page)
+        runner.submit(
+            "Restaurar backup",
+            lambda job: catalogo.restaurar_bd(paths, almacen_backup(paths), entrada["id"], progress=job.progress),
+            pasar_job=True, on_done=listo, on_error=lambda ex: _err(page, "Restaurar backup", str(ex)),
+        )
+
+    def listo(rep):
+        after_refresh()
+        _notify(f"Backup {rep['id']} restaurado en {rep['segundos']:.0f} s "
+                f"({rep['filas'].get('historias', 0)} historias).\n"
+                f"La base anterior quedó en {rep['copia_previa']}", page)
+
+    def confirmar(entrada):
+        _close_dialog(page)
+        _confirm(page, "Restaurar backup",
+                 f"Se reemplaza la base actual por el backup del {_fecha_backup(entrada)}. "
+                 "Antes se guarda una copia de la base actual. ¿Continuar?",
+                 lambda e: lanzar(entrada))
+
+    def elegir(entradas):
+        if not entradas:
+            _notify("No hay backups para restaurar", page); return
+        tiles = [
+            ft.ListTile(
+                title=ft.Text(f"{_fecha_backup(e)} — {e.get('filas', {}).get('historias', '?')} historias"),
+                subtitle=ft.Text(f"{(e.get('bytes') or 0) / 1e6:.1f} MB · {e['id']}"),
+                on_click=lambda ev, e=e: confirmar(e),
+            )
+            for e in entradas
+        ]
+        page.dialog = ft.AlertDialog(
+            modal=True,
+            title=ft.Text("Restaurar backup"),
+            content=ft.Container(ft.ListView(tiles), width=480, height=360),
+            actions=[ft.TextButton("Cancelar", on_click=lambda e: _close_dialog(page))],
+        )
+        page.dialog.open = True; page.update()
+
+    return runner.submit("Buscar backups", buscar, pasar_job=True, on_done=elegir,
+                         on_error=lambda ex: _err(page, "Restaurar backup", str(ex)))
+
+def _fecha_backup(entrada: dict) -> str:
     try:
-        backup_now(paths)
-        print("[DEBUG] entro en de copia de seguridad")
-        _notify("Copia de seguridad subida a Google Drive", page)
-    except Exception as ex:
-        _err(page, "Backup", str(ex))
+        return dt.datetime.fromisoformat(entrada["creado"]).strftime("%d/%m/%Y %H:%M")
+    except (KeyError, TypeError, ValueError):
+        return entrada["id"]
 
 # ---------------- Helpers UI (Flet) ----------------
 
@@ -0,0 +1,245 @@
+# almacenes.py
+"""
+Dónde se guardan los backups incrementales (backup_store.py). Un almacén es un
+conjunto plano de objetos con nombre ("chunks/<hash>", "snapshots/<id>.json"):
+
+    put(nombre, data)      guarda/reemplaza
+    get(nombre) -> bytes   KeyError si no existe
+    listar(prefijo="")     nombres que empiezan con prefijo, ordenados
+    borrar(nombre)         no falla si ya no estaba
+    exists(nombre)
+    modificado(nombre)     timestamp del último put (None si no se sabe)
+
+Implementaciones: CarpetaLocal (carpeta local o de red), EnMemoria (para pruebas y
+bench.py, con latencia y fallas simuladas) y backup_drive.DriveStore (Google Drive).
+ConReintentos envuelve cualquiera y reintenta los errores de red con espera
+exponencial; es lo que usa backup_now.
+"""
+import os
+import json
+import time
+import random
+import threading
+
+class Almacen:
+    """
+    Interfaz de los almacenes; exists() por defecto usa listar(). `lecturas_paralelas`:
+    cuántos get() pueden correr a la vez desde distintos hilos (restaurar).
+    """
+
+    lecturas_paralelas = 1
+
+    def put(self, nombre: str, data: bytes):
+        raise NotImplementedError
+
+    def get(self, nombre: str) -> bytes:
+        raise NotImplementedError
+
+    def listar(self, prefijo: str = "") -> list:
+        raise NotImplementedError
+
+    def borrar(self, nombre: str):
+        raise NotImplementedError
+
+    def exists(self, nombre: str) -> bool:
+        return nombre in self.listar(nombre)
+
+    def modificado(self, nombre: str):
+        return None
+
+# ------------------------- carpeta -------------------------
+class CarpetaLocal(Almacen):
+    """Almacén en una carpeta (local o de red): cada objeto es un archivo."""
+
+    lecturas_paralelas = 4
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def __repr__(self):
+        return f"CarpetaLocal({self.root!r})"
+
+    def _path(self, nombre: str) -> str:
+        return os.path.join(self.root, *nombre.split("/"))
+
+    def put(self, nombre: str, data: bytes):
+        path = self._path(nombre)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def get(self, nombre: str) -> bytes:
+        try:
+            with open(self._path(nombre), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(nombre)
+
+    def exists(self, nombre: str) -> bool:
+        return os.path.exists(self._path(nombre))
+
+    def modificado(self, nombre: str):
+        try:
+            return os.path.getmtime(self._path(nombre))
+        except FileNotFoundError:
+            return None
+
+    def listar(self, prefijo: str = "") -> list:
+        # Se recorre sólo la subcarpeta del prefijo ("chunks/" no mira "snapshots/")
+        carpeta = prefijo.rpartition("/")[0]
+        base = self._path(carpeta) if carpeta else self.root
+        out = []
+        for dirpath, _, archivos in os.walk(base):
+            rel = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            pre = "" if rel == "." else rel + "/"
+            out.extend(pre + n for n in archivos if not n.endswith(".tmp") and (pre + n).startswith(prefijo))
+        return sorted(out)
+
+    def borrar(self, nombre: str):
+        try:
+            os.remove(self._path(nombre))
+        except FileNotFoundError:
+            pass
+
+# ------------------------- memoria -------------------------
+class EnMemoria(Almacen):
+    """
+    Almacén en un dict, para pruebas sin red. `latencia` (segundos por operación) y
+    `fallas` (probabilidad de ConnectionError por operación) simulan una conexión
+    lenta o inestable; `ops` cuenta las operaciones y `bytes_subidos` lo que se guardó.
+    `fechas` tiene la hora de cada put (las pruebas la pueden envejecer).
+    """
+
+    lecturas_paralelas = 8
+
+    def __init__(self, latencia: float = 0.0, fallas: float = 0.0, semilla=None):
+        self.objetos = {}
+        self.fechas = {}
+        self.latencia = latencia
+        self.fallas = fallas
+        self.ops = {"put": 0, "get": 0, "listar": 0, "borrar": 0, "fallas": 0}
+        self.bytes_subidos = 0
+        self._rnd = random.Random(semilla)
+        self._lock = threading.Lock()
+
+    def _red(self, op: str):
+        if self.latencia:
+            time.sleep(self.latencia)
+        with self._lock:
+            self.ops[op] += 1
+            if self.fallas and self._rnd.random() < self.fallas:
+                self.ops["fallas"] += 1
+                raise ConnectionError(f"Falla simulada en {op}")
+
+    def put(self, nombre: str, data: bytes):
+        self._red("put")
+        with self._lock:
+            self.objetos[nombre] = bytes(data)
+            self.fechas[nombre] = time.time()
+            self.bytes_subidos += len(data)
+
+    def get(self, nombre: str) -> bytes:
+        self._red("get")
+        return self.objetos[nombre]
+
+    def exists(self, nombre: str) -> bool:
+        return nombre in self.objetos
+
+    def modificado(self, nombre: str):
+        return self.fechas.get(nombre)
+
+    def listar(self, prefijo: str = "") -> list:
+        self._red("listar")
+        return sorted(n for n in list(self.objetos) if n.startswith(prefijo))
+
+    def borrar(self, nombre: str):
+        self._red("borrar")
+        self.objetos.pop(nombre, None)
+        self.fechas.pop(nombre, None)
+
+# ------------------------- reintentos -------------------------
+# Errores que no se arreglan reintentando (el objeto no está, datos inválidos…)
+_PERMANENTES = (KeyError, FileNotFoundError, PermissionError, NotADirectoryError, ValueError, TypeError)
+
+# Un 403 de Google sólo se arregla esperando si es por límite de pedidos (no por permisos
+# ni por la cuota diaria)
+_MOTIVOS_LIMITE = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+def _error_http(ex: BaseException):
+    """
+    (estado, motivos) de un HttpError de googleapiclient o un ApiRequestError de
+    PyDrive2 (que trae el "error" del JSON ya leído); (None, set()) si no es ninguno.
+    """
+    error = getattr(ex, "error", None)
+    if not isinstance(error, dict):
+        try:
+            error = json.loads(getattr(ex, "content", None) or "{}").get("error")
+        except (TypeError, ValueError, AttributeError):
+            error = None
+    error = error if isinstance(error, dict) else {}
+    estado = getattr(getattr(ex, "resp", None), "status", None) or error.get("code")
+    motivos = {e.get("reason") for e in error.get("errors") or () if isinstance(e, dict)}
+    return estado, motivos
+
+def es_transitorio(ex: BaseException) -> bool:
+    """True para errores de red/servidor (ConnectionError, timeouts, HttpError 5xx/429…)."""
+    if isinstance(ex, _PERMANENTES) or not isinstance(ex, Exception):
+        return False
+    estado, motivos = _error_http(ex)
+    if estado is not None:
+        if int(estado) == 403:
+            return bool(motivos & _MOTIVOS_LIMITE)
+        return int(estado) >= 500 or int(estado) in (408, 429)
+    return True
+
+class ConReintentos(Almacen):
+    """
+    Envuelve un almacén y reintenta cada operación que falle por un error
+    transitorio: `intentos` veces en total, esperando espera, 2*espera, 4*espera…
+    `dormir` se puede reemplazar en pruebas. `reintentos` cuenta los reintentos hechos.
+    """
+
+    def __init__(self, almacen, intentos: int = 5, espera: float = 1.0, espera_max: float = 60.0,
+                 dormir=time.sleep):
+        self.almacen = almacen
+        self.intentos = max(1, intentos)
+        self.espera = espera
+        self.espera_max = espera_max
+        self.dormir = dormir
+        self.reintentos = 0
+        self.lecturas_paralelas = getattr(almacen, "lecturas_paralelas", 1)
+
+    def __repr__(self):
+        return f"ConReintentos({self.almacen!r})"
+
+    def _llamar(self, op: str, *args):
+        for intento in range(1, self.intentos + 1):
+            try:
+                return getattr(self.almacen, op)(*args)
+            except Exception as ex:
+                if intento >= self.intentos or not es_transitorio(ex):
+                    raise
+                espera = min(self.espera_max, self.espera * 2 ** (intento - 1))
+                self.reintentos += 1
+                print(f"[DEBUG] {op} falló ({ex}); reintento {intento} en {espera:.1f} s")
+                self.dormir(espera)
+
+    def put(self, nombre: str, data: bytes):
+        return self._llamar("put", nombre, data)
+
+    def get(self, nombre: str) -> bytes:
+        return self._llamar("get", nombre)
+
+    def listar(self, prefijo: str = "") -> list:
+        return self._llamar("listar", prefijo)
+
+    def borrar(self, nombre: str):
+        return self._llamar("borrar", nombre)
+
+    def exists(self, nombre: str) -> bool:
+        return self._llamar("exists", nombre)
+
+    def modificado(self, nombre: str):
+        return self._llamar("modificado", nombre)
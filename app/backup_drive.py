@@ -1,6 +1,10 @@
 # backup_drive.py
-import os, zipfile, datetime, time
+import os, io, time, datetime, threading
 from paths import load_config, save_config
+from backup_store import backup_incremental, CODECS, CODEC
+from almacenes import Almacen, CarpetaLocal, ConReintentos
+from tasks import TareaCancelada
+import catalogo
 
 
 try:
@@ -17,13 +21,51 @@ def _marcar_ultimo_backup(paths: dict):
     save_config(base_dir, cfg)
     print("[DEBUG] Último backup registrado en config.json")
 
-# PyDrive2 importada + client_secrets.json existe en la ruta que define paths.py
+def _carpeta_configurada(paths: dict) -> str:
+    """config.json "backup_carpeta": backups a una carpeta local/de red en vez de Drive."""
+    carpeta = load_config(paths["BASE_DIR"]).get("backup_carpeta")
+    return carpeta.strip() if isinstance(carpeta, str) else ""
+
+def _drive_disponible(paths: dict) -> bool:
+    return PYDRIVE_AVAILABLE and os.path.exists(paths["CLIENT_SECRETS"])
+
+# Carpeta configurada, o PyDrive2 importada + client_secrets.json en la ruta que define paths.py
 def can_backup(paths: dict) -> bool:
     print("[DEBUG] revisando si puede hacer backup")
-    return PYDRIVE_AVAILABLE and os.path.exists(paths["CLIENT_SECRETS"])
+    return bool(_carpeta_configurada(paths)) or _drive_disponible(paths)
 
-def backup_now(paths: dict):
-    if not can_backup(paths):
+# Cliente y almacén de Drive por proceso: autenticar y listar la carpeta una sola vez
+_CLIENTES = {}
+_ALMACENES = {}
+_CACHE_LOCK = threading.Lock()
+# Un backup a la vez (el automático y "Backup ahora" comparten el índice del almacén)
+_BACKUP_LOCK = threading.Lock()
+
+def _drive_client(paths: dict):
+    """Cliente de GoogleDrive del proceso; refresca el token si venció."""
+    token_file = paths["TOKEN_FILE"]
+    with _CACHE_LOCK:
+        cacheado = _CLIENTES.get(token_file)
+    if cacheado is not None:
+        gauth, drive = cacheado
+        if not gauth.access_token_expired:
+            return drive
+        try:
+            print("[DEBUG] Token expirado, refrescando")
+            gauth.Refresh()
+            gauth.SaveCredentialsFile(token_file)
+            return drive
+        except Exception as ex:
+            print("[DEBUG] No se pudo refrescar el token cacheado:", ex)
+    gauth = _autenticar(paths)
+    drive = GoogleDrive(gauth)
+    with _CACHE_LOCK:
+        _CLIENTES[token_file] = (gauth, drive)
+    return drive
+
+def _autenticar(paths: dict):
+    """Autentica (o refresca el token) y devuelve el GoogleAuth."""
+    if not _drive_disponible(paths):
         print("[DEBUG] client_secrets:", paths.get("CLIENT_SECRETS"))
         print("[DEBUG] token_file:", paths.get("TOKEN_FILE"))
         print("[DEBUG] base_dir:", paths.get("BASE_DIR"))
@@ -73,81 +115,187 @@ def backup_now(paths: dict):
     if not getattr(gauth.credentials, "refresh_token", None):
         raise RuntimeError("No refresh_token disponible. Revoque el acceso y autorice nuevamente con 'offline'.")
 
-    drive = GoogleDrive(gauth)
-    
-
-# Lógica zip (igual que antes)
-    zip_name = f"Backup_{datetime.datetime.now():%Y%m%d_%H%M%S}.zip"
-    zip_path = os.path.join(paths["BASE_DIR"], zip_name)
-    with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zf:
-        zf.write(paths["DB_NAME"], arcname=os.path.basename(paths["DB_NAME"]))
-        
-    q = f"title='{paths['DRIVE_FOLDER_NAME']}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
+    return gauth
+
+def _folder_id(drive, paths: dict) -> str:
+    """
+    Id de la carpeta de backups. Queda en config.json ("drive_folder") para no
+    buscarla por título en cada backup; si falla un backup se olvida (_olvidar_drive)
+    por si la borraron o movieron.
+    """
+    nombre = paths['DRIVE_FOLDER_NAME']
+    cfg = load_config(paths["BASE_DIR"])
+    guardada = cfg.get("drive_folder")
+    if isinstance(guardada, dict) and guardada.get("titulo") == nombre and guardada.get("id"):
+        return guardada["id"]
+
+    q = f"title='{nombre}' and mimeType='application/vnd.google-apps.folder' and trashed=false"
     flist = drive.ListFile({'q': q}).GetList()
     if flist:
         folder_id = flist[0]['id']
     else:
         folder = drive.CreateFile({
-            'title': paths['DRIVE_FOLDER_NAME'],
+            'title': nombre,
             'mimeType': 'application/vnd.google-apps.folder'
         })
         folder.Upload()
         folder_id = folder['id']
+    cfg = load_config(paths["BASE_DIR"])
+    cfg["drive_folder"] = {"titulo": nombre, "id": folder_id}
+    save_config(paths["BASE_DIR"], cfg)
+    return folder_id
 
+def _olvidar_drive(paths: dict):
+    with _CACHE_LOCK:
+        _ALMACENES.pop((paths["TOKEN_FILE"], paths["DRIVE_FOLDER_NAME"]), None)
+    cfg = load_config(paths["BASE_DIR"])
+    if cfg.pop("drive_folder", None) is not None:
+        save_config(paths["BASE_DIR"], cfg)
 
-    # Subida al Drive
-    f = drive.CreateFile({'title': zip_name, 'parents':[{'id': folder_id}]})
-    f.SetContentFile(zip_path)
-    f.Upload()
-    print("[DEBUG] Archivo subido a Drive:", zip_path)
-    _marcar_ultimo_backup(paths)
-    # Asegurar que todos los handles de archivo están cerrados → liberamos manualmente
+def _fecha_drive(valor):
+    """modifiedDate de Drive ("2024-05-10T12:34:56.789Z") a timestamp; None si no viene."""
     try:
-        del f  # eliminar referencia
-    except NameError:
-        pass
+        return datetime.datetime.fromisoformat(valor.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
 
-    # Intentar eliminar el zip local
-    try:
-        os.remove(zip_path)
-        print("[DEBUG] Archivo zip local eliminado:", zip_path)
-    except Exception as ex:
-        print("[DEBUG] Error al borrar localmente el zip:", zip_path, ex)
-        
+class DriveStore(Almacen):
+    """
+    Almacén sobre la carpeta de Drive. Drive no tiene carpetas anidadas baratas: el
+    nombre del objeto ("chunks/<hash>") va tal cual como título del archivo. Los
+    títulos se listan la primera vez que hacen falta y después se mantienen a mano.
+    put() de un título que ya está reemplaza el contenido de ese archivo (Drive
+    admite títulos repetidos: crear otro dejaría dos con el mismo nombre).
+    """
 
-def maybe_auto_backup(paths: dict, dias: int = 7):
-    
-    #
-    
-    if not can_backup(paths):
-        print("[DEBUG] No se puede hacer backup (falta PyDrive o client_secrets.json)")
-        return
+    lecturas_paralelas = 1   # el cliente http de PyDrive2 (httplib2) no es seguro entre hilos
 
-    today = datetime.date.today()
-    base_dir = paths["BASE_DIR"]
-    cfg = load_config(base_dir)
+    def __init__(self, drive, folder_id: str):
+        self.drive = drive
+        self.folder_id = folder_id
+        self._ids = None
+        self._fechas = {}
+        # put() que fallaron: la subida pudo haber llegado igual (p.ej. un timeout)
+        self._dudosos = set()
 
-    last_str = cfg.get("last_backup")
+    def __repr__(self):
+        return f"DriveStore({self.folder_id!r})"
 
-    if not last_str:
-        # Nunca se hizo backup → hacemos el primero ahora
-        print("[DEBUG] No hay registro de backup previo, ejecutando primero backup...")
-        backup_now(paths)
-        return
+    def _indice(self) -> dict:
+        if self._ids is None:
+            q = f"'{self.folder_id}' in parents and trashed=false"
+            archivos = self.drive.ListFile({'q': q}).GetList()
+            self._fechas = {f['title']: _fecha_drive(f.get('modifiedDate')) for f in archivos}
+            self._ids = {f['title']: f['id'] for f in archivos}
+        return self._ids
 
-    try:
-        last_date = datetime.date.fromisoformat(last_str)
-    except Exception:
-        # Si el dato está corrupto, forzamos backup
-        print("[DEBUG] Fecha de último backup inválida, forzando backup...")
-        backup_now(paths)
-        return
-
-    diff = (today - last_date).days
-    print(f"[DEBUG] Días desde el último backup: {diff}")
-
-    if diff >= dias:
-        print(f"[DEBUG] Pasaron {diff} días, toca backup automático")
-        backup_now(paths)
-    else:
-        print(f"[DEBUG] Aún no toca backup (faltan {dias - diff} días)")
+    def _buscar(self, nombre: str):
+        """id del archivo `nombre` en la carpeta según Drive (no según el índice), o None."""
+        titulo = nombre.replace("\\", "\\\\").replace("'", "\\'")
+        q = f"'{self.folder_id}' in parents and title='{titulo}' and trashed=false"
+        archivos = self.drive.ListFile({'q': q}).GetList()
+        return archivos[0]['id'] if archivos else None
+
+    def put(self, nombre: str, data: bytes):
+        file_id = self._indice().get(nombre)
+        if file_id is None and nombre in self._dudosos:
+            # Reintento: si el intento anterior llegó a crear el archivo, se reusa
+            file_id = self._buscar(nombre)
+        if file_id is None:
+            f = self.drive.CreateFile({'title': nombre, 'parents': [{'id': self.folder_id}]})
+        else:
+            f = self.drive.CreateFile({'id': file_id})
+        f.content = io.BytesIO(data)
+        self._dudosos.add(nombre)
+        f.Upload()
+        self._dudosos.discard(nombre)
+        self._indice()[nombre] = f['id']
+        self._fechas[nombre] = time.time()
+
+    def get(self, nombre: str) -> bytes:
+        f = self.drive.CreateFile({'id': self._indice()[nombre]})
+        f.FetchContent()
+        return f.content.getvalue()
+
+    def exists(self, nombre: str) -> bool:
+        return nombre in self._indice()
+
+    def modificado(self, nombre: str):
+        self._indice()
+        return self._fechas.get(nombre)
+
+    def listar(self, prefijo: str = "") -> list:
+        return sorted(t for t in self._indice() if t.startswith(prefijo))
+
+    def borrar(self, nombre: str):
+        file_id = self._indice().get(nombre)
+        if file_id is None:
+            return
+        self.drive.CreateFile({'id': file_id}).Delete()
+        self._indice().pop(nombre, None)
+        self._fechas.pop(nombre, None)
+
+def almacen_drive(paths: dict) -> DriveStore:
+    """El DriveStore del proceso (cliente autenticado e índice de la carpeta reusados)."""
+    clave = (paths["TOKEN_FILE"], paths["DRIVE_FOLDER_NAME"])
+    with _CACHE_LOCK:
+        store = _ALMACENES.get(clave)
+    drive = _drive_client(paths)
+    if store is None or store.drive is not drive:
+        store = DriveStore(drive, _folder_id(drive, paths))
+        with _CACHE_LOCK:
+            _ALMACENES[clave] = store
+    return store
+
+def almacen_backup(paths: dict) -> Almacen:
+    """Destino de backup_now: la carpeta de config.json "backup_carpeta" o Drive, con reintentos."""
+    carpeta = _carpeta_configurada(paths)
+    if carpeta:
+        return ConReintentos(CarpetaLocal(carpeta))
+    return ConReintentos(almacen_drive(paths))
+
+def _compresion(paths: dict) -> dict:
+    """config.json "backup_codec" ("deflate" | "lzma" | "bz2") y "backup_nivel"."""
+    cfg = load_config(paths["BASE_DIR"])
+    codec = cfg.get("backup_codec", CODEC)
+    if codec not in CODECS:
+        print("[DEBUG] backup_codec desconocido, uso", CODEC, codec)
+        codec = CODEC
+    nivel = cfg.get("backup_nivel")
+    return {"codec": codec, "nivel": nivel if isinstance(nivel, int) and 1 <= nivel <= 9 else None}
+
+def backup_now(paths: dict, progress=None):
+    """
+    Backup incremental de la BD (ver backup_store.py) en la carpeta de Drive, o en la
+    de config.json "backup_carpeta": sólo se suben los bloques que cambiaron desde el
+    último backup más un manifiesto chico. Los errores de red se reintentan, y si
+    el backup se corta, el próximo sigue desde donde quedó (sesión en BASE_DIR).
+    `progress(frac, msg)` (opcional) recibe el avance por etapa; si lanza una
+    excepción (p.ej. TareaCancelada) el backup se corta ahí.
+    """
+    progress = progress or (lambda frac=None, msg=None: None)
+    if not can_backup(paths):
+        raise RuntimeError("No está disponible PyDrive2 o falta client_secrets.json")
+    with _BACKUP_LOCK:
+        progress(0.05, "Conectando con el destino del backup…")
+        store = almacen_backup(paths)
+        try:
+            rep = backup_incremental(paths["DB_NAME"], store,
+                                     progress=lambda frac=None, msg=None: progress(0.1 + 0.9 * (frac or 0), msg),
+                                     sesion_dir=paths["BASE_DIR"], **_compresion(paths))
+        except Exception as ex:
+            if not isinstance(ex, TareaCancelada) and not _carpeta_configurada(paths):
+                _olvidar_drive(paths)
+            raise
+        catalogo.registrar(paths, rep, repr(store))
+        try:
+            progress(None, "Aplicando la retención…")
+            catalogo.podar(paths, store)
+        except TareaCancelada:
+            pass
+        except Exception as ex:
+            # El backup ya está guardado: si la limpieza falla se reintenta en el próximo
+            print("[DEBUG] No se pudo aplicar la retención:", ex)
+    print("[DEBUG] Backup guardado:", rep["id"], store)
+    _marcar_ultimo_backup(paths)
+    return rep
@@ -0,0 +1,351 @@
+# backup_store.py
+"""
+Backups incrementales: el snapshot de la BD (snapshot.py) se corta en bloques de
+CHUNK_BYTES alineados a páginas de SQLite; cada bloque se guarda una sola vez,
+comprimido y con su hash como nombre, y cada snapshot es un manifiesto chico con
+la lista de bloques. Como SQLite modifica páginas en su lugar (no corre los datos),
+una semana con pocas historias nuevas sube unos pocos MB en vez de la BD entera.
+
+Dónde se guardan los objetos lo decide el almacén (almacenes.py: carpeta, Drive,
+memoria):
+
+    chunks/<sha256>          bloque comprimido (zlib)
+    snapshots/<id>.json      manifiesto: bloques en orden, tamaño y hash del .db
+
+    rep = backup_incremental(paths["DB_NAME"], CarpetaLocal(paths["BACKUPS_DIR"]))
+    restaurar(CarpetaLocal(paths["BACKUPS_DIR"]), rep["id"], "/tmp/restaurada.db")
+
+También por consola: python backup_store.py backup|listar|restaurar ...
+"""
+import os
+import sys
+import json
+import bz2
+import zlib
+import lzma
+import time
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import tempfile
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from snapshot import tomar_snapshot, integridad
+from almacenes import CarpetaLocal
+
+CHUNK_BYTES = 64 * 1024   # 16 páginas de 4 KB: cambiar una historia toca ~80 páginas dispersas
+FORMATO = 1
+SESION_NAME = "backup_sesion"   # .json + .db en sesion_dir mientras un backup no terminó
+SESION_MAX_H = 24               # una sesión más vieja se descarta y se toma un snapshot nuevo
+
+# Compresión de cada bloque: (comprimir(data, nivel), nivel por defecto). Al leer no
+# hace falta saber cuál se usó: cada formato se reconoce por sus primeros bytes.
+CODECS = {
+    "deflate": (lambda data, nivel: zlib.compress(data, nivel), 6),
+    "lzma":    (lambda data, nivel: lzma.compress(data, preset=nivel), 6),
+    "bz2":     (lambda data, nivel: bz2.compress(data, nivel), 9),
+}
+CODEC = "deflate"
+
+class BackupError(RuntimeError):
+    """Un snapshot no se puede reconstruir (falta un bloque o no coincide su hash)."""
+
+def _descomprimir(blob: bytes) -> bytes:
+    if blob.startswith(b"\xfd7zXZ\x00"):
+        return lzma.decompress(blob)
+    if blob.startswith(b"BZh"):
+        return bz2.decompress(blob)
+    return zlib.decompress(blob)
+
+FILAS_TABLAS = ("historias", "consultas")   # se cuentan en cada snapshot (catálogo)
+
+def contar_filas(db_path: str) -> dict:
+    """{tabla: filas} de FILAS_TABLAS en un .db (las que existan)."""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        tablas = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        return {t: conn.execute(f"SELECT count(*) FROM {t}").fetchone()[0] for t in FILAS_TABLAS if t in tablas}
+    finally:
+        conn.close()
+
+def _chunk_name(h: str) -> str:
+    return f"chunks/{h}"
+
+def _snapshot_name(snap_id: str) -> str:
+    return f"snapshots/{snap_id}.json"
+
+# ------------------------- sesión (backup a medias) -------------------------
+def _sesion_paths(sesion_dir: str):
+    base = os.path.join(sesion_dir, SESION_NAME)
+    return base + ".json", base + ".db"
+
+def _leer_sesion(sesion_dir: str, db_path: str, chunk_bytes: int):
+    """La sesión guardada si sirve para retomar (misma BD, mismo tamaño de bloque, reciente)."""
+    sesion_json, snap_path = _sesion_paths(sesion_dir)
+    try:
+        with open(sesion_json, "r", encoding="utf-8") as f:
+            sesion = json.load(f)
+        ok = (sesion.get("db") == os.path.abspath(db_path)
+              and sesion.get("chunk_bytes") == chunk_bytes
+              and time.time() - sesion.get("inicio", 0) < SESION_MAX_H * 3600
+              and os.path.getsize(snap_path) == sesion.get("bytes"))
+    except (OSError, ValueError, AttributeError):
+        ok = False
+    if ok:
+        return sesion
+    _borrar_sesion(sesion_dir)
+    return None
+
+def _guardar_sesion(sesion_dir: str, sesion: dict):
+    sesion_json, _ = _sesion_paths(sesion_dir)
+    with open(sesion_json + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(sesion, f)
+    os.replace(sesion_json + ".tmp", sesion_json)
+
+def _borrar_sesion(sesion_dir: str):
+    for path in _sesion_paths(sesion_dir):
+        if os.path.exists(path):
+            os.remove(path)
+
+# ------------------------- backup -------------------------
+def backup_incremental(db_path: str, store, progress=None, chunk_bytes: int = CHUNK_BYTES,
+                       tmp_dir: str | None = None, codec: str = CODEC, nivel: int | None = None,
+                       sesion_dir: str | None = None) -> dict:
+    """
+    Snapshot verificado de `db_path` guardado en `store` subiendo sólo los bloques nuevos.
+    Cada bloque se comprime y se sube apenas se lee: no se arma ningún .zip.
+
+    codec: "deflate" | "lzma" | "bz2"; nivel: el del codec (None = por defecto).
+    progress(frac, msg) opcional; si lanza una excepción (p.ej. TareaCancelada) se corta.
+
+    Con `sesion_dir` el backup se puede retomar: el snapshot queda ahí hasta que se
+    sube el manifiesto, y si se corta (red, cancelación, cierre de la app) la próxima
+    llamada sigue con ese mismo snapshot y no vuelve a subir los bloques que ya
+    llegaron. Sin `sesion_dir` el snapshot va a un temporal en `tmp_dir` y se borra.
+    Devuelve {"id", "creado", "bytes", "sha256", "filas", "chunks", "nuevos", "bytes_subidos",
+    "retomado", "codec", "segundos"}.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Codec desconocido: {codec!r} (opciones: {', '.join(CODECS)})")
+    comprimir, nivel_def = CODECS[codec]
+    nivel = nivel_def if nivel is None else nivel
+    progress = progress or (lambda frac=None, msg=None: None)
+    t0 = time.perf_counter()
+
+    sesion = _leer_sesion(sesion_dir, db_path, chunk_bytes) if sesion_dir else None
+    retomado = sesion is not None
+    chunks, nuevos, subidos = [], 0, 0
+    if sesion_dir:
+        snap_path = _sesion_paths(sesion_dir)[1]
+    else:
+        fd, snap_path = tempfile.mkstemp(suffix=".db", prefix="snapshot_", dir=tmp_dir)
+        os.close(fd)
+    completo = False
+    try:
+        if sesion:
+            print(f"[DEBUG] Retomando backup {sesion['id']} ({sesion['hechos']} bloques ya recorridos)")
+            progress(0.4, "Retomando backup interrumpido…")
+        else:
+            snap_id = f"{datetime.datetime.now():%Y%m%d_%H%M%S}"
+            while store.exists(_snapshot_name(snap_id)):
+                snap_id += "b"
+            snap = tomar_snapshot(db_path, snap_path,
+                                  progress=lambda frac=None, msg=None: progress(0.4 * (frac or 0), msg))
+            sesion = {"id": snap_id, "db": os.path.abspath(db_path), "bytes": snap["bytes"],
+                      "chunk_bytes": chunk_bytes, "inicio": time.time(),
+                      "creado": datetime.datetime.now().isoformat(timespec="seconds"), "hechos": 0,
+                      "filas": contar_filas(snap_path)}
+            if sesion_dir:
+                _guardar_sesion(sesion_dir, sesion)
+        snap_id = sesion["id"]
+
+        progress(0.4, "Buscando bloques ya guardados…")
+        existentes = {n.rsplit("/", 1)[-1] for n in store.listar("chunks/")}
+
+        total = hashlib.sha256()
+        n_chunks = max(1, -(-sesion["bytes"] // chunk_bytes))
+        with open(snap_path, "rb") as f:
+            while True:
+                data = f.read(chunk_bytes)
+                if not data:
+                    break
+                total.update(data)
+                h = hashlib.sha256(data).hexdigest()
+                chunks.append(h)
+                if h not in existentes:
+                    blob = comprimir(data, nivel)
+                    store.put(_chunk_name(h), blob)
+                    existentes.add(h)
+                    nuevos += 1
+                    subidos += len(blob)
+                    if sesion_dir and nuevos % 64 == 0:
+                        sesion["hechos"] = max(sesion["hechos"], len(chunks))
+                        _guardar_sesion(sesion_dir, sesion)
+                progress(0.4 + 0.55 * len(chunks) / n_chunks,
+                         f"Bloque {len(chunks)} de {n_chunks} ({nuevos} nuevos)")
+
+        manifiesto = {
+            "formato": FORMATO,
+            "id": snap_id,
+            "creado": sesion["creado"],
+            "db": os.path.basename(db_path),
+            "bytes": sesion["bytes"],
+            "sha256": total.hexdigest(),
+            "chunk_bytes": chunk_bytes,
+            "codec": codec,
+            "filas": sesion.get("filas", {}),
+            "chunks": chunks,
+        }
+        store.put(_snapshot_name(snap_id), json.dumps(manifiesto).encode("utf-8"))
+        completo = True
+    except BaseException:
+        if sesion_dir and sesion:
+            sesion["hechos"] = max(sesion["hechos"], len(chunks))
+            _guardar_sesion(sesion_dir, sesion)
+            print(f"[DEBUG] Backup {sesion['id']} interrumpido; se retoma en el próximo intento")
+        raise
+    finally:
+        if completo and sesion_dir:
+            _borrar_sesion(sesion_dir)
+        elif not sesion_dir and os.path.exists(snap_path):
+            os.remove(snap_path)
+        elif sesion_dir and not sesion and os.path.exists(snap_path):
+            os.remove(snap_path)   # falló el snapshot: no hay nada que retomar
+
+    rep = {"id": snap_id, "creado": sesion["creado"], "bytes": sesion["bytes"], "sha256": manifiesto["sha256"],
+           "filas": manifiesto["filas"], "chunks": len(chunks), "nuevos": nuevos,
+           "bytes_subidos": subidos, "retomado": retomado, "codec": codec,
+           "segundos": time.perf_counter() - t0}
+    progress(1.0, f"Backup listo: {nuevos} bloques nuevos de {len(chunks)}")
+    print(f"[DEBUG] Backup incremental {snap_id} ({codec}): {nuevos}/{len(chunks)} bloques nuevos, "
+          f"{subidos / 1e6:.2f} MB subidos de {sesion['bytes'] / 1e6:.1f} MB, {rep['segundos']:.1f} s")
+    return rep
+
+# ------------------------- snapshots y restauración -------------------------
+def leer_manifiesto(store, snap_id: str) -> dict:
+    return json.loads(store.get(_snapshot_name(snap_id)).decode("utf-8"))
+
+def listar_snapshots(store) -> list:
+    """Manifiestos (sin la lista de bloques) del más viejo al más nuevo."""
+    out = []
+    for nombre in store.listar("snapshots/"):
+        if not nombre.endswith(".json"):
+            continue
+        m = leer_manifiesto(store, nombre[len("snapshots/"):-len(".json")])
+        m["n_chunks"] = len(m.pop("chunks", []))
+        out.append(m)
+    return sorted(out, key=lambda m: m["id"])
+
+def restaurar(store, snap_id: str, dest: str, progress=None) -> dict:
+    """
+    Reconstruye el snapshot `snap_id` en `dest` verificando cada bloque, el hash del
+    archivo completo y PRAGMA integrity_check. Lanza BackupError si algo no coincide;
+    `dest` sólo se escribe si todo está bien.
+    Devuelve {"id", "path", "bytes", "segundos"}.
+    """
+    progress = progress or (lambda frac=None, msg=None: None)
+    t0 = time.perf_counter()
+    man = leer_manifiesto(store, snap_id)
+    tmp = dest + ".parcial"
+    total = hashlib.sha256()
+
+    def bajar(h):
+        try:
+            data = _descomprimir(store.get(_chunk_name(h)))
+        except Exception as ex:
+            raise BackupError(f"No se pudo leer el bloque {h[:12]}… del snapshot {snap_id}: {ex}")
+        if hashlib.sha256(data).hexdigest() != h:
+            raise BackupError(f"El bloque {h[:12]}… del snapshot {snap_id} está dañado")
+        return data
+
+    # Descargas en paralelo si el almacén lo soporta, con una ventana acotada de
+    # bloques en memoria; se escriben en orden
+    hilos = max(1, getattr(store, "lecturas_paralelas", 1))
+    pool = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="restaurar")
+    try:
+        with open(tmp, "wb") as f:
+            n = len(man["chunks"])
+            pendientes = deque()
+            siguientes = iter(man["chunks"])
+            for h in itertools.islice(siguientes, 2 * hilos):
+                pendientes.append(pool.submit(bajar, h))
+            i = 0
+            while pendientes:
+                data = pendientes.popleft().result()
+                h = next(siguientes, None)
+                if h is not None:
+                    pendientes.append(pool.submit(bajar, h))
+                total.update(data)
+                f.write(data)
+                i += 1
+                progress(0.8 * i / n, f"Bloque {i} de {n}")
+        if os.path.getsize(tmp) != man["bytes"] or total.hexdigest() != man["sha256"]:
+            raise BackupError(f"El snapshot {snap_id} reconstruido no coincide con su manifiesto")
+
+        progress(0.8, "Verificando integridad…")
+        conn = sqlite3.connect(tmp)
+        try:
+            problemas = integridad(conn)
+        finally:
+            conn.close()
+        if problemas:
+            raise BackupError(f"El snapshot {snap_id} no pasó integrity_check: " + "; ".join(problemas[:5]))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    os.replace(tmp, dest)
+    progress(1.0, "Snapshot restaurado")
+    return {"id": snap_id, "path": dest, "bytes": man["bytes"], "segundos": time.perf_counter() - t0}
+
+# ------------------------- consola -------------------------
+def _store_desde_args(args):
+    if args.drive:
+        from paths import get_paths
+        from backup_drive import almacen_drive
+        return almacen_drive(get_paths())
+    if not args.repo:
+        from paths import get_paths
+        return CarpetaLocal(get_paths()["BACKUPS_DIR"])
+    return CarpetaLocal(args.repo)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Backups incrementales de la BD")
+    ap.add_argument("--repo", help="carpeta del repositorio (por defecto BACKUPS_DIR)")
+    ap.add_argument("--drive", action="store_true", help="usar la carpeta de Google Drive")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("backup", help="snapshot incremental de la BD")
+    p.add_argument("--db", help="archivo .db (por defecto el de la app)")
+    p.add_argument("--codec", choices=sorted(CODECS), default=CODEC)
+    p.add_argument("--nivel", type=int, help="nivel de compresión (1-9)")
+    sub.add_parser("listar", help="snapshots guardados")
+    p = sub.add_parser("restaurar", help="reconstruir un snapshot en un archivo")
+    p.add_argument("id")
+    p.add_argument("dest")
+
+    args = ap.parse_args(argv)
+    store = _store_desde_args(args)
+    if args.cmd == "backup":
+        if args.db:
+            db_path = args.db
+        else:
+            from paths import get_paths
+            db_path = get_paths()["DB_NAME"]
+        rep = backup_incremental(db_path, store, codec=args.codec, nivel=args.nivel)
+        print(f"{rep['id']}: {rep['nuevos']} de {rep['chunks']} bloques nuevos, "
+              f"{rep['bytes_subidos'] / 1e6:.2f} MB guardados ({rep['segundos']:.1f} s)")
+    elif args.cmd == "listar":
+        for m in listar_snapshots(store):
+            print(f"{m['id']}  {m['creado']}  {m['bytes'] / 1e6:8.1f} MB  {m['n_chunks']} bloques")
+    elif args.cmd == "restaurar":
+        rep = restaurar(store, args.id, args.dest)
+        print(f"{rep['id']} restaurado en {rep['path']} ({rep['bytes'] / 1e6:.1f} MB, {rep['segundos']:.1f} s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
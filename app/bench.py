@@ -0,0 +1,447 @@
+# bench.py
+"""
+Pruebas de carga y mediciones de rendimiento (no forman parte de la app).
+
+    python bench.py sesiones --db /tmp/carga.db --sesiones 3 --ops 200
+    python bench.py render --filas 1000 10000 50000
+    python bench.py planes --db consultorio.db
+    python bench.py pdf --n 50
+    python bench.py backup --db consultorio.db --latencia-ms 20 --fallas 0.05
+    python bench.py codecs --db consultorio.db --mbps 10
+    python bench.py export --filas 100 500000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+from db import (
+    open_database, insertar_historia, listar_pagina, buscar_texto, obtener_historia, iter_consultas,
+    explicar_pagina, close_database,
+)
+
+_PALABRAS = ("hipertensión", "diabetes", "control", "dolor", "artrosis", "marcha", "caída", "memoria")
+
+def _datos_paciente(n: int) -> dict:
+    return {
+        "nombre": f"Paciente {n} {random.choice(('González', 'Pérez', 'Núñez', 'Gómez'))}",
+        "dni": str(10_000_000 + n),
+        "edad": str(60 + n % 40),
+        "domicilio": "", "obra_social": random.choice(("PAMI", "IOSFA", "OSDE")),
+        "numero_beneficio": "", "telefono": "", "email": "",
+        "antecedentes_personales": " ".join(random.choices(_PALABRAS, k=8)),
+        "antecedentes_familiares": "", "examen_fisico": "", "diagnostico_presuntivo": "",
+        "evolucion_seguimiento": "Control " + random.choice(_PALABRAS),
+        "motivo_consulta": "Control",
+    }
+
+def carga_sesiones(db_path: str, sesiones: int = 3, ops: int = 200, pdf: bool = True) -> dict:
+    """
+    Simula `sesiones` consultorios en paralelo contra un mismo archivo: cada uno
+    alterna búsquedas, altas y (si hay fpdf2) PDFs, con su propia sesión de BD.
+    Devuelve {"ops", "errores", "segundos", "ops_por_seg", "por_tipo"}.
+    """
+    database = open_database(db_path)
+    pdfs_dir = tempfile.mkdtemp(prefix="consultorio_pdfs_")
+    if pdf:
+        try:
+            from pdf_utils import generar_pdf
+        except ImportError:
+            pdf = False
+
+    contador = {"n": int(time.time() * 1000) % 1_000_000 * 1000}
+    lock = threading.Lock()
+    errores, tiempos = [], {"buscar": [], "guardar": [], "pdf": []}
+
+    def sesion(sid: int):
+        db = database.session(f"carga-{sid}")
+        try:
+            for i in range(ops):
+                tipo = ("buscar", "guardar", "pdf" if pdf else "buscar")[i % 3]
+                t0 = time.perf_counter()
+                try:
+                    if tipo == "buscar":
+                        cur = db.reader().cursor()
+                        listar_pagina(cur, "nombre", None, 200, "nombre", random.choice(("gon", "per", "nu")))
+                        buscar_texto(cur, random.choice(_PALABRAS))
+                    elif tipo == "guardar":
+                        with lock:
+                            contador["n"] += 1
+                            n = contador["n"]
+                        with db.transaction() as cur:
+                            insertar_historia(cur, _datos_paciente(n))
+                    else:
+                        cur = db.reader().cursor()
+                        rows, _ = listar_pagina(cur, "id", None, 1)
+                        if rows:
+                            row = obtener_historia(cur, rows[0][0])
+                            generar_pdf({"PDFS_DIR": pdfs_dir, "BASE_DIR": os.path.dirname(__file__)},
+                                        row, list(iter_consultas(cur, row[0])), cache=False)
+                except Exception as ex:
+                    errores.append((sid, tipo, repr(ex)))
+                tiempos[tipo].append(time.perf_counter() - t0)
+        finally:
+            db.close_all()
+
+    t0 = time.perf_counter()
+    hilos = [threading.Thread(target=sesion, args=(s,)) for s in range(sesiones)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+    total = time.perf_counter() - t0
+
+    por_tipo = {
+        k: {"n": len(v), "ms_prom": 1000 * sum(v) / len(v), "ms_max": 1000 * max(v)}
+        for k, v in tiempos.items() if v
+    }
+    return {
+        "ops": sesiones * ops, "errores": errores, "segundos": total,
+        "ops_por_seg": sesiones * ops / total if total else 0.0, "por_tipo": por_tipo,
+    }
+
+def _filas_lista(n: int) -> list:
+    """Filas con el formato de db.listar_pagina (LIST_COLUMNS + nombre_norm)."""
+    return [(i, f"Paciente {i}", str(10_000_000 + i), 70 + i % 30, "PAMI", f"B-{i}", "362 4000000",
+             "Control", f"paciente {i}") for i in range(1, n + 1)]
+
+def render_tabla(tamanos=(1_000, 10_000, 50_000)) -> list:
+    """
+    Tiempo de armar la tabla y serializarla para el cliente Flet (los comandos que
+    viajan en page.update()): DataTable vieja vs. PatientList virtualizada, más lo
+    que cuesta rellenar la ventana de filas al desplazarse.
+    Devuelve [{"filas", "datatable_ms", "datatable_cmds", "lista_ms", "lista_cmds", "scroll_ms"}, ...].
+    """
+    import flet as ft
+    from ui import PatientList, HEADERS, ROW_HEIGHT
+
+    def datatable(rows):
+        t = ft.DataTable(columns=[ft.DataColumn(ft.Text(HEADERS[c])) for c in
+                                  ("nombre", "dni", "edad", "obra_social", "numero_beneficio", "telefono", "motivo_consulta")])
+        for r in rows:
+            t.rows.append(ft.DataRow(cells=[
+                ft.DataCell(ft.Text(str(r[i] or "")), on_tap=lambda e, v=r: None) for i in range(1, 8)
+            ]))
+        return t
+
+    class _Scroll:
+        def __init__(self, pixels):
+            self.pixels = pixels
+
+    out = []
+    for n in tamanos:
+        rows = _filas_lista(n)
+
+        t0 = time.perf_counter()
+        cmds_dt = len(datatable(rows)._build_add_commands())
+        dt_ms = 1000 * (time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        lista = PatientList(on_select=lambda row_id: None)
+        lista.set_rows(rows)
+        cmds_l = len(lista.view._build_add_commands())
+        l_ms = 1000 * (time.perf_counter() - t0)
+
+        # Desplazamiento: 100 saltos por la lista reciclando la misma ventana
+        lista.view.update = lambda: None  # sin página no hay nada que enviar
+        t0 = time.perf_counter()
+        for k in range(100):
+            lista._on_scroll(_Scroll(k * (n // 100) * ROW_HEIGHT))
+        scroll_ms = 1000 * (time.perf_counter() - t0) / 100
+
+        out.append({"filas": n, "datatable_ms": dt_ms, "datatable_cmds": cmds_dt,
+                    "lista_ms": l_ms, "lista_cmds": cmds_l, "scroll_ms": scroll_ms})
+    return out
+
+# Combinaciones de filtros y orden de la lista que tienen que resolverse con índices
+PLANES = (
+    ("id", {}, False),
+    ("nombre", {}, False),
+    ("dni", {}, True),
+    ("edad", {}, True),
+    ("obra_social", {}, False),
+    ("nombre", {"obra_social": "PAMI", "edad_min": "80"}, False),
+    ("id", {"obra_social": "PAMI"}, True),
+    ("edad", {"edad_min": "80", "edad_max": "90"}, False),
+    ("id", {"dni": "10.000.12"}, False),   # DNI completo: rango; uno parcial recorre la tabla
+    ("nombre", {"creado_desde": "2024-01-01", "creado_hasta": "2024-01-31"}, False),
+    ("id", {"texto": "hipertension"}, False),
+)
+
+def revisar_planes(db_path: str) -> list:
+    """
+    EXPLAIN QUERY PLAN de cada combinación de PLANES (primera página y siguientes).
+    Devuelve [{"orden", "filtros", "desc", "plan": [...], "ms", "ok"}, ...]; ok es False
+    si alguna lectura de `historias` recorre la tabla sin índice.
+    """
+    cur = open_database(db_path).reader().cursor()
+    out = []
+    for order, filtros, desc in PLANES:
+        t0 = time.perf_counter()
+        rows, after = listar_pagina(cur, order, None, 200, filtros=filtros, desc=desc)
+        ms = 1000 * (time.perf_counter() - t0)
+        plan = explicar_pagina(cur, order, filtros=filtros, desc=desc, after=after)
+        ok = not any(p.startswith("SCAN historias") and "INDEX" not in p for p in plan)
+        out.append({"orden": order + (" desc" if desc else ""), "filtros": filtros,
+                    "plan": plan, "ms": ms, "ok": ok})
+    return out
+
+def latencia_pdf(n: int = 50, base_dir: str | None = None, logo: str = "") -> dict:
+    """
+    ms por PDF generando `n` historias: "antes" carga fuentes y logo en cada
+    documento (un RenderContext nuevo, como hacía generar_pdf), "despues" usa el
+    compartido del proceso. Devuelve {"n", "unicode", "logo", "antes_ms", "despues_ms"}.
+    """
+    from pdf_utils import generar_pdf, RenderContext, render_context
+
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    paths = {"PDFS_DIR": tempfile.mkdtemp(prefix="consultorio_pdfs_"), "BASE_DIR": base_dir, "LOGO_PATH": logo}
+    filas = []
+    for i in range(n):
+        d = _datos_paciente(i)
+        filas.append([i, d["nombre"], d["dni"], d["edad"], d["domicilio"], d["obra_social"], d["numero_beneficio"],
+                      d["telefono"], d["email"], d["antecedentes_personales"], d["antecedentes_familiares"],
+                      d["examen_fisico"], d["diagnostico_presuntivo"], d["evolucion_seguimiento"],
+                      d["motivo_consulta"]])
+    consultas = [(1, "2024-03-05", "Control " + " ".join(_PALABRAS))]
+
+    t0 = time.perf_counter()
+    for row in filas:
+        generar_pdf(paths, row, consultas, ctx=RenderContext(base_dir, logo), cache=False)
+    antes = 1000 * (time.perf_counter() - t0) / n
+
+    ctx = render_context(paths)
+    t0 = time.perf_counter()
+    for row in filas:
+        generar_pdf(paths, row, consultas, cache=False)
+    despues = 1000 * (time.perf_counter() - t0) / n
+    return {"n": n, "unicode": ctx.unicode_ok, "logo": ctx.logo_ok,
+            "antes_ms": antes, "despues_ms": despues}
+
+def backup_offline(db_path: str, latencia_ms: float = 20.0, fallas: float = 0.0, cambios: int = 3) -> dict:
+    """
+    Backup incremental contra un almacén en memoria con latencia y fallas simuladas
+    (sin red): backup completo, `cambios` historias modificadas, segundo backup y
+    restauración verificada del segundo. La BD original no se toca (se usa una copia).
+    Devuelve {"completo", "incremental", "restaurar_s", "reintentos", "fallas"}.
+    """
+    import shutil
+    import sqlite3
+    from almacenes import EnMemoria, ConReintentos
+    from backup_store import backup_incremental, restaurar
+
+    tmp = tempfile.mkdtemp(prefix="consultorio_backup_")
+    copia = os.path.join(tmp, "bench.db")
+    shutil.copyfile(db_path, copia)
+    memoria = EnMemoria(latencia=latencia_ms / 1000, fallas=fallas, semilla=1)
+    store = ConReintentos(memoria, intentos=8, espera=0.01)
+    try:
+        completo = backup_incremental(copia, store, tmp_dir=tmp)
+        completo["puts"] = memoria.ops["put"]
+
+        conn = sqlite3.connect(copia)
+        ids = [r[0] for r in conn.execute("SELECT id FROM historias ORDER BY random() LIMIT ?", (cambios,))]
+        conn.executemany("UPDATE historias SET domicilio = coalesce(domicilio, '') || ' (bench)' WHERE id = ?",
+                         [(i,) for i in ids])
+        conn.commit()
+        conn.close()
+        time.sleep(1)   # ids de snapshot por segundo
+
+        puts = memoria.ops["put"]
+        incremental = backup_incremental(copia, store, tmp_dir=tmp)
+        incremental["puts"] = memoria.ops["put"] - puts
+
+        rest = restaurar(store, incremental["id"], os.path.join(tmp, "restaurada.db"))
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return {"completo": completo, "incremental": incremental, "restaurar_s": rest["segundos"],
+            "reintentos": store.reintentos, "fallas": memoria.ops["fallas"]}
+
+def comparar_codecs(db_path: str, codecs=("deflate:1", "deflate:6", "deflate:9", "lzma:1", "lzma:6", "bz2:9"),
+                    mbps: float = 10.0) -> list:
+    """
+    Compresión de los bloques de un snapshot de `db_path` con cada "codec:nivel":
+    MB resultantes, segundos comprimiendo/descomprimiendo y el tiempo estimado de un
+    backup completo subiendo a `mbps` megabits por segundo.
+    """
+    import hashlib
+    from snapshot import tomar_snapshot
+    from backup_store import CODECS, CHUNK_BYTES, _descomprimir
+
+    tmp = tempfile.mkdtemp(prefix="consultorio_codecs_")
+    snap = os.path.join(tmp, "snap.db")
+    try:
+        tomar_snapshot(db_path, snap)
+        bloques = {}
+        with open(snap, "rb") as f:
+            while True:
+                data = f.read(CHUNK_BYTES)
+                if not data:
+                    break
+                bloques.setdefault(hashlib.sha256(data).hexdigest(), data)
+        total = os.path.getsize(snap)
+    finally:
+        for n in os.listdir(tmp):
+            os.remove(os.path.join(tmp, n))
+        os.rmdir(tmp)
+
+    out = []
+    for spec in codecs:
+        codec, _, nivel = spec.partition(":")
+        comprimir, nivel_def = CODECS[codec]
+        nivel = int(nivel) if nivel else nivel_def
+        t0 = time.perf_counter()
+        blobs = [comprimir(data, nivel) for data in bloques.values()]
+        comp_s = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for b in blobs:
+            _descomprimir(b)
+        desc_s = time.perf_counter() - t0
+        mb = sum(len(b) for b in blobs) / 1e6
+        out.append({"codec": f"{codec}:{nivel}", "db_mb": total / 1e6, "mb": mb,
+                    "comprimir_s": comp_s, "descomprimir_s": desc_s,
+                    "backup_s": comp_s + mb * 8 / mbps})
+    return out
+
+def _bd_sintetica(db_path: str, n: int):
+    """BD con el esquema de la app y `n` historias generadas en SQL (rápido aun para 500k)."""
+    database = open_database(db_path)
+    with database.transaction() as cur:
+        cur.execute("""
+            WITH RECURSIVE s(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM s WHERE i < ?)
+            INSERT INTO historias (nombre, dni, edad, domicilio, obra_social, telefono, email,
+                                   antecedentes_personales, motivo_consulta, dni_norm, nombre_norm,
+                                   created_at, updated_at)
+            SELECT 'Paciente ' || i || ' Núñez', 10000000 + i, 60 + i % 40, 'Calle ' || i,
+                   CASE i % 3 WHEN 0 THEN 'PAMI' WHEN 1 THEN 'IOSFA' ELSE 'OSDE' END,
+                   '11-4000-' || i, 'p' || i || '@mail.com',
+                   'hipertensión; "control" cada 3 meses, dolor <lumbar> & artrosis', 'Control',
+                   10000000 + i, 'paciente ' || i || ' nunez', datetime('now'), datetime('now')
+            FROM s""", (n,))
+
+def memoria_export(tamanos=(100, 500_000), formatos=("csv", "jsonl", "xlsx")) -> list:
+    """
+    Pico de memoria de Python (tracemalloc) y velocidad de exporter.exportar para
+    BDs sintéticas de cada tamaño y cada formato: con streaming el pico no debe
+    crecer con la cantidad de historias.
+    """
+    import shutil
+    import tracemalloc
+    from exporter import exportar
+
+    out = []
+    tmp = tempfile.mkdtemp(prefix="consultorio_export_")
+    try:
+        for n in tamanos:
+            db_path = os.path.join(tmp, f"bench_{n}.db")
+            _bd_sintetica(db_path, n)
+            database = open_database(db_path)
+            try:
+                for formato in formatos:
+                    destino = os.path.join(tmp, f"export_{n}.{formato}")
+                    tracemalloc.start()
+                    rep = exportar(database.reader().cursor(), destino)
+                    pico = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    out.append({"filas": rep["filas"], "formato": formato, "pico_mb": pico / 1e6,
+                                "mb": rep["bytes"] / 1e6, "segundos": rep["segundos"],
+                                "filas_por_seg": rep["filas"] / max(rep["segundos"], 1e-9)})
+                    os.remove(destino)
+            finally:
+                close_database(db_path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return out
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("sesiones", help="N sesiones concurrentes: búsqueda, alta y PDF")
+    p.add_argument("--db", required=True)
+    p.add_argument("--sesiones", type=int, default=3)
+    p.add_argument("--ops", type=int, default=200)
+    p.add_argument("--sin-pdf", action="store_true")
+
+    p = sub.add_parser("render", help="armado + serialización de la tabla para 1k/10k/50k filas")
+    p.add_argument("--filas", type=int, nargs="*", default=[1_000, 10_000, 50_000])
+
+    p = sub.add_parser("planes", help="EXPLAIN QUERY PLAN de los filtros/órdenes de la lista")
+    p.add_argument("--db", required=True)
+
+    p = sub.add_parser("pdf", help="ms por PDF cargando fuentes/logo cada vez vs. una vez por proceso")
+    p.add_argument("--n", type=int, default=50)
+    p.add_argument("--base", help="carpeta con fonts/ (por defecto la de la app)")
+    p.add_argument("--logo", default="")
+
+    p = sub.add_parser("backup", help="backup incremental y restauración contra un almacén simulado (sin red)")
+    p.add_argument("--db", required=True)
+    p.add_argument("--latencia-ms", type=float, default=20.0)
+    p.add_argument("--fallas", type=float, default=0.0, help="probabilidad de falla por operación")
+    p.add_argument("--cambios", type=int, default=3, help="historias modificadas entre backups")
+
+    p = sub.add_parser("codecs", help="tamaño y tiempo de cada compresión sobre los bloques de la BD")
+    p.add_argument("--db", required=True)
+    p.add_argument("--mbps", type=float, default=10.0, help="subida estimada en megabits/s")
+    p.add_argument("--codecs", nargs="*", default=["deflate:1", "deflate:6", "deflate:9", "lzma:1", "lzma:6", "bz2:9"])
+
+    p = sub.add_parser("export", help="pico de memoria y velocidad de la exportación CSV/JSONL/XLSX")
+    p.add_argument("--filas", type=int, nargs="*", default=[100, 500_000])
+    p.add_argument("--formatos", nargs="*", default=["csv", "jsonl", "xlsx"])
+
+    args = ap.parse_args(argv)
+    if args.cmd == "sesiones":
+        rep = carga_sesiones(args.db, args.sesiones, args.ops, pdf=not args.sin_pdf)
+        print(f"{rep['ops']} operaciones en {rep['segundos']:.2f} s ({rep['ops_por_seg']:.0f} ops/s), "
+              f"{len(rep['errores'])} errores")
+        for tipo, t in rep["por_tipo"].items():
+            print(f"  {tipo:8} n={t['n']:5}  prom={t['ms_prom']:.1f} ms  max={t['ms_max']:.1f} ms")
+        for e in rep["errores"][:10]:
+            print("  error:", e)
+        return 1 if rep["errores"] else 0
+    if args.cmd == "render":
+        for r in render_tabla(args.filas):
+            print(f"{r['filas']:>7} filas  DataTable {r['datatable_ms']:8.0f} ms ({r['datatable_cmds']} cmds)  "
+                  f"PatientList {r['lista_ms']:6.0f} ms ({r['lista_cmds']} cmds)  "
+                  f"scroll {r['scroll_ms']:5.1f} ms")
+        return 0
+    if args.cmd == "planes":
+        rep = revisar_planes(args.db)
+        for r in rep:
+            print(f"{'OK ' if r['ok'] else 'SIN ÍNDICE'} {r['orden']:16} {r['filtros']}  {r['ms']:.1f} ms")
+            for paso in r["plan"]:
+                print("      " + paso)
+        return 0 if all(r["ok"] for r in rep) else 1
+    if args.cmd == "pdf":
+        r = latencia_pdf(args.n, args.base, args.logo)
+        print(f"{r['n']} PDFs (fuentes Unicode: {'sí' if r['unicode'] else 'no'}, logo: {'sí' if r['logo'] else 'no'})")
+        print(f"  antes   {r['antes_ms']:7.1f} ms/PDF")
+        print(f"  después {r['despues_ms']:7.1f} ms/PDF  ({r['antes_ms'] / r['despues_ms']:.1f}x)")
+        return 0
+    if args.cmd == "backup":
+        r = backup_offline(args.db, args.latencia_ms, args.fallas, args.cambios)
+        for etapa in ("completo", "incremental"):
+            b = r[etapa]
+            print(f"{etapa:12} {b['segundos']:6.1f} s  {b['nuevos']:5}/{b['chunks']} bloques  "
+                  f"{b['bytes_subidos'] / 1e6:7.2f} MB  {b['puts']} puts (con reintentos)")
+        print(f"restaurar    {r['restaurar_s']:6.1f} s (verificado)")
+        print(f"fallas simuladas: {r['fallas']}, reintentos: {r['reintentos']}")
+        return 0
+    if args.cmd == "codecs":
+        rep = comparar_codecs(args.db, args.codecs, args.mbps)
+        print(f"BD {rep[0]['db_mb']:.1f} MB, subida {args.mbps:g} Mbit/s")
+        for r in rep:
+            print(f"  {r['codec']:10} {r['mb']:7.1f} MB  comprimir {r['comprimir_s']:5.1f} s  "
+                  f"descomprimir {r['descomprimir_s']:4.1f} s  backup completo ~{r['backup_s']:5.0f} s")
+        return 0
+    if args.cmd == "export":
+        for r in memoria_export(args.filas, args.formatos):
+            print(f"{r['filas']:>8} filas  {r['formato']:5}  pico {r['pico_mb']:6.2f} MB  "
+                  f"archivo {r['mb']:7.1f} MB  {r['segundos']:5.1f} s ({r['filas_por_seg']:.0f} filas/s)")
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+# catalogo.py
+"""
+Catálogo, retención y restauración de los backups incrementales (backup_store.py).
+
+- Catálogo local (BASE_DIR/backup_catalogo.json): por snapshot, fecha, tamaño, hash
+  del .db, filas de historias/consultas y destino. Se actualiza en cada backup y con
+  sincronizar() (lee los manifiestos del almacén), así la lista para restaurar no
+  necesita bajar nada.
+- Retención abuelo-padre-hijo: se conservan el último backup de cada uno de los
+  últimos N días, N semanas y N meses (config.json "retencion"); podar() borra los
+  manifiestos que sobran y después los bloques que ya nadie usa (salvo los subidos
+  hace menos de GRACIA_H: pueden ser de un backup que sigue en curso en otra PC).
+- restaurar_bd(): baja el snapshot, lo verifica (bloques, hash, integrity_check),
+  guarda una copia de la BD actual y reemplaza el contenido de la BD abierta con la
+  API de backup de SQLite (Database.reemplazar_con): la app no se cierra y nunca
+  queda una BD a medio copiar.
+
+    python catalogo.py [--repo <carpeta>] listar|sincronizar|podar|restaurar <id>
+"""
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+
+from paths import load_config
+from snapshot import tomar_snapshot
+from backup_store import listar_snapshots, leer_manifiesto, restaurar, contar_filas, BackupError, SESION_MAX_H
+
+CATALOGO_NAME = "backup_catalogo.json"
+RETENCION = {"diarios": 7, "semanales": 4, "mensuales": 12}
+# Un backup a medias se retoma hasta SESION_MAX_H después de empezar (en esta PC o en
+# otra con el mismo destino), y sus bloques todavía no figuran en ningún manifiesto
+GRACIA_H = 2 * SESION_MAX_H
+
+# ------------------------- catálogo -------------------------
+def _catalogo_path(paths: dict) -> str:
+    return os.path.join(paths["BASE_DIR"], CATALOGO_NAME)
+
+def _leer(paths: dict) -> dict:
+    try:
+        with open(_catalogo_path(paths), "r", encoding="utf-8") as f:
+            cat = json.load(f)
+        if isinstance(cat, dict) and isinstance(cat.get("snapshots"), dict):
+            return cat
+    except (OSError, ValueError):
+        pass
+    return {"snapshots": {}}
+
+def _guardar(paths: dict, cat: dict):
+    path = _catalogo_path(paths)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(cat, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+def _entrada(m: dict, destino: str) -> dict:
+    return {"id": m["id"], "creado": m.get("creado"), "bytes": m.get("bytes"), "sha256": m.get("sha256"),
+            "filas": m.get("filas", {}), "codec": m.get("codec"), "destino": destino}
+
+def registrar(paths: dict, rep: dict, destino: str = ""):
+    """Agrega al catálogo el snapshot recién subido (el dict de backup_incremental)."""
+    cat = _leer(paths)
+    cat["snapshots"][rep["id"]] = _entrada(rep, destino)
+    _guardar(paths, cat)
+
+def listar(paths: dict) -> list:
+    """Entradas del catálogo, la más nueva primero."""
+    return sorted(_leer(paths)["snapshots"].values(), key=lambda e: e["id"], reverse=True)
+
+def sincronizar(paths: dict, store) -> list:
+    """
+    Pone el catálogo al día con los manifiestos del almacén: agrega los que falten
+    (backups de otra PC, o de antes del catálogo) y quita los que ya no están.
+    """
+    destino = repr(store)
+    cat = _leer(paths)
+    previos = {k: v for k, v in cat["snapshots"].items() if v.get("destino") not in ("", destino)}
+    actuales = {}
+    for m in listar_snapshots(store):
+        actuales[m["id"]] = cat["snapshots"].get(m["id"]) or _entrada(m, destino)
+        actuales[m["id"]]["destino"] = destino
+    cat["snapshots"] = {**previos, **actuales}
+    _guardar(paths, cat)
+    return listar(paths)
+
+# ------------------------- retención -------------------------
+def politica(paths: dict) -> dict:
+    """config.json "retencion": {"diarios", "semanales", "mensuales"} (faltantes: RETENCION)."""
+    cfg = load_config(paths["BASE_DIR"]).get("retencion")
+    out = dict(RETENCION)
+    if isinstance(cfg, dict):
+        out.update({k: int(v) for k, v in cfg.items() if k in RETENCION and isinstance(v, int) and v >= 0})
+    return out
+
+def _fecha(m: dict) -> datetime.datetime:
+    try:
+        return datetime.datetime.fromisoformat(m["creado"])
+    except (KeyError, TypeError, ValueError):
+        return datetime.datetime.strptime(m["id"][:15], "%Y%m%d_%H%M%S")
+
+def conservar_gfs(snaps: list, diarios: int = 7, semanales: int = 4, mensuales: int = 12) -> set:
+    """
+    Ids a conservar de `snaps` ([{"id", "creado"}…]): el más nuevo siempre, y el
+    último de cada uno de los `diarios` días, `semanales` semanas ISO y `mensuales`
+    meses más recientes que tengan backup.
+    """
+    orden = sorted(snaps, key=_fecha, reverse=True)
+    conservar = {orden[0]["id"]} if orden else set()
+    for n, clave in ((diarios, lambda d: d.date()),
+                     (semanales, lambda d: d.isocalendar()[:2]),
+                     (mensuales, lambda d: (d.year, d.month))):
+        vistos = set()
+        for m in orden:
+            k = clave(_fecha(m))
+            if k in vistos:
+                continue
+            if len(vistos) >= n:
+                break
+            vistos.add(k)
+            conservar.add(m["id"])
+    return conservar
+
+def podar(paths: dict, store, pol: dict | None = None, simular: bool = False,
+          gracia_h: float = GRACIA_H) -> dict:
+    """
+    Aplica la retención en `store`: borra los manifiestos que no conserva
+    conservar_gfs() y después los bloques que no usa ningún snapshot conservado y
+    que se subieron hace más de `gracia_h` horas (si el almacén no sabe cuándo, no
+    se borran). Con simular=True sólo informa.
+    Devuelve {"conservados", "borrados", "chunks_borrados", "chunks_recientes"}.
+    """
+    pol = pol or politica(paths)
+    snaps = [leer_manifiesto(store, n[len("snapshots/"):-len(".json")])
+             for n in store.listar("snapshots/") if n.endswith(".json")]
+    conservar = conservar_gfs(snaps, **pol)
+    borrar = [m["id"] for m in snaps if m["id"] not in conservar]
+    if not conservar:
+        # Nunca limpiar bloques si no se ve ningún manifiesto (listado fallido, carpeta equivocada)
+        return {"conservados": [], "borrados": [], "chunks_borrados": 0, "chunks_recientes": 0}
+
+    usados = set()
+    for m in snaps:
+        if m["id"] in conservar:
+            usados.update(m["chunks"])
+    limite = time.time() - gracia_h * 3600
+    huerfanos, recientes = [], 0
+    for n in store.listar("chunks/"):
+        if n.rsplit("/", 1)[-1] in usados:
+            continue
+        subido = store.modificado(n)
+        if subido is None or subido > limite:
+            recientes += 1
+        else:
+            huerfanos.append(n)
+    if not simular:
+        # Primero los manifiestos: si se corta a mitad, quedan bloques sueltos, no snapshots rotos
+        for snap_id in borrar:
+            store.borrar(f"snapshots/{snap_id}.json")
+        for nombre in huerfanos:
+            store.borrar(nombre)
+        cat = _leer(paths)
+        for snap_id in borrar:
+            cat["snapshots"].pop(snap_id, None)
+        _guardar(paths, cat)
+    print(f"[DEBUG] Retención {pol}: {len(conservar)} snapshots conservados, {len(borrar)} borrados, "
+          f"{len(huerfanos)} bloques sin uso, {recientes} recientes sin tocar{' (simulado)' if simular else ''}")
+    return {"conservados": sorted(conservar), "borrados": borrar, "chunks_borrados": len(huerfanos),
+            "chunks_recientes": recientes}
+
+# ------------------------- restauración -------------------------
+def restaurar_bd(paths: dict, store, snap_id: str, progress=None) -> dict:
+    """
+    Reemplaza la BD de la app por el snapshot `snap_id`:
+      1. lo baja y verifica (bloques, hash del .db, integrity_check) en un temporal;
+      2. guarda una copia verificada de la BD actual en BACKUPS_DIR;
+      3. reemplaza el contenido con la API de backup de SQLite y controla las filas.
+    Si algo falla antes del paso 3, la BD no se toca. Devuelve los tiempos de cada paso:
+    {"id", "bytes", "filas", "copia_previa", "descarga_s", "copia_s", "reemplazo_s", "segundos"}.
+    """
+    from db import open_database
+
+    progress = progress or (lambda frac=None, msg=None: None)
+    t0 = time.perf_counter()
+    backups_dir = paths.get("BACKUPS_DIR") or os.path.join(paths["BASE_DIR"], "backups")
+    os.makedirs(backups_dir, exist_ok=True)
+    tmp = os.path.join(backups_dir, f"restaurar_{snap_id}.db")
+    try:
+        rest = restaurar(store, snap_id, tmp,
+                         progress=lambda frac=None, msg=None: progress(0.7 * (frac or 0), msg))
+        descarga_s = time.perf_counter() - t0
+        esperadas = leer_manifiesto(store, snap_id).get("filas") or contar_filas(tmp)
+
+        progress(0.7, "Guardando copia de la base actual…")
+        t1 = time.perf_counter()
+        previa = os.path.join(backups_dir, f"antes_de_restaurar_{datetime.datetime.now():%Y%m%d_%H%M%S}.db")
+        tomar_snapshot(paths["DB_NAME"], previa,
+                       progress=lambda frac=None, msg=None: progress(0.7 + 0.2 * (frac or 0), msg))
+        copia_s = time.perf_counter() - t1
+
+        progress(0.9, "Reemplazando la base de datos…")
+        progress(0.9)   # último punto de cancelación: el reemplazo no se corta a la mitad
+        t2 = time.perf_counter()
+        database = open_database(paths["DB_NAME"])
+        database.reemplazar_con(tmp)
+        filas = contar_filas(paths["DB_NAME"])
+        if any(filas.get(t) != n for t, n in esperadas.items()):
+            database.reemplazar_con(previa)
+            raise BackupError(f"La base restaurada no tiene las filas esperadas ({filas} en vez de "
+                              f"{esperadas}); se volvió a la anterior")
+        reemplazo_s = time.perf_counter() - t2
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    rep = {"id": snap_id, "bytes": rest["bytes"], "filas": filas, "copia_previa": previa,
+           "descarga_s": descarga_s, "copia_s": copia_s, "reemplazo_s": reemplazo_s,
+           "segundos": time.perf_counter() - t0}
+    progress(1.0, "Backup restaurado")
+    print(f"[DEBUG] Restaurado {snap_id} ({rest['bytes'] / 1e6:.1f} MB): descarga+verificación "
+          f"{descarga_s:.1f} s, copia previa {copia_s:.1f} s, reemplazo {reemplazo_s:.2f} s")
+    return rep
+
+# ------------------------- consola -------------------------
+def main(argv=None):
+    from paths import get_paths
+    from almacenes import CarpetaLocal
+
+    ap = argparse.ArgumentParser(description="Catálogo, retención y restauración de backups")
+    ap.add_argument("--repo", help="carpeta del repositorio (por defecto el destino de backup_now)")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("listar", help="snapshots del catálogo local")
+    sub.add_parser("sincronizar", help="actualizar el catálogo con el almacén")
+    p = sub.add_parser("podar", help="aplicar la retención abuelo-padre-hijo")
+    p.add_argument("--simular", action="store_true")
+    p = sub.add_parser("restaurar", help="reemplazar la BD de la app por un snapshot")
+    p.add_argument("id")
+
+    args = ap.parse_args(argv)
+    paths = get_paths()
+    if args.cmd == "listar":
+        for e in listar(paths):
+            filas = ", ".join(f"{n} {t}" for t, n in e.get("filas", {}).items())
+            print(f"{e['id']}  {e['creado']}  {e['bytes'] / 1e6:8.1f} MB  {filas}")
+        return 0
+
+    if args.repo:
+        store = CarpetaLocal(args.repo)
+    else:
+        from backup_drive import almacen_backup
+        store = almacen_backup(paths)
+    if args.cmd == "sincronizar":
+        print(f"{len(sincronizar(paths, store))} snapshots en el catálogo")
+    elif args.cmd == "podar":
+        rep = podar(paths, store, simular=args.simular)
+        print(f"Conservados {len(rep['conservados'])}, borrados {len(rep['borrados'])}: "
+              f"{' '.join(rep['borrados'])}; bloques sin uso: {rep['chunks_borrados']} "
+              f"(recientes sin tocar: {rep['chunks_recientes']})")
+    elif args.cmd == "restaurar":
+        rep = restaurar_bd(paths, store, args.id)
+        print(f"{rep['id']} restaurado ({rep['bytes'] / 1e6:.1f} MB, {rep['filas']}): "
+              f"descarga+verificación {rep['descarga_s']:.1f} s, copia previa {rep['copia_s']:.1f} s, "
+              f"reemplazo {rep['reemplazo_s']:.2f} s, total {rep['segundos']:.1f} s")
+        print(f"La base anterior quedó en {rep['copia_previa']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,214 @@
 # db.py
+import os
+import re
 import sqlite3
+import datetime
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from validators import normalizar_dni, normalizar_nombre
+
+# Columnas de texto indexadas por la búsqueda de texto completo (FTS5)
+FTS_COLUMNS = (
+    "nombre", "antecedentes_personales", "antecedentes_familiares",
+    "examen_fisico", "diagnostico_presuntivo", "evolucion_seguimiento",
+    "motivo_consulta",
+)
+
+# Columnas editables de `historias` (orden de los formularios y del INSERT).
+# `evolucion_seguimiento` ya no se escribe: cada evolución es una fila de `consultas`.
+DATA_COLUMNS = (
+    "nombre", "dni", "edad", "domicilio", "obra_social", "numero_beneficio",
+    "telefono", "email", "antecedentes_personales", "antecedentes_familiares",
+    "examen_fisico", "diagnostico_presuntivo", "motivo_consulta",
+)
+
+# Columnas de la vista de lista (lo que muestra la tabla). Los textos clínicos largos
+# se leen recién al abrir una historia (obtener_historia).
+LIST_COLUMNS = (
+    "id", "nombre", "dni", "edad", "obra_social", "numero_beneficio",
+    "telefono", "motivo_consulta",
+)
 
 def init_db(db_path: str):
-    conn = sqlite3.connect(db_path)
+    """Abre (o reabre) la BD, aplica migraciones y devuelve la conexión de escritura del hilo."""
+    database = open_database(db_path)
+    conn = database.writer()
     cur = conn.cursor()
+    return conn, cur
+
+# ------------------------- Conexiones -------------------------
+# WAL: los lectores no bloquean al que escribe (ni al revés) y el backup ve un estado consistente
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",   # seguro con WAL; sólo se pierde la última tx ante un corte de luz
+    "PRAGMA foreign_keys = ON",      # consultas -> historias (ON DELETE CASCADE)
+)
+COMMON_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000",    # esperar hasta 5 s en vez de "database is locked"
+    "PRAGMA cache_size = -16000",    # ~16 MB de cache de páginas por conexión
+    "PRAGMA mmap_size = 268435456",  # 256 MB mapeados en memoria para lecturas
+    "PRAGMA temp_store = MEMORY",
+)
+
+class Database:
+    """
+    Conexiones a un archivo SQLite: una de escritura y una de sólo lectura por hilo
+    (los handlers de Flet corren en un pool de hilos). Las conexiones se crean a
+    demanda y se reutilizan mientras viva el hilo; close_all() cierra todas.
+
+    Cada sesión de Flet (p.ej. cada consultorio en modo web) usa session(), que tiene
+    sus propias conexiones pero comparte el candado de escritura: las escrituras
+    de todas las sesiones pasan de a una por transaction().
+    """
+
+    def __init__(self, path: str, parent=None, session_id=None):
+        self.path = path
+        self.session_id = session_id
+        self._parent = parent
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._conns = []
+        self._sessions = {}
+        self._write_lock = parent._write_lock if parent else threading.RLock()
+
+    def _open(self, readonly: bool):
+        if readonly:
+            uri = "file:" + self.path.replace("?", "%3f").replace("#", "%23") + "?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            for pragma in WRITER_PRAGMAS:
+                conn.execute(pragma)
+        for pragma in COMMON_PRAGMAS:
+            conn.execute(pragma)
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        with self._lock:
+            self._conns.append(conn)
+        return conn
+
+    def writer(self):
+        """Conexión de escritura del hilo actual."""
+        conn = getattr(self._local, "writer", None)
+        if conn is None:
+            conn = self._local.writer = self._open(readonly=False)
+        return conn
+
+    def reader(self):
+        """Conexión de sólo lectura del hilo actual (búsquedas, exportes, PDFs)."""
+        conn = getattr(self._local, "reader", None)
+        if conn is None:
+            conn = self._local.reader = self._open(readonly=True)
+        return conn
+
+    def dedicated_reader(self):
+        """
+        Conexión de sólo lectura nueva, fuera del reparto por hilo: para un trabajo que
+        corre en hilos sueltos y se puede cancelar con conn.interrupt() (búsqueda en vivo).
+        Se cierra con close_all().
+        """
+        return self._open(readonly=True)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Transacción de escritura serializada: `with db.transaction() as cur: ...`.
+        Hace COMMIT al salir o ROLLBACK si hubo una excepción (que se propaga).
+        """
+        with self._write_lock:
+            conn = self.writer()
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    def session(self, session_id):
+        """Conexiones propias para una sesión (se reutilizan si ya existe)."""
+        with self._lock:
+            sess = self._sessions.get(session_id)
+            if sess is None:
+                sess = self._sessions[session_id] = Database(self.path, parent=self, session_id=session_id)
+        return sess
+
+    def close_all(self):
+        """
+        Cierra todas las conexiones de todos los hilos (p.ej. antes de reemplazar el
+        archivo). En una sesión, cierra sólo las suyas; en la raíz, también las de las sesiones.
+        """
+        with self._lock:
+            conns, self._conns = self._conns, []
+            sessions, self._sessions = list(self._sessions.values()), {}
+            # Conexiones viejas en otros hilos: al pedir una nueva, se reabre
+            self._local = threading.local()
+        for sess in sessions:
+            sess.close_all()
+        if self._parent is not None:
+            with self._parent._lock:
+                if self._parent._sessions.get(self.session_id) is self:
+                    del self._parent._sessions[self.session_id]
+        for conn in conns:
+            try:
+                conn.commit()
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def reemplazar_con(self, src_path: str):
+        """
+        Reemplaza todo el contenido de la BD por el de `src_path` con la API de backup
+        de SQLite, en una sola transacción de escritura: las demás conexiones siguen
+        abiertas y ven la BD vieja o la nueva, nunca una mezcla. Aplica las migraciones
+        pendientes (si `src_path` es de una versión anterior) y vacía la cache de historias.
+        """
+        src = sqlite3.connect(f"file:{src_path}?mode=ro", uri=True)
+        try:
+            with self._write_lock:
+                conn = self.writer()
+                src.backup(conn, pages=-1)
+                migrate(conn)
+        finally:
+            src.close()
+        historias_cache.clear()
+
+    def checkpoint(self):
+        """Vuelca el WAL al archivo principal (deja el .db completo por sí solo)."""
+        with self._write_lock:
+            self.writer().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+def open_database(db_path: str) -> Database:
+    """
+    Database compartida para `db_path` (una por archivo y por proceso). La primera vez
+    (o después de close_database) aplica las migraciones pendientes.
+    """
+    key = os.path.abspath(db_path)
+    with _databases_lock:
+        database = _databases.get(key)
+        if database is None:
+            database = Database(key)
+            historias_cache.clear()
+            migrate(database.writer())
+            _databases[key] = database
+    return database
+
+def close_database(db_path: str):
+    """Cierra todas las conexiones a `db_path` y lo olvida (la próxima apertura re-migra)."""
+    with _databases_lock:
+        database = _databases.pop(os.path.abspath(db_path), None)
+    if database is not None:
+        database.close_all()
+    historias_cache.clear()
+
+# ------------------------- Migraciones -------------------------
+def _m001_historias(cur):
     cur.execute("""
     CREATE TABLE IF NOT EXISTS historias (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -23,5 +228,879 @@ def init_db(db_path: str):
         motivo_consulta TEXT
     )
     """)
-    conn.commit()
-    return conn, cur
+
+def _m002_fts(cur):
+    _ensure_fts(cur)
+
+def _m003_normalizados(cur):
+    """DNI sólo dígitos (único), nombre plegado (sin acentos/mayúsculas) y timestamps."""
+    for col in ("dni_norm", "nombre_norm", "created_at", "updated_at"):
+        cur.execute(f"ALTER TABLE historias ADD COLUMN {col} TEXT")
+
+    cur.execute("SELECT id, nombre, dni FROM historias ORDER BY id")
+    seen, updates = set(), []
+    for row_id, nombre, dni in cur.fetchall():
+        dni_norm = normalizar_dni(dni) or None
+        if dni_norm in seen:
+            # DNI repetido en una BD vieja: la fila queda sin dni_norm para no romper el índice único
+            print(f"[DEBUG] DNI duplicado {dni!r} en historia {row_id}; queda sin normalizar")
+            dni_norm = None
+        elif dni_norm:
+            seen.add(dni_norm)
+        updates.append((dni_norm, normalizar_nombre(nombre), row_id))
+    cur.executemany("UPDATE historias SET dni_norm=?, nombre_norm=? WHERE id=?", updates)
+    cur.execute("UPDATE historias SET created_at=datetime('now'), updated_at=datetime('now')")
+
+    cur.execute("CREATE UNIQUE INDEX idx_historias_dni_norm ON historias(dni_norm)")
+    cur.execute("CREATE INDEX idx_historias_nombre_norm ON historias(nombre_norm)")
+    cur.execute("CREATE INDEX idx_historias_obra_social ON historias(obra_social COLLATE NOCASE)")
+
+def _m004_consultas(cur):
+    """Historial de visitas (append-only) en vez de un único texto de evolución."""
+    cur.execute("""
+    CREATE TABLE consultas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        historia_id INTEGER NOT NULL REFERENCES historias(id) ON DELETE CASCADE,
+        fecha TEXT NOT NULL,
+        notas TEXT NOT NULL,
+        created_at TEXT
+    )
+    """)
+    cur.execute("CREATE INDEX idx_consultas_historia_fecha ON consultas(historia_id, fecha, id)")
+    cur.execute("""
+    CREATE VIRTUAL TABLE consultas_fts USING fts5(
+        notas, content='consultas', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """)
+    cur.execute("""
+    CREATE TRIGGER consultas_fts_ai AFTER INSERT ON consultas BEGIN
+        INSERT INTO consultas_fts(rowid, notas) VALUES (new.id, new.notas);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER consultas_fts_ad AFTER DELETE ON consultas BEGIN
+        INSERT INTO consultas_fts(consultas_fts, rowid, notas) VALUES ('delete', old.id, old.notas);
+    END
+    """)
+    cur.execute("""
+    CREATE TRIGGER consultas_fts_au AFTER UPDATE ON consultas BEGIN
+        INSERT INTO consultas_fts(consultas_fts, rowid, notas) VALUES ('delete', old.id, old.notas);
+        INSERT INTO consultas_fts(rowid, notas) VALUES (new.id, new.notas);
+    END
+    """)
+
+    # Pasar el texto de evolución existente a visitas
+    cur.execute("""SELECT id, evolucion_seguimiento, created_at FROM historias
+                   WHERE evolucion_seguimiento IS NOT NULL AND trim(evolucion_seguimiento) <> ''""")
+    visitas = []
+    for row_id, texto, created_at in cur.fetchall():
+        fecha_base = (created_at or datetime.date.today().isoformat())[:10]
+        for fecha, notas in _split_evolucion(texto, fecha_base):
+            visitas.append((row_id, fecha, notas))
+    cur.executemany("""INSERT INTO consultas (historia_id, fecha, notas, created_at)
+                       VALUES (?, ?, ?, datetime('now'))""", visitas)
+    cur.execute("UPDATE historias SET evolucion_seguimiento = NULL WHERE evolucion_seguimiento IS NOT NULL")
+
+def _m005_trigramas(cur):
+    """Índice de trigramas del nombre plegado, para la búsqueda aproximada (buscar_nombre)."""
+    cur.execute("""
+    CREATE TABLE nombre_trigramas (
+        trigrama TEXT NOT NULL,
+        historia_id INTEGER NOT NULL REFERENCES historias(id) ON DELETE CASCADE,
+        PRIMARY KEY (trigrama, historia_id)
+    ) WITHOUT ROWID
+    """)
+    cur.execute("CREATE INDEX idx_nombre_trigramas_historia ON nombre_trigramas(historia_id)")
+    cur.execute("SELECT id, nombre_norm FROM historias")
+    _index_trigramas(cur, cur.fetchall(), replace=False)
+
+def _m006_indices_lista(cur):
+    """Índices para los filtros combinados y el orden por columna de la lista."""
+    cur.execute("UPDATE historias SET edad = NULL WHERE edad = ''")
+    # Las expresiones son las mismas que usan PAGE_ORDERS y _where_filtros
+    cur.execute("DROP INDEX IF EXISTS idx_historias_obra_social")
+    cur.execute("""CREATE INDEX idx_historias_obra_social
+                   ON historias(ifnull(obra_social, '') COLLATE NOCASE, ifnull(edad, -1))""")
+    cur.execute("""CREATE INDEX idx_historias_obra_social_orden
+                   ON historias(ifnull(obra_social, '') COLLATE NOCASE, id)""")
+    cur.execute("CREATE INDEX idx_historias_edad ON historias(ifnull(edad, -1))")
+    cur.execute("CREATE INDEX idx_historias_dni_orden ON historias(ifnull(dni_norm, ''))")
+    cur.execute("CREATE INDEX idx_historias_created_at ON historias(created_at)")
+    cur.execute("ANALYZE historias")
+
+def _m007_dni_duplicados(cur):
+    """
+    Las historias con DNI repetido de una BD vieja (_m003 las dejó sin dni_norm, y así
+    no aparecían al filtrar por DNI) recuperan su dni_norm y quedan marcadas con
+    dni_duplicado = 1; el índice único pasa a cubrir sólo las no marcadas.
+    """
+    cur.execute("ALTER TABLE historias ADD COLUMN dni_duplicado INTEGER")
+    cur.execute("DROP INDEX idx_historias_dni_norm")
+    cur.execute("""CREATE UNIQUE INDEX idx_historias_dni_norm ON historias(dni_norm)
+                   WHERE dni_duplicado IS NULL""")
+    cur.execute("SELECT id, dni FROM historias WHERE dni_norm IS NULL AND dni IS NOT NULL")
+    dups = [(normalizar_dni(dni), row_id) for row_id, dni in cur.fetchall() if normalizar_dni(dni)]
+    cur.executemany("UPDATE historias SET dni_norm = ?, dni_duplicado = 1 WHERE id = ?", dups)
+    for dni_norm, row_id in dups:
+        print(f"[DEBUG] Historia {row_id} tiene el DNI {dni_norm} repetido; se marca como duplicada")
+    # El filtro por DNI (rango sobre dni_norm) no puede usar el índice parcial
+    cur.execute("CREATE INDEX idx_historias_dni_norm_todas ON historias(dni_norm)")
+
+# El índice de cada función + 1 es la versión que deja la BD (PRAGMA user_version).
+# Sólo se agregan al final; nunca se editan las ya publicadas.
+MIGRATIONS = (
+    _m001_historias,
+    _m002_fts,
+    _m003_normalizados,
+    _m004_consultas,
+    _m005_trigramas,
+    _m006_indices_lista,
+    _m007_dni_duplicados,
+)
+
+def migrate(conn) -> int:
+    """
+    Lleva la BD a la última versión de MIGRATIONS. Todas las migraciones pendientes
+    se aplican en una sola transacción: si alguna falla, la BD queda como estaba.
+    Devuelve la versión final.
+    """
+    cur = conn.cursor()
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    target = len(MIGRATIONS)
+    if version >= target:
+        return version
+
+    old_isolation = conn.isolation_level
+    conn.isolation_level = None  # manejamos BEGIN/COMMIT a mano (incluye DDL)
+    try:
+        cur.execute("BEGIN IMMEDIATE")
+        for n in range(version, target):
+            print(f"[DEBUG] Migrando BD a versión {n + 1}")
+            MIGRATIONS[n](cur)
+        cur.execute(f"PRAGMA user_version = {target}")
+        cur.execute("COMMIT")
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+    finally:
+        conn.isolation_level = old_isolation
+    return target
+
+# ------------------------- Escritura -------------------------
+def _write_params(data: dict) -> tuple:
+    dni_norm = normalizar_dni(data.get("dni")) or None
+    # Edad vacía = NULL (no '') para que los filtros y el orden por edad sean numéricos
+    values = tuple(None if c == "edad" and data.get(c) == "" else data.get(c) for c in DATA_COLUMNS)
+    return values + (dni_norm, normalizar_nombre(data.get("nombre")))
+
+def insertar_historia(cur, data: dict) -> int:
+    """
+    INSERT de una historia; devuelve el id nuevo. IntegrityError si el DNI ya existe.
+    Si `data["evolucion_seguimiento"]` trae texto, se registra como primera visita.
+    """
+    cols = ", ".join(DATA_COLUMNS)
+    marks = ", ".join("?" for _ in DATA_COLUMNS)
+    cur.execute(f"""INSERT INTO historias
+        ({cols}, dni_norm, nombre_norm, created_at, updated_at)
+        VALUES ({marks}, ?, ?, datetime('now'), datetime('now'))""", _write_params(data))
+    row_id = cur.lastrowid
+    _index_trigramas(cur, [(row_id, normalizar_nombre(data.get("nombre")))])
+    _append_evolucion(cur, row_id, data)
+    return row_id
+
+def _append_evolucion(cur, row_id: int, data: dict):
+    """El campo de evolución del formulario agrega una visita nueva (no pisa las anteriores)."""
+    notas = (data.get("evolucion_seguimiento") or "").strip()
+    if notas:
+        agregar_consulta(cur, row_id, notas)
+
+def actualizar_historia(cur, row_id: int, data: dict) -> int:
+    """
+    UPDATE de una historia existente; devuelve cuántas filas cambió.
+    Si `data["evolucion_seguimiento"]` trae texto, se agrega como visita nueva.
+    """
+    sets = ", ".join(f"{c}=?" for c in DATA_COLUMNS)
+    cur.execute(f"""UPDATE historias SET
+        {sets}, dni_norm=?, nombre_norm=?, updated_at=datetime('now')
+        WHERE id=?""", _write_params(data) + (row_id,))
+    historias_cache.discard(_cache_key(cur, row_id))
+    changed = cur.rowcount
+    if changed:
+        _index_trigramas(cur, [(row_id, normalizar_nombre(data.get("nombre")))])
+        # Un DNI duplicado que se corrigió a uno libre vuelve a contar para el índice único
+        cur.execute("""UPDATE historias SET dni_duplicado = NULL
+                       WHERE id = ? AND dni_duplicado IS NOT NULL AND NOT EXISTS (
+                           SELECT 1 FROM historias h WHERE h.dni_norm = historias.dni_norm
+                           AND h.id <> historias.id)""", (row_id,))
+    _append_evolucion(cur, row_id, data)
+    return changed
+
+def upsert_historias(cur, datas: list) -> tuple:
+    """
+    Alta/actualización masiva por DNI normalizado (un solo executemany).
+    Devuelve (insertadas, actualizadas). Las evoluciones se agregan como visitas,
+    salvo las que la historia ya tiene (reimportar el mismo archivo no las duplica).
+    Llamar dentro de una transacción; el commit lo hace quien llama.
+    """
+    if not datas:
+        return 0, 0
+    params = [_write_params(d) for d in datas]
+
+    # ¿Cuáles DNI ya existen? (para el reporte; de a 500 por el límite de parámetros)
+    dnis = list({p[-2] for p in params if p[-2]})
+    existing = set()
+    for i in range(0, len(dnis), 500):
+        chunk = dnis[i:i + 500]
+        cur.execute(f"""SELECT dni_norm FROM historias WHERE dni_duplicado IS NULL
+                        AND dni_norm IN ({', '.join('?' for _ in chunk)})""", chunk)
+        existing.update(r[0] for r in cur.fetchall())
+
+    cur.execute("SELECT coalesce(max(id), 0) FROM historias")
+    max_id = cur.fetchone()[0]
+    cols = ", ".join(DATA_COLUMNS)
+    marks = ", ".join("?" for _ in DATA_COLUMNS)
+    sets = ", ".join(f"{c}=excluded.{c}" for c in DATA_COLUMNS)
+    cur.executemany(f"""INSERT INTO historias
+        ({cols}, dni_norm, nombre_norm, created_at, updated_at)
+        VALUES ({marks}, ?, ?, datetime('now'), datetime('now'))
+        ON CONFLICT(dni_norm) WHERE dni_duplicado IS NULL DO UPDATE SET
+        {sets}, nombre_norm=excluded.nombre_norm, updated_at=datetime('now')""", params)
+
+    updated = sum(1 for p in params if p[-2] in existing)
+    # Repetidos dentro del mismo lote: el segundo actualiza al primero
+    seen = set()
+    for p in params:
+        if p[-2] and p[-2] not in existing:
+            if p[-2] in seen:
+                updated += 1
+            seen.add(p[-2])
+
+    # dni_norm -> id de todo el lote (para el índice de trigramas y las visitas)
+    ids = {}
+    for i in range(0, len(dnis), 500):
+        chunk = dnis[i:i + 500]
+        cur.execute(f"""SELECT dni_norm, id FROM historias WHERE dni_duplicado IS NULL
+                        AND dni_norm IN ({', '.join('?' for _ in chunk)})""", chunk)
+        ids.update(cur.fetchall())
+    nombres = {p[-2]: p[-1] for p in params if p[-2] in ids}   # el último del lote gana
+    pares = [(ids[k], nombre_norm) for k, nombre_norm in nombres.items()]
+    # Altas sin DNI: no tienen clave, pero sí id nuevo
+    cur.execute("SELECT id, nombre_norm FROM historias WHERE id > ? AND dni_norm IS NULL", (max_id,))
+    pares.extend(cur.fetchall())
+    _index_trigramas(cur, pares)
+
+    con_evol = [(ids[normalizar_dni(d.get("dni"))], d["evolucion_seguimiento"]) for d in datas
+                if (d.get("evolucion_seguimiento") or "").strip() and normalizar_dni(d.get("dni")) in ids]
+    if con_evol:
+        _agregar_visitas_nuevas(cur, con_evol)
+
+    historias_cache.clear()
+    return len(params) - updated, updated
+
+def _agregar_visitas_nuevas(cur, textos: list):
+    """
+    textos: [(historia_id, texto de evolución), ...]. Agrega cada visita del texto que
+    la historia todavía no tenga, por (fecha, notas); lo que no trae fecha se compara
+    sólo por notas (se guardaría con la fecha de hoy, distinta en cada reimportación).
+    """
+    hids = sorted({h for h, _ in textos})
+    con_fecha, sin_fecha = set(), set()
+    for i in range(0, len(hids), 500):
+        chunk = hids[i:i + 500]
+        cur.execute(f"""SELECT historia_id, fecha, notas FROM consultas
+                        WHERE historia_id IN ({', '.join('?' for _ in chunk)})""", chunk)
+        for h, fecha, notas in cur.fetchall():
+            con_fecha.add((h, fecha, notas))
+            sin_fecha.add((h, notas))
+
+    hoy = datetime.date.today().isoformat()
+    nuevas = []
+    for h, texto in textos:
+        for fecha, notas in _split_evolucion(texto, ""):
+            if (h, fecha, notas) in con_fecha or (not fecha and (h, notas) in sin_fecha):
+                continue
+            fecha = fecha or hoy
+            con_fecha.add((h, fecha, notas))
+            sin_fecha.add((h, notas))
+            nuevas.append((h, fecha, notas))
+    cur.executemany("""INSERT INTO consultas (historia_id, fecha, notas, created_at)
+                       VALUES (?, ?, ?, datetime('now'))""", nuevas)
+
+def borrar_historia(cur, row_id: int) -> int:
+    cur.execute("DELETE FROM historias WHERE id=?", (row_id,))
+    historias_cache.discard(_cache_key(cur, row_id))
+    return cur.rowcount  # las consultas se borran por ON DELETE CASCADE
+
+# ------------------------- Consultas (visitas) -------------------------
+# Una fecha al comienzo de línea abre una visita nueva: 05/03/2024, 5-3-24, 2024-03-05,
+# opcionalmente con hora (2024-03-05 14:30, como las guarda agregar_consulta)
+_DATE_LINE_RE = re.compile(
+    r"^\s*(?:(?P<d>\d{1,2})[/.-](?P<m>\d{1,2})[/.-](?P<y>\d{2,4})|(?P<iy>\d{4})-(?P<im>\d{2})-(?P<id>\d{2}))"
+    r"(?:[ T](?P<hh>[01]?\d|2[0-3]):(?P<mi>[0-5]\d))?\b[\s:.-]*"
+)
+
+# La evolución de cada historia armada desde `consultas`, una visita por línea
+# ("fecha notas", en orden): el mismo formato que _split_evolucion vuelve a partir, así
+# un exporte (exporter.py) se puede reimportar sin perder visitas. `historias.evolucion_seguimiento`
+# quedó en NULL desde la migración 4 y no se debe leer.
+EVOLUCION_SQL = """(SELECT group_concat(linea, char(10)) FROM (
+    SELECT fecha || ' ' || notas AS linea FROM consultas
+    WHERE historia_id = historias.id ORDER BY fecha, id))"""
+
+def _parse_line_date(line: str):
+    m = _DATE_LINE_RE.match(line)
+    if not m:
+        return None, line
+    try:
+        if m.group("iy"):
+            d = datetime.date(int(m.group("iy")), int(m.group("im")), int(m.group("id")))
+        else:
+            y = int(m.group("y"))
+            y = y + 2000 if y < 100 else y
+            d = datetime.date(y, int(m.group("m")), int(m.group("d")))
+        fecha = d.isoformat()
+        if m.group("hh"):
+            fecha += " " + datetime.time(int(m.group("hh")), int(m.group("mi"))).strftime("%H:%M")
+    except ValueError:
+        return None, line
+    return fecha, line[m.end():]
+
+def _split_evolucion(texto: str, fecha_base: str):
+    """
+    Parte un texto de evolución viejo en [(fecha, notas), ...]. Cada línea que empieza
+    con una fecha abre una visita; lo anterior a la primera fecha queda en `fecha_base`.
+    """
+    visitas, fecha, lines = [], fecha_base, []
+    for line in (texto or "").replace("\r", "").split("\n"):
+        nueva, resto = _parse_line_date(line)
+        if nueva:
+            if "\n".join(lines).strip():
+                visitas.append((fecha, "\n".join(lines).strip()))
+            fecha, lines = nueva, [resto]
+        else:
+            lines.append(line)
+    if "\n".join(lines).strip():
+        visitas.append((fecha, "\n".join(lines).strip()))
+    # Texto sin fecha antes de la primera visita fechada: se escribió antes que ésta
+    if len(visitas) > 1 and visitas[0][0] == fecha_base and not _DATE_LINE_RE.match(texto):
+        visitas[0] = (visitas[1][0], visitas[0][1])
+    return visitas
+
+def agregar_consulta(cur, historia_id: int, notas: str, fecha: str | None = None) -> int:
+    """Agrega una visita a la historia; `fecha` ISO (por defecto, ahora). Devuelve su id."""
+    fecha = fecha or datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    cur.execute("""INSERT INTO consultas (historia_id, fecha, notas, created_at)
+                   VALUES (?, ?, ?, datetime('now'))""", (historia_id, fecha, notas))
+    return cur.lastrowid
+
+def listar_consultas(cur, historia_id: int, after=None, limit: int = 50, newest_first: bool = False):
+    """
+    Visitas de una historia paginadas por (fecha, id) usando idx_consultas_historia_fecha.
+    Filas: (id, fecha, notas). Devuelve (rows, next_after) igual que listar_pagina.
+    """
+    op, direction = ("<", "DESC") if newest_first else (">", "ASC")
+    sql = "SELECT id, fecha, notas FROM consultas WHERE historia_id = ?"
+    params = (historia_id,)
+    if after is not None:
+        sql += f" AND (fecha, id) {op} (?, ?)"
+        params += tuple(after)
+    sql += f" ORDER BY fecha {direction}, id {direction} LIMIT ?"
+    cur.execute(sql, params + (limit,))
+    rows = cur.fetchall()
+    if len(rows) < limit:
+        return rows, None
+    return rows, (rows[-1][1], rows[-1][0])
+
+def iter_consultas(cur, historia_id: int, page_size: int = 200):
+    """Todas las visitas de una historia en orden cronológico, de a páginas."""
+    after = None
+    while True:
+        rows, after = listar_consultas(cur, historia_id, after, page_size)
+        yield from rows
+        if after is None:
+            return
+
+# ------------------------- Lectura de una historia -------------------------
+class LRUCache:
+    """
+    Cache LRU chica y thread-safe (clave -> fila completa). Cada discard()/clear() sube
+    la generación: put(..., gen) con la generación leída antes de ir a la BD no guarda
+    una fila que otra sesión invalidó mientras tanto.
+    """
+
+    def __init__(self, maxsize: int = 64):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._gen = 0
+
+    def generation(self) -> int:
+        with self._lock:
+            return self._gen
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value, gen: int | None = None):
+        with self._lock:
+            if gen is not None and gen != self._gen:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._gen += 1
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._gen += 1
+            self._data.clear()
+
+# Historias abiertas recientemente, por (archivo de la BD, id); se invalida en cada UPDATE/DELETE
+historias_cache = LRUCache(64)
+
+def _cache_key(cur, row_id: int) -> tuple:
+    """(archivo, id): el mismo id en dos BDs abiertas no comparte entrada."""
+    # Cursor propio: no pisar el resultado pendiente del cursor de quien llama
+    path = cur.connection.execute("PRAGMA database_list").fetchone()[2]
+    return (path or id(cur.connection), int(row_id))
+
+def obtener_historia(cur, row_id: int):
+    """
+    Fila completa de una historia (mismo orden que `SELECT * FROM historias`),
+    o None si no existe. Usa la cache LRU de historias abiertas.
+    """
+    key = _cache_key(cur, row_id)
+    row = historias_cache.get(key)
+    if row is None:
+        gen = historias_cache.generation()
+        cur.execute("SELECT * FROM historias WHERE id=?", (key[1],))
+        row = cur.fetchone()
+        if row is not None:
+            historias_cache.put(key, row, gen)
+    return row
+
+# ------------------------- Lectura paginada -------------------------
+# Orden (columna visible de la lista) -> expresiones de la clave keyset; la última es
+# siempre id para desempatar. Es la lista de columnas permitidas: lo que llega de la UI
+# se busca acá y nunca se interpola en el SQL. Los NULL se llevan a '' / -1 porque la
+# comparación de la clave con NULL no encuentra nada. Con índice (incluyen el rowid):
+# id (PK), nombre (idx_historias_nombre_norm) y, desde la migración 6, dni, edad y obra social;
+# el resto (columnas de texto libre) se ordena sin índice.
+PAGE_ORDERS = {
+    "id": ("id",),
+    "nombre": ("nombre_norm", "id"),
+    "dni": ("ifnull(dni_norm, '')", "id"),
+    "edad": ("ifnull(edad, -1)", "id"),
+    "obra_social": ("ifnull(obra_social, '') COLLATE NOCASE", "id"),
+    "numero_beneficio": ("ifnull(numero_beneficio, '')", "id"),
+    "telefono": ("ifnull(telefono, '')", "id"),
+    "motivo_consulta": ("ifnull(motivo_consulta, '') COLLATE NOCASE", "id"),
+}
+
+# Filtros combinables de la lista ({nombre: valor}); los vacíos se ignoran.
+FILTROS = ("nombre", "dni", "texto", "obra_social", "edad_min", "edad_max", "creado_desde", "creado_hasta")
+
+def _fecha(valor: str, campo: str) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(valor)
+    except ValueError:
+        raise ValueError(f"{campo}: fecha inválida (usar AAAA-MM-DD)") from None
+
+def _utc(fecha: datetime.date) -> str:
+    """
+    Las 0 h locales de `fecha` en UTC y con el formato de datetime('now'), que es
+    como se guarda created_at: así "creada el 3" es el día 3 de este reloj.
+    """
+    local = datetime.datetime.combine(fecha, datetime.time()).astimezone()
+    return local.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def _edad(valor: str, campo: str) -> int:
+    try:
+        return int(valor)
+    except ValueError:
+        raise ValueError(f"{campo}: la edad debe ser un número entero") from None
+
+def filtros_lista(crit: str | None = None, q: str | None = None, filtros: dict | None = None) -> dict:
+    """Junta el filtro simple (criterio + texto del buscador) con los filtros combinados."""
+    out = {k: v for k, v in (filtros or {}).items() if str(v if v is not None else "").strip()}
+    for k in out:
+        if k not in FILTROS:
+            raise ValueError(f"Filtro no soportado: {k}")
+    q = (q or "").strip()
+    if q:
+        crit = crit or "nombre"
+        if crit not in ("nombre", "dni", "texto"):
+            raise ValueError(f"Criterio no soportado: {crit}")
+        out[crit] = q
+    return out
+
+# Menos dígitos que esto no es un DNI completo: se busca como parte del número
+DNI_DIGITOS_MIN = 7
+_DNI_RANGO = "dni_norm >= ? AND dni_norm < ?"
+
+def _hay_prefijo_dni(cur, digits: str) -> bool:
+    row = cur.connection.execute(f"SELECT 1 FROM historias WHERE {_DNI_RANGO} LIMIT 1",
+                                 (digits, digits + ":")).fetchone()
+    return row is not None
+
+def _where_filtros(filtros: dict, cur=None):
+    """
+    WHERE de los filtros combinados (todos con AND). Cada condición está escrita
+    igual que la expresión de su índice, para que SQLite lo pueda usar.
+    Con `cur`, un DNI completo que no es prefijo de ninguno pasa a buscarse como
+    parte del número (sin `cur` queda el rango sobre el índice).
+    """
+    conds, params = [], []
+    val = lambda k: str(filtros.get(k) if filtros.get(k) is not None else "").strip()
+
+    if val("nombre"):
+        conds.append("nombre_norm LIKE ?")
+        params.append(f"%{normalizar_nombre(val('nombre'))}%")
+    if val("dni"):
+        # "12.345.678", "12 345" y "12345678" buscan lo mismo. Un DNI completo va por
+        # rango sobre el índice único; uno parcial ("5678") o que no es prefijo de
+        # ninguno (un DNI dentro de un CUIT) se busca en cualquier parte del número.
+        digits = normalizar_dni(val("dni"))
+        if digits and len(digits) >= DNI_DIGITOS_MIN and (cur is None or _hay_prefijo_dni(cur, digits)):
+            conds.append(_DNI_RANGO)   # ':' va después de '9'
+            params += [digits, digits + ":"]
+        elif digits:
+            conds.append("dni_norm LIKE '%' || ? || '%'")
+            params.append(digits)
+        else:
+            conds.append("dni LIKE ?")
+            params.append(f"%{val('dni')}%")
+    if val("texto"):
+        match = _fts_query(val("texto"))
+        if match:
+            conds.append("""id IN (SELECT rowid FROM historias_fts WHERE historias_fts MATCH ?
+                                   UNION
+                                   SELECT c.historia_id FROM consultas_fts JOIN consultas c ON c.id = consultas_fts.rowid
+                                   WHERE consultas_fts MATCH ?)""")
+            params += [match, match]
+    if val("obra_social"):
+        conds.append("ifnull(obra_social, '') COLLATE NOCASE = ?")
+        params.append(val("obra_social"))
+    if val("edad_min") or val("edad_max"):
+        # Siempre con los dos extremos: así quedan afuera las edades vacías (-1)
+        conds.append("ifnull(edad, -1) BETWEEN ? AND ?")
+        params += [_edad(val("edad_min"), "Edad desde") if val("edad_min") else 0,
+                   _edad(val("edad_max"), "Edad hasta") if val("edad_max") else 200]
+    if val("creado_desde"):
+        conds.append("created_at >= ?")
+        params.append(_utc(_fecha(val("creado_desde"), "Creada desde")))
+    if val("creado_hasta"):
+        conds.append("created_at < ?")
+        params.append(_utc(_fecha(val("creado_hasta"), "Creada hasta") + datetime.timedelta(days=1)))
+    return " AND ".join(conds), tuple(params)
+
+def _filter_clause(crit: str | None, q: str | None, filtros: dict | None = None, cur=None):
+    """WHERE para el filtro de la tabla: criterio simple (nombre/DNI/texto) + filtros combinados."""
+    return _where_filtros(filtros_lista(crit, q, filtros), cur)
+
+def obtener_fila_lista(cur, row_id: int, crit: str | None = None, q: str | None = None,
+                       filtros: dict | None = None):
+    """
+    La fila de `row_id` con el mismo formato que listar_pagina, o None si no existe
+    o no pasa el filtro (crit/q/filtros). Sirve para actualizar una sola fila de la tabla.
+    """
+    where, params = _filter_clause(crit, q, filtros, cur)
+    sql = f"SELECT {', '.join(LIST_COLUMNS)}, nombre_norm FROM historias WHERE id = ?"
+    if where:
+        sql += " AND " + where
+    cur.execute(sql, (row_id,) + params)
+    return cur.fetchone()
+
+def _edad_key(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return -1
+
+# Lo mismo que PAGE_ORDERS pero calculado en Python sobre una fila de listar_pagina
+# (para ubicar una fila nueva en la lista ya cargada sin volver a consultar).
+# COLLATE NOCASE de SQLite sólo pliega ASCII: lower() alcanza para ubicar la fila.
+_ROW_KEYS = {
+    "id": lambda r: (r[0],),
+    "nombre": lambda r: (r[-1] or "", r[0]),
+    "dni": lambda r: (normalizar_dni(r[2]), r[0]),
+    "edad": lambda r: (_edad_key(r[3]), r[0]),
+    "obra_social": lambda r: ((r[4] or "").lower(), r[0]),
+    "numero_beneficio": lambda r: (r[5] or "", r[0]),
+    "telefono": lambda r: (r[6] or "", r[0]),
+    "motivo_consulta": lambda r: ((r[7] or "").lower(), r[0]),
+}
+
+def row_key(order: str, row) -> tuple:
+    """Clave de orden (la del cursor keyset) de una fila de listar_pagina."""
+    return _ROW_KEYS[order](row)
+
+def _page_sql(order: str, after, limit: int, filtros: dict, desc: bool, cur=None):
+    if order not in PAGE_ORDERS:
+        raise ValueError(f"Orden no soportado: {order}")
+    keys = PAGE_ORDERS[order]
+    where, params = _where_filtros(filtros, cur)
+    conds = [where] if where else []
+    # El rango de un DNI trae pocas filas: mejor ordenarlas que recorrer el índice del
+    # orden filtrando (SQLite elige eso con el keyset). El '+' le saca el índice a la clave.
+    orden = tuple("+" + k for k in keys) if _DNI_RANGO in where else keys
+    if after is not None:
+        op = "<" if desc else ">"
+        if len(keys) == 1:
+            conds.append(f"{orden[0]} {op} ?")
+            params += tuple(after)
+        else:
+            # (k, id) > (?, ?) escrito a mano: con índices de expresión SQLite sólo
+            # arranca la búsqueda en el índice si la primera clave va sola (k >= ?)
+            conds.append(f"{orden[0]} {op}= ? AND ({orden[0]} {op} ? OR {orden[1]} {op} ?)")
+            params += (after[0], after[0], after[1])
+    # Sólo columnas de la lista (+ nombre_norm), y al final la clave para el cursor
+    sql = (f"SELECT {', '.join(LIST_COLUMNS)}, nombre_norm, {', '.join(keys)} FROM historias"
+           + (" WHERE " + " AND ".join(conds) if conds else "")
+           + f" ORDER BY {', '.join(k + (' DESC' if desc else '') for k in orden)} LIMIT ?")
+    return sql, params + (limit,)
+
+def listar_pagina(cur, order: str = "id", after=None, limit: int = 200,
+                  crit: str | None = None, q: str | None = None,
+                  filtros: dict | None = None, desc: bool = False):
+    """
+    Una página de `historias` con paginación keyset: en vez de OFFSET se pide
+    "lo que viene después de `after`", así cada página cuesta lo mismo.
+    `order` es una clave de PAGE_ORDERS (`desc` invierte el sentido); `crit`/`q` es el
+    filtro simple del buscador y `filtros` los combinados (ver FILTROS).
+    Las filas traen LIST_COLUMNS (+ nombre_norm al final).
+    Devuelve (rows, next_after); next_after es None cuando no hay más filas.
+    """
+    nkeys = len(PAGE_ORDERS.get(order, ()))
+    sql, params = _page_sql(order, after, limit, filtros_lista(crit, q, filtros), desc, cur)
+    cur.execute(sql, params)
+    rows = cur.fetchall()
+    next_after = rows[-1][-nkeys:] if len(rows) == limit else None
+    return [r[:-nkeys] for r in rows], next_after
+
+def iter_historias(cur, ids=None, filtros: dict | None = None, chunk: int = 200):
+    """
+    Historias completas (como obtener_historia) de una lista de `ids` o de las que
+    pasan `filtros`, en orden de id y de a `chunk` filas: sirve para recorrer miles
+    sin cargarlas todas en memoria. No usa la cache LRU.
+    """
+    if ids is not None:
+        ids = sorted({int(i) for i in ids})
+        for i in range(0, len(ids), chunk):
+            part = ids[i:i + chunk]
+            cur.execute(f"SELECT * FROM historias WHERE id IN ({', '.join('?' for _ in part)}) ORDER BY id", part)
+            yield from cur.fetchall()
+        return
+    where, params = _where_filtros(filtros_lista(filtros=filtros), cur)
+    after = 0
+    while True:
+        conds = ["id > ?"] + ([where] if where else [])
+        cur.execute(f"SELECT * FROM historias WHERE {' AND '.join(conds)} ORDER BY id LIMIT ?",
+                    (after,) + params + (chunk,))
+        rows = cur.fetchall()
+        yield from rows
+        if len(rows) < chunk:
+            return
+        after = rows[-1][0]
+
+def contar_historias(cur, ids=None, filtros: dict | None = None) -> int:
+    """Cuántas filas va a devolver iter_historias con los mismos argumentos."""
+    if ids is not None:
+        ids = sorted({int(i) for i in ids})
+        n = 0
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            cur.execute(f"SELECT count(*) FROM historias WHERE id IN ({', '.join('?' for _ in part)})", part)
+            n += cur.fetchone()[0]
+        return n
+    where, params = _where_filtros(filtros_lista(filtros=filtros), cur)
+    cur.execute("SELECT count(*) FROM historias" + (f" WHERE {where}" if where else ""), params)
+    return cur.fetchone()[0]
+
+def explicar_pagina(cur, order: str = "id", crit: str | None = None, q: str | None = None,
+                    filtros: dict | None = None, desc: bool = False, after=None) -> list:
+    """
+    EXPLAIN QUERY PLAN de la consulta de listar_pagina: una línea por paso
+    ("SEARCH historias USING INDEX ..."). Un "SCAN historias" sin índice o un
+    "USE TEMP B-TREE FOR ORDER BY" indican que esa combinación recorre toda la tabla.
+    """
+    sql, params = _page_sql(order, after, 200, filtros_lista(crit, q, filtros), desc, cur)
+    cur.execute("EXPLAIN QUERY PLAN " + sql, params)
+    return [r[-1] for r in cur.fetchall()]
+
+# ------------------------- Búsqueda de texto completo -------------------------
+def _ensure_fts(cur):
+    """
+    Crea el índice FTS5 (external content sobre `historias`) y los triggers que
+    lo mantienen sincronizado. Si el índice es nuevo, lo llena con las filas existentes.
+    """
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='historias_fts'")
+    if cur.fetchone():
+        return
+
+    cols = ", ".join(FTS_COLUMNS)
+    new_cols = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+    old_cols = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+
+    # remove_diacritics 2: "hipertension" encuentra "hipertensión"
+    cur.execute(f"""
+    CREATE VIRTUAL TABLE historias_fts USING fts5(
+        {cols},
+        content='historias', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """)
+    cur.execute(f"""
+    CREATE TRIGGER historias_fts_ai AFTER INSERT ON historias BEGIN
+        INSERT INTO historias_fts(rowid, {cols}) VALUES (new.id, {new_cols});
+    END
+    """)
+    cur.execute(f"""
+    CREATE TRIGGER historias_fts_ad AFTER DELETE ON historias BEGIN
+        INSERT INTO historias_fts(historias_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+    END
+    """)
+    cur.execute(f"""
+    CREATE TRIGGER historias_fts_au AFTER UPDATE ON historias BEGIN
+        INSERT INTO historias_fts(historias_fts, rowid, {cols}) VALUES ('delete', old.id, {old_cols});
+        INSERT INTO historias_fts(rowid, {cols}) VALUES (new.id, {new_cols});
+    END
+    """)
+    cur.execute("INSERT INTO historias_fts(historias_fts) VALUES ('rebuild')")
+
+def _fts_query(q: str) -> str:
+    """
+    Convierte lo que escribe el usuario en una consulta FTS5 segura:
+    cada palabra va entre comillas (sin operadores) y como prefijo ("hipertensi*").
+    """
+    terms = re.findall(r"\w+", q or "")
+    return " ".join(f'"{t}"*' for t in terms)
+
+def buscar_texto(cur, q: str, limit: int = 200):
+    """
+    Busca `q` en los campos clínicos y en las notas de las visitas. Devuelve
+    [(row, snippet), ...] ordenado por relevancia (bm25), una entrada por historia;
+    `row` trae LIST_COLUMNS (+ nombre_norm) y `snippet` marca las coincidencias con «».
+    """
+    match = _fts_query(q)
+    if not match:
+        return []
+    cols = ", ".join("h." + c for c in LIST_COLUMNS + ("nombre_norm",))
+    cur.execute(f"""
+        WITH hits AS (
+            SELECT rowid AS hid, bm25(historias_fts) AS rank,
+                   snippet(historias_fts, -1, '«', '»', '…', 12) AS snip
+            FROM historias_fts WHERE historias_fts MATCH ?
+            UNION ALL
+            SELECT c.historia_id, bm25(consultas_fts),
+                   snippet(consultas_fts, -1, '«', '»', '…', 12)
+            FROM consultas_fts JOIN consultas c ON c.id = consultas_fts.rowid
+            WHERE consultas_fts MATCH ?
+        ),
+        best AS (
+            SELECT hid, rank, snip,
+                   row_number() OVER (PARTITION BY hid ORDER BY rank) AS rn
+            FROM hits
+        )
+        SELECT {cols}, best.snip
+        FROM best JOIN historias h ON h.id = best.hid
+        WHERE best.rn = 1
+        ORDER BY best.rank
+        LIMIT ?
+    """, (match, match, limit))
+    return [(r[:-1], r[-1]) for r in cur.fetchall()]
+
+# ------------------------- Búsqueda aproximada por nombre -------------------------
+def trigramas(nombre_norm: str) -> set:
+    """Trigramas de cada palabra con relleno ("  ana " -> "  a", " an", "ana", "na ")."""
+    out = set()
+    for word in (nombre_norm or "").split():
+        w = f"  {word} "
+        out.update(w[i:i + 3] for i in range(len(w) - 2))
+    return out
+
+def _jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+def _index_trigramas(cur, pares, replace: bool = True):
+    """(Re)indexa los trigramas de [(historia_id, nombre_norm), ...]."""
+    pares = list(pares)
+    if replace:
+        cur.executemany("DELETE FROM nombre_trigramas WHERE historia_id = ?", [(i,) for i, _ in pares])
+    cur.executemany("INSERT OR IGNORE INTO nombre_trigramas (trigrama, historia_id) VALUES (?, ?)",
+                    [(t, i) for i, nombre in pares for t in trigramas(nombre)])
+
+def buscar_nombre(cur, q: str, limit: int = 50, umbral: float = 0.3, candidatos: int = 200,
+                  presupuesto: int = 20000):
+    """
+    Búsqueda aproximada de pacientes por nombre: sin acentos ni mayúsculas y tolerante
+    a errores de tipeo ("Gonzales" encuentra "González"). Devuelve [(row, similitud), ...]
+    de mayor a menor similitud (0..1); `row` trae LIST_COLUMNS + nombre_norm.
+
+    1) el índice nombre_trigramas elige los `candidatos` con más trigramas en común,
+       usando primero los trigramas más raros y sólo hasta recorrer `presupuesto`
+       entradas del índice (los muy comunes, como los de "maria", no discriminan);
+    2) se ordenan por similitud de Jaccard entre conjuntos de trigramas (1.0 si la
+       búsqueda aparece tal cual dentro del nombre).
+    """
+    q_norm = normalizar_nombre(q)
+    q_tris = trigramas(q_norm)
+    if not q_tris:
+        return []
+    frecuencia = {}
+    for t in q_tris:
+        cur.execute("SELECT count(*) FROM (SELECT 1 FROM nombre_trigramas WHERE trigrama = ? LIMIT ?)",
+                    (t, presupuesto + 1))
+        frecuencia[t] = cur.fetchone()[0]
+    tris, total = [], 0
+    for t in sorted(q_tris, key=lambda t: (frecuencia[t], t)):
+        if total + frecuencia[t] > presupuesto:
+            break
+        tris.append(t)
+        total += frecuencia[t]
+    if total:
+        cur.execute(f"""
+            SELECT h.{', h.'.join(LIST_COLUMNS)}, h.nombre_norm
+            FROM (SELECT historia_id, count(*) AS comunes FROM nombre_trigramas
+                  WHERE trigrama IN ({', '.join('?' for _ in tris)})
+                  GROUP BY historia_id
+                  ORDER BY comunes DESC
+                  LIMIT ?) t
+            JOIN historias h ON h.id = t.historia_id
+        """, tris + [candidatos])
+    else:
+        # Nada raro en lo buscado: sobran coincidencias literales
+        cur.execute(f"""
+            SELECT {', '.join(LIST_COLUMNS)}, nombre_norm FROM historias
+            WHERE nombre_norm LIKE ? LIMIT ?
+        """, (f"%{q_norm}%", candidatos))
+    rows = cur.fetchall()
+
+    q_words = [trigramas(p) for p in q_norm.split()]
+    found = []
+    for row in rows:
+        nombre_norm = row[-1] or ""
+        if q_norm in nombre_norm:
+            score = 1.0
+        else:
+            # Lo mejor entre el nombre completo y palabra por palabra (cada palabra
+            # buscada contra la más parecida del nombre), para no penalizar
+            # "gonzales" por el resto de "maria jose gonzalez"
+            n_words = [trigramas(w) for w in nombre_norm.split()]
+            score = _jaccard(q_tris, trigramas(nombre_norm))
+            if n_words:
+                score = max(score, sum(max(_jaccard(qw, nw) for nw in n_words) for qw in q_words) / len(q_words))
+        if score >= umbral:
+            found.append((row, score))
+    found.sort(key=lambda x: (-x[1], x[0][-1] or ""))
+    return found[:limit]
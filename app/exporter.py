@@ -0,0 +1,240 @@
+# exporter.py
+"""
+Exportación de historias en streaming: las filas se leen de a `chunk` con fetchmany
+y se escriben apenas llegan, así la memoria es la misma para 100 que para 500.000
+historias. Formatos (por la extensión del archivo, o `formato`):
+
+    csv    ';' y UTF-8 con BOM (Excel lo abre directo; importer.py lo vuelve a leer)
+    jsonl  un objeto JSON por línea (también lo lee importer.py)
+    xlsx   planilla de Excel/LibreOffice, escrita a mano (zip + XML) sin dependencias
+
+    rep = exportar(db.reader().cursor(), "/tmp/pami.xlsx", filtros={"obra_social": "PAMI"},
+                   columnas=["id", "nombre", "dni"], on_progress=lambda n, total: ...)
+
+El archivo se escribe como <destino>.parcial y se renombra al terminar: si se cancela
+(on_progress lanza TareaCancelada) o falla, no queda un archivo a medias.
+"""
+import io
+import os
+import re
+import csv
+import sys
+import json
+import time
+import zipfile
+import argparse
+from xml.sax.saxutils import escape
+
+from db import DATA_COLUMNS, EVOLUCION_SQL, contar_historias, filtros_lista, _where_filtros
+
+# Columnas exportables (y su orden por defecto). Las *_norm son internas de la búsqueda.
+EXPORT_COLUMNS = ("id",) + DATA_COLUMNS + ("evolucion_seguimiento", "created_at", "updated_at")
+# Columnas que no se leen tal cual de `historias`
+_EXPRESIONES = {"evolucion_seguimiento": f"{EVOLUCION_SQL} AS evolucion_seguimiento"}
+FORMATOS = ("csv", "jsonl", "xlsx")
+CHUNK = 1000
+BUFFER = 1 << 20   # 1 MB de buffer de escritura
+
+XLSX_MAX_FILAS = 1_048_576 - 1    # límite de Excel, menos el encabezado
+XLSX_MAX_CELDA = 32_767
+
+def formato_de(path: str, formato: str | None = None) -> str:
+    formato = (formato or os.path.splitext(path)[1].lstrip(".") or "csv").lower()
+    if formato == "ndjson":
+        formato = "jsonl"
+    if formato not in FORMATOS:
+        raise ValueError(f"Formato no soportado: {formato!r} (opciones: {', '.join(FORMATOS)})")
+    return formato
+
+def _columnas(columnas) -> tuple:
+    if not columnas:
+        return EXPORT_COLUMNS
+    pedidas = tuple(dict.fromkeys(columnas))
+    malas = [c for c in pedidas if c not in EXPORT_COLUMNS]
+    if malas:
+        raise ValueError(f"Columnas desconocidas: {', '.join(malas)}")
+    return pedidas
+
+# ------------------------- escritores -------------------------
+class _EscritorCSV:
+    def __init__(self, f, columnas):
+        self._f = io.TextIOWrapper(f, encoding="utf-8-sig", newline="")
+        self._w = csv.writer(self._f, delimiter=";")
+        self._w.writerow(columnas)
+
+    def filas(self, rows):
+        self._w.writerows(rows)
+
+    def cerrar(self):
+        self._f.flush()
+        self._f.detach()
+
+class _EscritorJSONL:
+    def __init__(self, f, columnas):
+        self._f = f
+        self._columnas = columnas
+
+    def filas(self, rows):
+        cols = self._columnas
+        self._f.write("".join(json.dumps(dict(zip(cols, r)), ensure_ascii=False) + "\n"
+                              for r in rows).encode("utf-8"))
+
+    def cerrar(self):
+        pass
+
+# Caracteres que XML 1.0 no permite (Excel rechaza el archivo si aparecen)
+_XML_INVALIDOS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f￾￿]")
+
+def _celda(v) -> str:
+    if v is None or v == "":
+        return "<c/>"
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return f"<c t=\"n\"><v>{v}</v></c>"
+    texto = _XML_INVALIDOS.sub("", str(v))[:XLSX_MAX_CELDA]
+    return f"<c t=\"inlineStr\"><is><t xml:space=\"preserve\">{escape(texto)}</t></is></c>"
+
+_XLSX_FIJOS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Historias" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>'),
+}
+
+class _EscritorXLSX:
+    """Una hoja con celdas de texto en línea (sin sharedStrings, que obligaría a juntar todo)."""
+
+    def __init__(self, f, columnas):
+        self._zip = zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED)
+        for nombre, xml in _XLSX_FIJOS.items():
+            self._zip.writestr(nombre, xml)
+        self._hoja = self._zip.open("xl/worksheets/sheet1.xml", "w", force_zip64=True)
+        self._hoja.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                          '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                          '<sheetViews><sheetView workbookViewId="0"><pane ySplit="1" topLeftCell="A2" '
+                          'activePane="bottomLeft" state="frozen"/></sheetView></sheetViews>'
+                          '<sheetData>').encode("utf-8"))
+        self.filas([columnas])
+
+    def filas(self, rows):
+        self._hoja.write("".join("<row>" + "".join(_celda(v) for v in r) + "</row>"
+                                 for r in rows).encode("utf-8"))
+
+    def cerrar(self):
+        self._hoja.write(b"</sheetData></worksheet>")
+        self._hoja.close()
+        self._zip.close()
+
+_ESCRITORES = {"csv": _EscritorCSV, "jsonl": _EscritorJSONL, "xlsx": _EscritorXLSX}
+
+# ------------------------- lectura -------------------------
+def _lotes(cur, columnas, filtros=None, ids=None, chunk: int = CHUNK):
+    """Listas de hasta `chunk` filas (en orden de id) con sólo `columnas`."""
+    select = f"SELECT {', '.join(_EXPRESIONES.get(c, c) for c in columnas)} FROM historias"
+    if ids is not None:
+        ids = sorted({int(i) for i in ids})
+        for i in range(0, len(ids), chunk):
+            part = ids[i:i + chunk]
+            cur.execute(f"{select} WHERE id IN ({', '.join('?' for _ in part)}) ORDER BY id", part)
+            rows = cur.fetchall()
+            if rows:
+                yield rows
+        return
+    where, params = _where_filtros(filtros_lista(filtros=filtros), cur)
+    cur.execute(select + (f" WHERE {where}" if where else "") + " ORDER BY id", params)
+    while True:
+        rows = cur.fetchmany(chunk)
+        if not rows:
+            return
+        yield rows
+
+def exportar(cur, path: str, formato: str | None = None, columnas=None, filtros: dict | None = None,
+             ids=None, chunk: int = CHUNK, on_progress=None) -> dict:
+    """
+    Exporta las historias que pasan `filtros` (o las de `ids`; todas si no hay ninguno)
+    a `path`. columnas: subconjunto de EXPORT_COLUMNS (None = todas, en ese orden).
+    on_progress(n, total) después de cada lote escrito.
+    Devuelve {"path", "formato", "filas", "bytes", "segundos"}.
+    """
+    formato = formato_de(path, formato)
+    columnas = _columnas(columnas)
+    t0 = time.perf_counter()
+    total = contar_historias(cur, ids=ids, filtros=filtros)
+    if formato == "xlsx" and total > XLSX_MAX_FILAS:
+        raise ValueError(f"Excel admite hasta {XLSX_MAX_FILAS} filas por hoja y son {total}: "
+                         "exportá a CSV o JSONL, o filtrá el listado")
+
+    tmp = path + ".parcial"
+    n = 0
+    try:
+        with open(tmp, "wb", buffering=BUFFER) as f:
+            escritor = _ESCRITORES[formato](f, columnas)
+            for rows in _lotes(cur, columnas, filtros=filtros, ids=ids, chunk=chunk):
+                escritor.filas(rows)
+                n += len(rows)
+                if on_progress:
+                    on_progress(n, total)
+            escritor.cerrar()
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+    rep = {"path": path, "formato": formato, "filas": n, "bytes": os.path.getsize(path),
+           "segundos": time.perf_counter() - t0}
+    print(f"[DEBUG] Exportadas {n} historias a {path} ({formato}, {rep['bytes'] / 1e6:.1f} MB, "
+          f"{rep['segundos']:.1f} s)")
+    return rep
+
+# ------------------------- consola -------------------------
+def main(argv=None):
+    import sqlite3
+
+    ap = argparse.ArgumentParser(description="Exportar historias (CSV, JSONL o XLSX)")
+    ap.add_argument("destino")
+    ap.add_argument("--db", help="archivo .db (por defecto el de la app)")
+    ap.add_argument("--formato", choices=FORMATOS, help="por defecto, según la extensión")
+    ap.add_argument("--columnas", nargs="*", help=f"de: {' '.join(EXPORT_COLUMNS)}")
+    ap.add_argument("--filtro", action="append", default=[], metavar="CLAVE=VALOR",
+                    help="filtros de la lista (nombre, dni, texto, obra_social, edad_min, ...)")
+    args = ap.parse_args(argv)
+
+    if args.db:
+        db_path = args.db
+    else:
+        from paths import get_paths
+        db_path = get_paths()["DB_NAME"]
+    filtros = dict(f.split("=", 1) for f in args.filtro)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rep = exportar(conn.cursor(), args.destino, args.formato, args.columnas, filtros or None,
+                       on_progress=lambda n, total: print(f"\r{n} de {total}", end="", file=sys.stderr))
+    finally:
+        conn.close()
+    print(f"\n{rep['filas']} historias -> {rep['path']} ({rep['bytes'] / 1e6:.1f} MB, {rep['segundos']:.1f} s)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+# importer.py
+import os
+import csv
+import json
+import time
+import sqlite3
+
+from validators import validar_campos
+from db import DATA_COLUMNS, upsert_historias
+
+# Campos que se leen de cada registro (las columnas de export_csv; `id` se ignora)
+IMPORT_FIELDS = DATA_COLUMNS + ("evolucion_seguimiento",)
+
+def _iter_csv(path: str):
+    """Filas del CSV con ';' que escribe export_csv: [(nro_linea, dict), ...]."""
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.DictReader(f, delimiter=";")
+        for row in reader:
+            yield reader.line_num, row
+
+def _iter_jsonl(path: str):
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for n, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                obj = json.loads(line)
+            except json.JSONDecodeError as ex:
+                yield n, ex
+                continue
+            yield n, obj if isinstance(obj, dict) else ValueError("La línea no es un objeto JSON")
+
+def _to_record(raw: dict) -> dict:
+    return {k: ("" if raw.get(k) is None else str(raw.get(k)).strip()) for k in IMPORT_FIELDS}
+
+def importar_pacientes(db, path: str, batch_size: int = 1000, on_progress=None) -> dict:
+    """
+    Importa pacientes desde CSV (';', formato de export_csv) o JSONL, en streaming.
+    Valida cada fila con validar_campos y hace upsert por DNI normalizado en lotes
+    (un executemany por lote, cada uno en su db.transaction()).
+    `on_progress(procesadas)` se llama por lote.
+
+    Devuelve {"insertadas", "actualizadas", "errores": [(linea, msg), ...],
+              "procesadas", "segundos", "filas_por_seg"}.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    rows = _iter_jsonl(path) if ext in (".jsonl", ".ndjson", ".json") else _iter_csv(path)
+
+    report = {"insertadas": 0, "actualizadas": 0, "errores": [], "procesadas": 0}
+    t0 = time.perf_counter()
+    batch, lines = [], []
+
+    def flush():
+        if not batch:
+            return
+        try:
+            with db.transaction() as cur:
+                ins, upd = upsert_historias(cur, batch)
+        except sqlite3.Error:
+            ins = upd = 0
+            # Reintento fila por fila para saber cuál falla
+            for linea, data in zip(lines, batch):
+                try:
+                    with db.transaction() as cur:
+                        i, u = upsert_historias(cur, [data])
+                    ins += i; upd += u
+                except sqlite3.Error as ex:
+                    report["errores"].append((linea, str(ex)))
+        report["insertadas"] += ins
+        report["actualizadas"] += upd
+        batch.clear(); lines.clear()
+        if on_progress:
+            on_progress(report["procesadas"])
+
+    for linea, raw in rows:
+        report["procesadas"] += 1
+        if isinstance(raw, Exception):
+            report["errores"].append((linea, f"JSON inválido: {raw}"))
+            continue
+        data = _to_record(raw)
+        ok, msg = validar_campos(data)
+        if not ok:
+            report["errores"].append((linea, msg))
+            continue
+        batch.append(data); lines.append(linea)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    report["segundos"] = time.perf_counter() - t0
+    report["filas_por_seg"] = report["procesadas"] / report["segundos"] if report["segundos"] else 0.0
+    print(f"[DEBUG] Importación: {report['insertadas']} nuevas, {report['actualizadas']} actualizadas, "
+          f"{len(report['errores'])} errores, {report['filas_por_seg']:.0f} filas/s")
+    return report
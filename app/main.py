@@ -17,7 +17,7 @@ from paths import get_paths
 from db import init_db
 from validators import validar_campos
 from pdf_utils import generar_pdf
-from backup_drive import can_backup, backup_now , maybe_auto_backup
+from backup_drive import can_backup, backup_now
 
 
 
@@ -25,11 +25,13 @@ def app_main(page: ft.Page):
     # Setup básico
     paths = get_paths()
     conn, cur = init_db(paths["DB_NAME"])
-    # Construye la interfaz y conecta handlers
-    maybe_auto_backup(paths) 
+    # Construye la interfaz y conecta handlers (el backup automático arranca desde ahí)
     make_app(page, conn, cur, paths)
 
 
 
 if __name__ == "__main__":
+    # Los PDFs por lote usan un pool de procesos: en el .exe (PyInstaller) hace falta esto
+    import multiprocessing
+    multiprocessing.freeze_support()
     ft.app(target=app_main)
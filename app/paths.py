@@ -32,6 +32,7 @@ def get_paths():
     db_dir     = os.path.join(base_dir, "db")
     pdfs_dir   = os.path.join(base_dir, "PDFs")
     images_dir = os.path.join(base_dir, "imagenes")
+    backups_dir = os.path.join(base_dir, "backups")   # backups incrementales locales (backup_store.py)
 
     # 3) Rutas finales
     db_path     = os.path.join(db_dir, DB_FILENAME)
@@ -71,13 +72,26 @@ def get_paths():
         "DB_NAME": db_path,        # <- usa esto en init_db()
         "PDFS_DIR": pdfs_dir,
         "IMAGES_DIR": images_dir,
+        "BACKUPS_DIR": backups_dir,
         "LOGO_PATH": logo_path,
         "CLIENT_SECRETS": client_json,
         "TOKEN_FILE": token_file,
         "DRIVE_FOLDER_NAME": "Backups Consultorio Dra. Zulma Cabrera",
+        "PAGE_SIZE": _page_size(cfg),
     }
 
 
+DEFAULT_PAGE_SIZE = 200
+
+def _page_size(cfg: dict) -> int:
+    """Filas por página de la tabla (config.json: "page_size")."""
+    try:
+        n = int(cfg.get("page_size", DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return DEFAULT_PAGE_SIZE
+    return max(20, min(n, 5000))
+
+
 def _config_file(base_dir: str) -> str:
     return os.path.join(base_dir, "config.json")
 
@@ -0,0 +1,221 @@
+# pdf_batch.py
+"""
+PDFs de muchas historias a la vez (auditorías, presentaciones a obras sociales):
+las filas se leen de a poco de SQLite y se renderizan en paralelo en un pool de
+procesos (fpdf2 es Python puro: con hilos no se usan los otros núcleos), o todas
+juntas en un único PDF con índice (generar_reporte).
+"""
+import os
+import csv
+import time
+import datetime
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from db import iter_historias, contar_historias, iter_consultas, listar_pagina
+from pdf_utils import generar_pdf, render_context, generar_reporte_pdf
+
+def _render_lote(paths: dict, items: list) -> list:
+    """
+    Corre en un proceso del pool: genera los PDFs de `items` [(row, consultas), ...].
+    Un error en una historia no corta el resto: devuelve [(id, nombre, ruta, error), ...].
+    Sin caché de PDFs: cada lote va a una carpeta nueva y varios procesos escribirían
+    el mismo manifiesto.
+    """
+    out = []
+    for row, consultas in items:
+        try:
+            out.append((row[0], row[1], generar_pdf(paths, row, consultas, cache=False), None))
+        except Exception as ex:
+            out.append((row[0], row[1], None, f"{type(ex).__name__}: {ex}"))
+    return out
+
+def _lotes(cur, ids, filtros, por_lote: int):
+    """(row, consultas) agrupados de a `por_lote`, leyendo la BD a medida que se piden."""
+    lote = []
+    for row in iter_historias(cur, ids=ids, filtros=filtros):
+        # Otro cursor para las visitas: `cur` es el que recorre las historias
+        lote.append((row, list(iter_consultas(cur.connection.cursor(), row[0]))))
+        if len(lote) >= por_lote:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+def generar_pdfs_lote(db, paths: dict, ids=None, filtros: dict | None = None, out_dir: str | None = None,
+                      workers: int | None = None, por_lote: int = 8, on_progress=None) -> dict:
+    """
+    Genera un PDF por historia para `ids` (lista de ids) o, si no se pasan, para las
+    historias que cumplen `filtros` (los de db.listar_pagina; vacío = todas).
+
+    - Lee con db.reader() en este hilo y manda de a `por_lote` historias a cada
+      proceso; nunca hay más de 2 × workers lotes en vuelo (memoria acotada).
+    - on_progress(hechos, total, errores) después de cada lote; si lanza una
+      excepción (p.ej. TareaCancelada) se cancela lo pendiente y se propaga.
+    - Los PDFs van a `out_dir` (por defecto PDFS_DIR/Lote_AAAAMMDD_HHMMSS); si hubo
+      errores, también `errores.csv` con uno por historia.
+
+    Devuelve {"carpeta", "total", "generados", "errores": [(id, nombre, msg), ...],
+              "segundos", "pdfs_por_seg"}.
+    """
+    workers = workers or os.cpu_count() or 2
+    out_dir = out_dir or os.path.join(paths["PDFS_DIR"], f"Lote_{datetime.datetime.now():%Y%m%d_%H%M%S}")
+    os.makedirs(out_dir, exist_ok=True)
+    paths_lote = dict(paths, PDFS_DIR=out_dir)
+
+    cur = db.reader().cursor()
+    total = contar_historias(cur, ids=ids, filtros=filtros)
+    rep = {"carpeta": out_dir, "total": total, "generados": 0, "errores": []}
+    t0 = time.perf_counter()
+
+    lotes = _lotes(cur, ids, filtros, por_lote)
+    pendientes = set()
+    # "spawn" como en Windows (la app se distribuye ahí): no hereda conexiones ni hilos
+    # Cada worker carga fuentes y logo una sola vez al arrancar (render_context)
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=render_context, initargs=(paths_lote,))
+    try:
+        while True:
+            while len(pendientes) < 2 * workers:
+                lote = next(lotes, None)
+                if lote is None:
+                    break
+                pendientes.add(pool.submit(_render_lote, paths_lote, lote))
+            if not pendientes:
+                break
+            listos, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+            for fut in listos:
+                for row_id, nombre, _ruta, error in fut.result():
+                    if error:
+                        rep["errores"].append((row_id, nombre, error))
+                    else:
+                        rep["generados"] += 1
+            if on_progress:
+                on_progress(rep["generados"] + len(rep["errores"]), total, len(rep["errores"]))
+    except BaseException:
+        for fut in pendientes:
+            fut.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    pool.shutdown()
+
+    rep["segundos"] = time.perf_counter() - t0
+    rep["pdfs_por_seg"] = rep["generados"] / rep["segundos"] if rep["segundos"] else 0.0
+    if rep["errores"]:
+        with open(os.path.join(out_dir, "errores.csv"), "w", encoding="utf-8-sig", newline="") as f:
+            w = csv.writer(f, delimiter=";")
+            w.writerow(["id", "nombre", "error"])
+            w.writerows(rep["errores"])
+    print(f"[DEBUG] Lote de PDFs: {rep['generados']}/{total} en {rep['segundos']:.1f} s "
+          f"({rep['pdfs_por_seg']:.1f} PDF/s), {len(rep['errores'])} errores")
+    return rep
+
+# ------------------------- Reporte combinado -------------------------
+_ETIQUETAS = {
+    "nombre": "Nombre", "dni": "DNI", "texto": "Texto", "obra_social": "Obra social",
+    "edad_min": "Edad desde", "edad_max": "Edad hasta", "creado_desde": "Alta desde", "creado_hasta": "Alta hasta",
+}
+
+def titulo_reporte(filtros: dict | None) -> str:
+    """'Historias clínicas — Obra social: PAMI, Edad desde: 80' (o sin filtros, 'todas')."""
+    partes = [f"{_ETIQUETAS.get(k, k)}: {v}" for k, v in (filtros or {}).items() if v not in (None, "")]
+    return "Historias clínicas — " + (", ".join(partes) if partes else "todas")
+
+def _historias_en_orden(cur, ids=None, filtros=None, chunk: int = 200):
+    """
+    (row, consultas) de `ids` en el orden dado, o de las que pasan `filtros` por
+    nombre (el orden del índice). Se leen de a `chunk`.
+    """
+    def bloques():
+        if ids is not None:
+            for i in range(0, len(ids), chunk):
+                yield ids[i:i + chunk]
+            return
+        after = None
+        while True:
+            rows, after = listar_pagina(cur, "nombre", after, chunk, filtros=filtros)
+            yield [r[0] for r in rows]
+            if after is None:
+                return
+
+    cur_visitas = cur.connection.cursor()
+    for bloque in bloques():
+        filas = {r[0]: r for r in iter_historias(cur, ids=bloque)}
+        for row_id in bloque:
+            if row_id in filas:
+                yield filas[row_id], list(iter_consultas(cur_visitas, row_id))
+
+def _archivo(base: str, parte: int, partes: int) -> str:
+    return f"{base}.pdf" if partes == 1 else f"{base}_parte{parte}.pdf"
+
+def _reservar_base(out_dir: str, nombre: str, partes: int) -> str:
+    """
+    Ruta base libre para un reporte (nombre, nombre_2, ...). Deja creado vacío el
+    primer archivo (O_EXCL): otro reporte pedido en el mismo segundo, en este u otro
+    proceso, ya no puede elegir el mismo nombre y pisarlo.
+    """
+    for n in itertools.count(1):
+        base = os.path.join(out_dir, nombre if n == 1 else f"{nombre}_{n}")
+        try:
+            os.close(os.open(_archivo(base, 1, partes), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return base
+        except FileExistsError:
+            continue
+
+def generar_reporte(db, paths: dict, ids=None, filtros: dict | None = None, titulo: str | None = None,
+                    out_dir: str | None = None, por_archivo: int = 1000, on_progress=None) -> dict:
+    """
+    Un PDF con índice y marcadores para `ids` (en ese orden) o para las historias que
+    cumplen `filtros` (por nombre). Las filas se leen y dibujan de a una; como fpdf2
+    guarda todas las páginas hasta escribir el archivo, se corta en partes de a
+    `por_archivo` historias para que la memoria no crezca con el tamaño del reporte.
+
+    on_progress(hechos, total) cada 10 historias; si lanza una excepción (p.ej.
+    TareaCancelada) se borran las partes ya escritas y se propaga.
+    Devuelve {"archivos", "total", "paginas", "segundos"}.
+    """
+    cur = db.reader().cursor()
+    total = contar_historias(cur, ids=ids, filtros=filtros)
+    if not total:
+        raise ValueError("No hay historias para el reporte")
+    titulo = titulo or titulo_reporte(filtros)
+    out_dir = out_dir or paths["PDFS_DIR"]
+    partes = -(-total // por_archivo)
+    base = _reservar_base(out_dir, f"Reporte_{datetime.datetime.now():%Y%m%d_%H%M%S}", partes)
+    ctx = render_context(paths)
+    rep = {"archivos": [], "total": total, "paginas": 0}
+    t0 = time.perf_counter()
+
+    if ids is not None:
+        ids = list(dict.fromkeys(int(i) for i in ids))  # sin repetidos, en el orden dado
+    historias = _historias_en_orden(cur, ids=ids, filtros=filtros)
+    hechos = 0
+
+    def avance(_i):
+        nonlocal hechos
+        hechos += 1
+        if on_progress and (hechos % 10 == 0 or hechos == total):
+            on_progress(hechos, total)
+
+    try:
+        for parte in range(1, partes + 1):
+            n = min(por_archivo, total - (parte - 1) * por_archivo)
+            lote = itertools.islice(historias, n)
+            out = _archivo(base, parte, partes)
+            subtitulo = f"{total} historias" + (f" — parte {parte} de {partes}" if partes > 1 else "")
+            subtitulo += f" — generado el {datetime.datetime.now():%d/%m/%Y %H:%M}"
+            rep["paginas"] += generar_reporte_pdf(paths, lote, out, titulo, n, subtitulo, ctx=ctx, on_item=avance)
+            rep["archivos"].append(out)
+    except BaseException:
+        for out in rep["archivos"] or [_archivo(base, 1, partes)]:
+            try:
+                os.remove(out)
+            except OSError:
+                pass
+        raise
+
+    rep["segundos"] = time.perf_counter() - t0
+    print(f"[DEBUG] Reporte: {total} historias, {rep['paginas']} páginas en {len(rep['archivos'])} "
+          f"archivo(s), {rep['segundos']:.1f} s")
+    return rep
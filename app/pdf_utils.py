@@ -1,8 +1,13 @@
 # pdf_utils.py
 import os
+import io
 import re
+import copy
+import json
+import hashlib
 import inspect
 import datetime
+import threading
 from fpdf import FPDF
 
 # Pillow (solo para mostrar el logo si existe)
@@ -70,23 +75,148 @@ def _mc(pdf: FPDF, w, h, txt: str):
     else:
         pdf.multi_cell(w=w, h=h, txt=txt)
 
-# ------------------------- fuentes Unicode -------------------------
-def _register_unicode_fonts(pdf: FPDF, base_dir: str) -> bool:
+# ------------------------- fuentes y logo -------------------------
+class RenderContext:
     """
-    Registra DejaVuSans (Regular/Bold) desde ./fonts. Devuelve True si quedó OK.
+    Fuentes y logo ya leídos, para reusar en todos los PDFs de un proceso (o de un
+    worker del lote). Parsear DejaVu (cmap + anchos de ~6000 glifos) y decodificar el
+    PNG del logo costaba más que dibujar la historia entera.
+
+    Lo que fpdf2 modifica al escribir el archivo (el subconjunto de glifos y el
+    TTFont de fontTools, que se recorta al embeber) se crea nuevo por documento; lo
+    demás (métricas, cmap, píxeles del logo) se comparte y nunca se modifica.
     """
-    fonts_dir = os.path.join(base_dir, "fonts")
-    reg = os.path.join(fonts_dir, "DejaVuSans.ttf")
-    bold = os.path.join(fonts_dir, "DejaVuSans-Bold.ttf")
-    if os.path.exists(reg):
+
+    FONTS = (("", "DejaVuSans.ttf"), ("B", "DejaVuSans-Bold.ttf"))
+
+    def __init__(self, base_dir: str, logo_path: str = ""):
+        self.base_dir = base_dir
+        self.logo_path = logo_path
+        self._fonts = {}    # estilo -> (ruta, TTFFont plantilla, bytes del .ttf)
+        self._logo = None   # info de imagen de fpdf2 (píxeles ya comprimidos)
+        self._load_fonts()
+        self._load_logo()
+        self.huella = self._huella()
+
+    def _load_fonts(self):
+        fonts_dir = os.path.join(self.base_dir, "fonts")
+        dummy = FPDF()
+        for style, fname in self.FONTS:
+            path = os.path.join(fonts_dir, fname)
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "rb") as f:
+                    raw = f.read()
+                dummy.add_font("DejaVu", style, path)
+                tpl = dummy.fonts[f"dejavu{style}"]
+            except Exception as ex:
+                print(f"[DEBUG] No se pudo cargar la fuente {fname}:", ex)
+                continue
+            self._fonts[style] = (path, tpl, raw)
+
+    def _load_logo(self):
+        if not (PIL_AVAILABLE and self.logo_path and os.path.exists(self.logo_path)):
+            return
         try:
-            pdf.add_font("DejaVu", "", reg, uni=True)
-            if os.path.exists(bold):
-                pdf.add_font("DejaVu", "B", bold, uni=True)
-            return True
-        except Exception:
+            from fpdf.image_parsing import preload_image
+            from fpdf.image_datastructures import ImageCache
+            cache = ImageCache()
+            _name, _img, info = preload_image(cache, self.logo_path)
+            # El perfil ICC queda en el caché de imágenes, no en la info
+            iccp = next(iter(cache.icc_profiles), None)
+            self._logo = (info, iccp)
+        except Exception as ex:
+            print("[DEBUG] No se pudo precargar el logo:", ex)
+
+    def _huella(self) -> str:
+        """Hash de las fuentes y el logo que se usan: si cambian, los PDFs cacheados caducan."""
+        h = hashlib.sha256()
+        for style, (_path, _tpl, raw) in sorted(self._fonts.items()):
+            h.update(style.encode() + hashlib.sha256(raw).digest())
+        if self._logo is not None:
+            with open(self.logo_path, "rb") as f:
+                h.update(b"logo" + hashlib.sha256(f.read()).digest())
+        return h.hexdigest()
+
+    @property
+    def unicode_ok(self) -> bool:
+        return "" in self._fonts
+
+    @property
+    def logo_ok(self) -> bool:
+        return self._logo is not None
+
+    def register_fonts(self, pdf: FPDF) -> bool:
+        """
+        Registra DejaVuSans (Regular/Bold) de ./fonts en `pdf` con las fuentes ya
+        parseadas. Devuelve True si quedó OK.
+        """
+        if not self.unicode_ok:
+            return False
+        for style, (path, tpl, raw) in self._fonts.items():
+            try:
+                pdf.fonts[f"dejavu{style}"] = self._clone_font(pdf, tpl, raw)
+            except Exception as ex:
+                # Otra versión de fpdf2 con otros internos: cargar como siempre
+                print("[DEBUG] Fuente cacheada no usable, leyendo el .ttf:", ex)
+                pdf.fonts.pop(f"dejavu{style}", None)
+                pdf.add_font("DejaVu", style, path)
+        return True
+
+    @staticmethod
+    def _clone_font(pdf: FPDF, tpl, raw: bytes):
+        from fontTools import ttLib
+        from fpdf.fonts import SubsetMap
+        if tpl.color_font is not None:
+            raise ValueError("fuente color")
+        font = copy.copy(tpl)
+        font.i = len(pdf.fonts) + 1
+        font.ttfont = ttLib.TTFont(io.BytesIO(raw), recalcTimestamp=False, lazy=True)
+        font.missing_glyphs = []
+        font.biggest_size_pt = 0
+        font._hbfont = None
+        font.subset = SubsetMap(font)
+        return font
+
+    def draw_logo(self, pdf: FPDF, x: float, y: float, w: float) -> bool:
+        """Dibuja el logo precargado; si no se pudo precargar, lo lee del archivo."""
+        if self._logo is not None:
+            info, iccp = self._logo
+            images = pdf.image_cache.images
+            if self.logo_path not in images:
+                info = copy.copy(info)   # fpdf2 le anota el número de objeto al escribir
+                info["i"] = len(images) + 1
+                info["usages"] = 0
+                if iccp is not None:
+                    profiles = pdf.image_cache.icc_profiles
+                    info["iccp_i"] = profiles.setdefault(iccp, len(profiles))
+                images[self.logo_path] = info
+        elif not (PIL_AVAILABLE and self.logo_path and os.path.exists(self.logo_path)):
             return False
-    return False
+        pdf.image(self.logo_path, x=x, y=y, w=w)
+        return True
+
+_CONTEXTS = {}
+_CONTEXTS_LOCK = threading.Lock()
+
+def render_context(paths: dict) -> RenderContext:
+    """
+    RenderContext compartido del proceso para estas rutas (se crea la primera vez).
+    Si cambia el archivo del logo se vuelve a cargar.
+    """
+    base_dir = paths.get("BASE_DIR", os.getcwd())
+    logo = paths.get("LOGO_PATH", "")
+    try:
+        mtime = os.path.getmtime(logo) if logo else None
+    except OSError:
+        mtime = None
+    key = (base_dir, logo, mtime)
+    with _CONTEXTS_LOCK:
+        ctx = _CONTEXTS.get(key)
+        if ctx is None:
+            ctx = _CONTEXTS[key] = RenderContext(base_dir, logo)
+    return ctx
 
 # ------------------------- Footer -------------------------
 class PDF(FPDF):
@@ -107,9 +237,13 @@ class PDF(FPDF):
 
 # ------------------------- Layout -------------------------
 # --- en pdf_utils.py, reemplaza _header por esto ---
-def _header(pdf: PDF, paths: dict, nombre: str, FONT_BOLD: tuple, FONT_REG: tuple, norm):
+def _header(pdf: PDF, paths: dict, nombre: str, FONT_BOLD: tuple, FONT_REG: tuple, norm,
+            ctx: RenderContext | None = None, marcador: str | None = None, nueva_pagina: bool = True):
     pdf.set_margins(15, 15, 15)
-    pdf.add_page()
+    if nueva_pagina:
+        pdf.add_page()
+    if marcador:
+        pdf.start_section(marcador)  # entrada en el panel de marcadores del visor
     content_w = pdf.w - pdf.l_margin - pdf.r_margin
 
     # Medidas/espaciado del bloque de cabecera
@@ -121,12 +255,11 @@ def _header(pdf: PDF, paths: dict, nombre: str, FONT_BOLD: tuple, FONT_REG: tupl
 
     # Logo (no cambia el cursor)
     has_logo = False
-    if PIL_AVAILABLE and os.path.exists(paths.get("LOGO_PATH", "")):
-        try:
-            pdf.image(paths["LOGO_PATH"], x=pdf.l_margin, y=y0, w=LOGO_W)
-            has_logo = True
-        except Exception:
-            pass
+    ctx = ctx or render_context(paths)
+    try:
+        has_logo = ctx.draw_logo(pdf, x=pdf.l_margin, y=y0, w=LOGO_W)
+    except Exception:
+        pass
 
     text_x = pdf.l_margin + (LOGO_W + GAP if has_logo else 0)
 
@@ -224,20 +357,142 @@ def _section(pdf: PDF, title: str, body: str, FONT_BOLD: tuple, FONT_REG: tuple,
     y2 = pdf.get_y()
     pdf.rect(x, y, content_w, y2 - y)
 
+def _visits_section(pdf: PDF, title: str, consultas, FONT_BOLD: tuple, FONT_REG: tuple, norm):
+    """Evolución como lista de visitas en orden: fecha en negrita y sus notas debajo."""
+    content_w = pdf.w - pdf.l_margin - pdf.r_margin
+    pdf.set_fill_color(240, 240, 240)
+    pdf.set_draw_color(220, 220, 220)
+    pdf.set_line_width(0.2)
+    pdf.set_font(*FONT_BOLD, size=11)
+    pdf.cell(content_w, 7, norm(title), ln=1, fill=True, border=1)
+    pdf.ln(1)
+
+    for _id, fecha, notas in consultas:
+        pdf.set_x(pdf.l_margin)
+        pdf.set_font(*FONT_BOLD, size=10)
+        pdf.cell(content_w, 5.5, norm(_fecha_visita(fecha)), ln=1)
+        pdf.set_font(*FONT_REG, size=11)
+        _mc(pdf, content_w, 5.5, norm(_safe(notas)))
+        pdf.ln(2)
+
+def _fecha_visita(fecha) -> str:
+    """'2024-03-05' / '2024-03-05 10:30' -> '05/03/2024' / '05/03/2024 10:30'."""
+    s = _safe(fecha)
+    for fmt_in, fmt_out in (("%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M"), ("%Y-%m-%d", "%d/%m/%Y")):
+        try:
+            return datetime.datetime.strptime(s, fmt_in).strftime(fmt_out)
+        except ValueError:
+            pass
+    return s
+
+# ------------------------- caché de PDFs -------------------------
+# Subir al cambiar el diseño del PDF (textos, medidas, secciones): invalida el caché
+LAYOUT_VERSION = 1
+MANIFEST_NAME = ".pdf_manifest.json"
+_MANIFEST_LOCK = threading.Lock()
+
+def huella_pdf(row_values, consultas, ctx: RenderContext) -> str:
+    """Hash de todo lo que define el contenido del PDF: fila, visitas, diseño, fuentes y logo."""
+    datos = [LAYOUT_VERSION, ctx.huella, list(row_values), [list(c) for c in consultas or []]]
+    return hashlib.sha256(json.dumps(datos, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+def _leer_manifest(pdfs_dir: str) -> dict:
+    try:
+        with open(os.path.join(pdfs_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+            man = json.load(f)
+        if isinstance(man.get("pdfs"), dict):
+            return man
+    except Exception:
+        pass
+    return {"pdfs": {}}
+
+def _guardar_manifest(pdfs_dir: str, man: dict):
+    path = os.path.join(pdfs_dir, MANIFEST_NAME)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(man, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+def _intacto(path: str, entrada: dict) -> bool:
+    """El archivo sigue siendo el que generamos (nadie lo borró ni lo reemplazó)."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    return st.st_size == entrada.get("size") and st.st_mtime_ns == entrada.get("mtime_ns")
+
+def _pdf_cacheado(pdfs_dir: str, nombre: str, huella: str) -> bool:
+    with _MANIFEST_LOCK:
+        entrada = _leer_manifest(pdfs_dir)["pdfs"].get(nombre)
+    return bool(entrada) and entrada.get("hash") == huella and _intacto(os.path.join(pdfs_dir, nombre), entrada)
+
+def _registrar_pdf(pdfs_dir: str, nombre: str, row_id, huella: str):
+    """
+    Anota el PDF recién generado y desaloja lo viejo: otros PDFs de la misma historia
+    (cambió el nombre o el DNI) se borran si siguen intactos, y las entradas de
+    archivos que ya no existen se descartan.
+    """
+    st = os.stat(os.path.join(pdfs_dir, nombre))
+    with _MANIFEST_LOCK:
+        man = _leer_manifest(pdfs_dir)
+        pdfs = man["pdfs"]
+        for otro, entrada in list(pdfs.items()):
+            if otro == nombre:
+                continue
+            path = os.path.join(pdfs_dir, otro)
+            if entrada.get("id") == row_id and _intacto(path, entrada):
+                try:
+                    os.remove(path)
+                    print("[DEBUG] PDF viejo de la misma historia eliminado:", path)
+                except OSError:
+                    continue
+                del pdfs[otro]
+            elif not os.path.exists(path):
+                del pdfs[otro]
+        pdfs[nombre] = {"id": row_id, "hash": huella, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                        "layout": LAYOUT_VERSION}
+        _guardar_manifest(pdfs_dir, man)
+
 # ------------------------- API principal -------------------------
-def generar_pdf(paths: dict, row_values: list | tuple):
+def generar_pdf(paths: dict, row_values: list | tuple, consultas=None, ctx: RenderContext | None = None,
+                cache: bool = True):
     """
     row_values = [id, nombre, dni, edad, domicilio, obra_social, numero_beneficio,
                   telefono, email, antecedentes_personales, antecedentes_familiares,
                   examen_fisico, diagnostico_presuntivo, evolucion_seguimiento,
                   motivo_consulta]
+    consultas  = [(id, fecha, notas), ...] en orden cronológico (db.iter_consultas).
+                 Si no hay visitas se usa el texto viejo de evolucion_seguimiento.
+    ctx        = fuentes/logo ya cargados; por defecto el compartido del proceso
+                 (render_context), así sólo el primer PDF paga la lectura.
+    cache      = si el PDF de esta historia ya existe en PDFS_DIR y nada cambió (fila,
+                 visitas, LAYOUT_VERSION, fuentes, logo; ver .pdf_manifest.json), se
+                 devuelve ese archivo sin volver a generarlo.
     """
     if not row_values:
         raise ValueError("No hay datos seleccionados para PDF")
 
     os.makedirs(paths["PDFS_DIR"], exist_ok=True)
+    ctx = ctx or render_context(paths)
+    consultas = list(consultas or [])
+    nombre_pdf = f"Historia_{_safe(row_values[1])}_{_safe(row_values[2])}.pdf"
+    if cache:
+        huella = huella_pdf(row_values, consultas, ctx)
+        if _pdf_cacheado(paths["PDFS_DIR"], nombre_pdf, huella):
+            print("[DEBUG] PDF sin cambios, se reusa:", nombre_pdf)
+            return os.path.join(paths["PDFS_DIR"], nombre_pdf)
+
+    pdf, FONT_BOLD, FONT_REG, norm = _nuevo_documento(ctx)
+    _historia(pdf, paths, row_values, consultas, FONT_BOLD, FONT_REG, norm, ctx)
+
+    out = os.path.join(paths["PDFS_DIR"], nombre_pdf)
+    pdf.output(out)
+    if cache:
+        _registrar_pdf(paths["PDFS_DIR"], nombre_pdf, row_values[0], huella)
+    return out
 
-    data = {
+def _datos(row_values) -> dict:
+    return {
         "Nombre": _safe(row_values[1]),
         "DNI": _safe(row_values[2]),
         "Edad": _safe(row_values[3]),
@@ -254,11 +509,13 @@ def generar_pdf(paths: dict, row_values: list | tuple):
         "Evolución/Seguimiento": _safe(row_values[13] or ""),
     }
 
+def _nuevo_documento(ctx: RenderContext):
+    """PDF A4 con las fuentes registradas. Devuelve (pdf, FONT_BOLD, FONT_REG, norm)."""
     pdf = PDF("P", "mm", "A4")
     pdf.set_margins(15, 15, 15)
     pdf.set_auto_page_break(True, 18)
 
-    unicode_ok = _register_unicode_fonts(pdf, paths.get("BASE_DIR", os.getcwd()))
+    unicode_ok = ctx.register_fonts(pdf)
     pdf._unicode_ok = bool(unicode_ok)  # <-- bandera para el footer
 
     if unicode_ok:
@@ -271,10 +528,15 @@ def generar_pdf(paths: dict, row_values: list | tuple):
         FONT_BOLD = ("Arial", "B")
         norm = _latin1_safe
         pdf._footer_font_name = "Arial"
+    return pdf, FONT_BOLD, FONT_REG, norm
 
+def _historia(pdf: PDF, paths: dict, row_values, consultas, FONT_BOLD: tuple, FONT_REG: tuple, norm,
+              ctx: RenderContext, marcador: str | None = None, nueva_pagina: bool = True):
+    """Una historia completa desde una página nueva (generar_pdf y el reporte combinado)."""
+    data = _datos(row_values)
 
     # Encabezado
-    _header(pdf, paths, data["Nombre"], FONT_BOLD, FONT_REG, norm)
+    _header(pdf, paths, data["Nombre"], FONT_BOLD, FONT_REG, norm, ctx, marcador, nueva_pagina)
 
     # Dos columnas para datos cortos
     _two_columns_short_fields(pdf, data, FONT_BOLD, FONT_REG, norm)
@@ -289,8 +551,75 @@ def generar_pdf(paths: dict, row_values: list | tuple):
     pdf.ln(3)
     _section(pdf, "Diagnóstico Presuntivo", data["Diagnóstico Presuntivo"], FONT_BOLD, FONT_REG, norm)
     pdf.ln(3)
-    _section(pdf, "Evolución / Seguimiento", data["Evolución/Seguimiento"], FONT_BOLD, FONT_REG, norm)
+    if consultas:
+        _visits_section(pdf, "Evolución / Seguimiento", consultas, FONT_BOLD, FONT_REG, norm)
+    else:
+        _section(pdf, "Evolución / Seguimiento", data["Evolución/Seguimiento"], FONT_BOLD, FONT_REG, norm)
+
+# ------------------------- Reporte combinado -------------------------
+# Medidas del índice: alcanzan para saber de antemano cuántas páginas ocupa
+_INDICE_FILA_H = 6
+_INDICE_TITULO_H = 8 + 6 + 4
+
+def _paginas_indice(pdf: PDF, n: int) -> int:
+    alto = pdf.h - pdf.b_margin - pdf.t_margin
+    primera = int((alto - _INDICE_TITULO_H) // _INDICE_FILA_H)
+    resto = int(alto // _INDICE_FILA_H)
+    return 1 if n <= primera else 1 + -(-(n - primera) // resto)
+
+def _recortar(pdf: PDF, txt: str, w: float) -> str:
+    if pdf.get_string_width(txt) <= w:
+        return txt
+    while txt and pdf.get_string_width(txt + "…") > w:
+        txt = txt[:-1]
+    return txt + "…"
+
+def generar_reporte_pdf(paths: dict, historias, out: str, titulo: str, n: int,
+                        subtitulo: str = "", ctx: RenderContext | None = None, on_item=None) -> int:
+    """
+    Un solo PDF con muchas historias: página(s) de índice con enlaces, un marcador
+    por paciente y cada historia con el mismo diseño que generar_pdf.
+
+    historias = iterable de (row_values, consultas); se dibuja cada una apenas llega
+                (no hace falta tenerlas todas en memoria).
+    n         = cuántas trae (para reservar las páginas del índice al principio).
+    on_item(i) después de cada historia; si lanza una excepción no se escribe nada.
+    Devuelve la cantidad de páginas.
+    """
+    ctx = ctx or render_context(paths)
+    pdf, FONT_BOLD, FONT_REG, norm = _nuevo_documento(ctx)
+    pdf.set_title(titulo)
+    pdf.add_page()
 
-    out = os.path.join(paths["PDFS_DIR"], f"Historia_{data['Nombre']}_{data['DNI']}.pdf")
+    def indice(pdf, outline):
+        content_w = pdf.w - pdf.l_margin - pdf.r_margin
+        pdf.set_font(*FONT_BOLD, size=14)
+        pdf.cell(content_w, 8, norm(titulo), ln=1)
+        pdf.set_font(*FONT_REG, size=10)
+        pdf.set_text_color(100, 100, 100)
+        pdf.cell(content_w, 6, norm(subtitulo or f"{len(outline)} historias"), ln=1)
+        pdf.set_text_color(0, 0, 0)
+        pdf.ln(4)
+        pdf.set_font(*FONT_REG, size=10)
+        for sec in outline:
+            link = pdf.add_link(page=sec.page_number)
+            pdf.cell(content_w - 15, _INDICE_FILA_H, _recortar(pdf, norm(sec.name), content_w - 17), link=link)
+            pdf.cell(15, _INDICE_FILA_H, str(sec.page_number), ln=1, align="R", link=link)
+        # fpdf2 exige ocupar justo las hojas reservadas (si llegaron menos historias que n)
+        ultima = pdf.toc_placeholder.start_page + pdf.toc_placeholder.pages - 1
+        while pdf.page < ultima:
+            pdf.cell(content_w, _INDICE_FILA_H, "", ln=1)
+
+    # El índice se dibuja al final (recién ahí se saben las páginas), en estas hojas;
+    # después del lugar reservado queda una página en blanco para la primera historia
+    pdf.insert_toc_placeholder(indice, pages=_paginas_indice(pdf, n), reset_page_indices=False)
+    for i, (row, consultas) in enumerate(historias, 1):
+        marcador = f"{_safe(row[1]) or 'Sin nombre'} (DNI {_safe(row[2]) or '-'})"
+        _historia(pdf, paths, row, list(consultas or []), FONT_BOLD, FONT_REG, norm, ctx, marcador,
+                  nueva_pagina=i > 1)
+        if on_item:
+            on_item(i)
+    paginas = pdf.page
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
     pdf.output(out)
-    return out
+    return paginas
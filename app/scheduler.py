@@ -0,0 +1,258 @@
+# scheduler.py
+"""
+Backup automático en segundo plano: un hilo que arranca con la ventana ya abierta,
+revisa cada tanto si toca backup y lo hace sin frenar la UI. Reemplaza al viejo
+maybe_auto_backup(), que corría antes de make_app() y demoraba (o tiraba) el arranque.
+
+- Intervalo entre backups: config.json "backup_intervalo_horas" (por defecto 7 días).
+- Horas de silencio: config.json "backup_silencio": [desde, hasta] en horas locales,
+  p.ej. [8, 20] para no usar la conexión en horario de consultorio (puede cruzar la
+  medianoche: [22, 6]). Un backup vencido espera a que termine el silencio.
+- Si falla, reintenta con espera exponencial (5 min, 10, 20… hasta 6 h).
+- El estado queda en BASE_DIR/backup_estado.json (último ok, fallos seguidos, error,
+  próximo intento), así sobrevive a cerrar la app; un backup que quedó a medias
+  por cerrar la app cuenta como intento fallido.
+
+    sched = iniciar_scheduler(paths)   # uno por proceso, aunque haya varias ventanas
+    sched.subscribe(lambda ev, estado: ...)   # "inicio" | "ok" | "error"
+    sched.unsubscribe(cb)              # al cerrar una ventana; el hilo se para al salir
+
+Para probarlo sin esperar: BackupScheduler(paths, backup_fn=..., clock=reloj_falso)
+y llamar a tick(), que hace una sola revisión (y el backup, si toca) en el hilo actual.
+"""
+import os
+import json
+import time
+import atexit
+import datetime
+import threading
+
+from paths import load_config
+from tasks import TareaCancelada
+
+ESTADO_NAME = "backup_estado.json"
+INTERVALO_HORAS = 7 * 24
+REINTENTO_BASE_S = 5 * 60
+REINTENTO_MAX_S = 6 * 3600
+DEMORA_INICIAL_S = 60      # dejar que la ventana termine de abrir
+CHEQUEO_S = 5 * 60
+PARADA_S = 10              # al salir, cuánto esperar a que un backup en curso se corte
+
+def _ts_de_fecha(iso: str):
+    """Fecha "AAAA-MM-DD" (config.json last_backup) a timestamp; None si no se entiende."""
+    try:
+        return datetime.datetime.combine(datetime.date.fromisoformat(iso), datetime.time()).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def espera_reintento(fallos: int) -> float:
+    """Segundos hasta el próximo intento después de `fallos` fallos seguidos."""
+    if fallos <= 0:
+        return 0.0
+    return float(min(REINTENTO_MAX_S, REINTENTO_BASE_S * 2 ** (fallos - 1)))
+
+def en_silencio(hora: float, silencio) -> bool:
+    """True si la hora local (0..24, con fracción) cae en [desde, hasta)."""
+    if not silencio:
+        return False
+    desde, hasta = silencio
+    if desde == hasta:
+        return False
+    if desde < hasta:
+        return desde <= hora < hasta
+    return hora >= desde or hora < hasta
+
+class BackupScheduler:
+    """Decide cuándo toca backup y lo corre en su propio hilo."""
+
+    def __init__(self, paths: dict, backup_fn=None, disponible=None, clock=time.time,
+                 demora_inicial: float = DEMORA_INICIAL_S, chequeo: float = CHEQUEO_S):
+        if backup_fn is None or disponible is None:
+            from backup_drive import backup_now, can_backup
+            backup_fn = backup_fn or backup_now
+            disponible = disponible or can_backup
+        self.paths = paths
+        self.backup_fn = backup_fn
+        self.disponible = disponible
+        self.clock = clock
+        self.demora_inicial = demora_inicial
+        self.chequeo = chequeo
+        self._estado_path = os.path.join(paths["BASE_DIR"], ESTADO_NAME)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self._estado = self._leer_estado()
+        if self._estado.get("en_curso_desde"):
+            # La app se cerró (o se colgó) a mitad de un backup
+            print("[DEBUG] Backup anterior quedó a medias; cuenta como fallido")
+            self._estado["fallos"] = self._estado.get("fallos", 0) + 1
+            self._estado["ultimo_error"] = "Interrumpido al cerrar la aplicación"
+            self._estado["ultimo_intento"] = self._estado.pop("en_curso_desde")
+            self._guardar_estado()
+
+    # ----- estado persistente -----
+    def _leer_estado(self) -> dict:
+        try:
+            with open(self._estado_path, "r", encoding="utf-8") as f:
+                estado = json.load(f)
+            if isinstance(estado, dict):
+                return estado
+        except (OSError, ValueError):
+            pass
+        return {"ultimo_ok": None, "ultimo_intento": None, "fallos": 0, "ultimo_error": None}
+
+    def _guardar_estado(self):
+        tmp = self._estado_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._estado, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self._estado_path)
+
+    def estado(self) -> dict:
+        with self._lock:
+            out = dict(self._estado)
+        out["proximo"] = self.proximo()
+        return out
+
+    # ----- configuración -----
+    def _config(self):
+        cfg = load_config(self.paths["BASE_DIR"])
+        try:
+            intervalo = float(cfg.get("backup_intervalo_horas", INTERVALO_HORAS)) * 3600
+        except (TypeError, ValueError):
+            intervalo = INTERVALO_HORAS * 3600
+        silencio = cfg.get("backup_silencio")
+        if not (isinstance(silencio, (list, tuple)) and len(silencio) == 2
+                and all(isinstance(h, (int, float)) for h in silencio)):
+            silencio = None
+        # "Backup ahora" (y las versiones viejas) sólo anotan la fecha en config.json
+        manual = _ts_de_fecha(cfg.get("last_backup"))
+        return intervalo, silencio, manual
+
+    def proximo(self) -> float:
+        """Timestamp desde el que toca el próximo backup (sin contar horas de silencio)."""
+        intervalo, _, manual = self._config()
+        with self._lock:
+            e = dict(self._estado)
+        if e.get("fallos") and (manual or 0) <= (e.get("ultimo_intento") or 0):
+            return (e.get("ultimo_intento") or 0) + espera_reintento(e["fallos"])
+        ultimo = max(e.get("ultimo_ok") or 0, manual or 0)
+        return ultimo + intervalo if ultimo else 0.0
+
+    # ----- una revisión -----
+    def tick(self):
+        """
+        Una revisión: si toca (y no es hora de silencio) hace el backup en este hilo.
+        Devuelve el resultado de backup_fn, la excepción si falló, o None si no tocaba.
+        """
+        ahora = self.clock()
+        if ahora < self.proximo():
+            return None
+        _, silencio, _ = self._config()
+        local = datetime.datetime.fromtimestamp(ahora)
+        if en_silencio(local.hour + local.minute / 60, silencio):
+            return None
+        if not self.disponible(self.paths):
+            return None
+
+        with self._lock:
+            self._estado["en_curso_desde"] = ahora
+            self._guardar_estado()
+        print("[DEBUG] Backup automático: empezando")
+        self._avisar("inicio")
+        try:
+            res = self.backup_fn(self.paths, progress=self._progress)
+        except TareaCancelada:
+            with self._lock:
+                self._estado.pop("en_curso_desde", None)
+                self._guardar_estado()
+            return None
+        except Exception as ex:
+            with self._lock:
+                self._estado.pop("en_curso_desde", None)
+                self._estado["ultimo_intento"] = ahora
+                self._estado["fallos"] = self._estado.get("fallos", 0) + 1
+                self._estado["ultimo_error"] = str(ex)
+                self._guardar_estado()
+                fallos = self._estado["fallos"]
+            print(f"[DEBUG] Backup automático falló ({fallos} seguidos), reintento en "
+                  f"{espera_reintento(fallos) / 60:.0f} min:", ex)
+            self._avisar("error")
+            return ex
+
+        with self._lock:
+            self._estado.pop("en_curso_desde", None)
+            self._estado.update(ultimo_ok=self.clock(), ultimo_intento=ahora, fallos=0, ultimo_error=None)
+            if isinstance(res, dict) and res.get("id"):
+                self._estado["ultimo_id"] = res["id"]
+            self._guardar_estado()
+        print("[DEBUG] Backup automático: listo")
+        self._avisar("ok")
+        return res
+
+    def _progress(self, frac=None, msg=None):
+        # Punto de cancelación: al cerrar la app el backup se corta en el próximo paso
+        if self._stop.is_set():
+            raise TareaCancelada()
+
+    # ----- avisos -----
+    def subscribe(self, cb):
+        """cb(evento, estado) con evento "inicio" | "ok" | "error" (corre en el hilo del scheduler)."""
+        self._listeners.append(cb)
+
+    def unsubscribe(self, cb):
+        if cb in self._listeners:
+            self._listeners.remove(cb)
+
+    def _avisar(self, evento: str):
+        estado = self.estado()
+        for cb in list(self._listeners):
+            try:
+                cb(evento, estado)
+            except Exception as ex:
+                print("[DEBUG] Error notificando backup automático:", ex)
+
+    # ----- hilo -----
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="backup-auto", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float | None = None):
+        """Para el hilo; un backup en curso se corta en su próximo paso de progreso."""
+        self._stop.set()
+        if self._thread is not None and timeout:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        if self._stop.wait(self.demora_inicial):
+            return
+        while not self._stop.is_set():
+            try:
+                self.tick()
+            except Exception as ex:
+                print("[DEBUG] Error en el scheduler de backups:", ex)
+            self._stop.wait(self.chequeo)
+
+_SCHEDULER = None
+_SCHEDULER_LOCK = threading.Lock()
+
+def iniciar_scheduler(paths: dict) -> BackupScheduler:
+    """
+    El scheduler del proceso (en modo web cada pestaña llama a make_app). Es de todas
+    las sesiones: al cerrar una sólo hay que desuscribirse, el hilo se para al salir.
+    """
+    global _SCHEDULER
+    with _SCHEDULER_LOCK:
+        if _SCHEDULER is None:
+            _SCHEDULER = BackupScheduler(paths)
+            atexit.register(_parar_scheduler)
+        _SCHEDULER.start()
+        return _SCHEDULER
+
+def _parar_scheduler():
+    # Un backup en curso se corta y deja el estado prolijo antes de que muera el hilo
+    if _SCHEDULER is not None:
+        _SCHEDULER.stop(PARADA_S)
@@ -0,0 +1,97 @@
+# snapshot.py
+"""
+Copias consistentes de la BD mientras la app sigue abierta, con la API de backup
+de SQLite (sqlite3.Connection.backup) en vez de copiar/comprimir el archivo vivo:
+la copia es el estado de una transacción completa, incluido lo que todavía está en
+el -wal, y nunca queda a medio escribir.
+
+    rep = tomar_snapshot(paths["DB_NAME"], "/tmp/copia.db", progress=job.progress)
+
+La copia se hace de a `paginas` páginas por paso: entre pasos la app puede leer y
+escribir (con WAL nadie espera). Si otra conexión escribe a mitad de copia, SQLite
+la vuelve a empezar; si eso se repite (mucha escritura), se termina en un solo paso,
+que con WAL tampoco frena a los que escriben: ven la BD como al empezar la copia.
+Antes de entregarla se corre PRAGMA integrity_check.
+"""
+import os
+import time
+import sqlite3
+
+PAGINAS_POR_PASO = 1024  # 4 MB por paso con páginas de 4 KB
+MAX_REINICIOS = 3        # después de tantos reinicios, se copia todo en un solo paso
+
+class _Reiniciada(Exception):
+    pass
+
+class SnapshotError(RuntimeError):
+    """La copia no pasó PRAGMA integrity_check."""
+
+def integridad(conn) -> list:
+    """Problemas que informa PRAGMA integrity_check ([] si la BD está bien)."""
+    filas = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+    return [] if filas == ["ok"] else filas
+
+def tomar_snapshot(db_path: str, dest: str, progress=None, paginas: int = PAGINAS_POR_PASO) -> dict:
+    """
+    Copia `db_path` en `dest` (un .db suelto, sin -wal) y la verifica.
+
+    progress(frac, msg) opcional: avance de 0 a 1; si lanza una excepción (p.ej.
+    TareaCancelada) la copia se corta y no queda nada en `dest`.
+    Lanza SnapshotError si la copia no está íntegra.
+    Devuelve {"path", "bytes", "paginas", "segundos"}.
+    """
+    if os.path.exists(dest) and os.path.samefile(dest, db_path):
+        raise ValueError("El destino es la misma base de datos que se está copiando")
+    progress = progress or (lambda frac=None, msg=None: None)
+    tmp = dest + ".parcial"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    t0 = time.perf_counter()
+
+    src = sqlite3.connect(db_path, timeout=5)
+    dst = sqlite3.connect(tmp)
+    try:
+        previo = {"restantes": None, "reinicios": 0}
+
+        def paso(_status, restantes, total):
+            if previo["restantes"] is not None and restantes > previo["restantes"]:
+                previo["reinicios"] += 1
+                if previo["reinicios"] >= MAX_REINICIOS:
+                    raise _Reiniciada()
+            previo["restantes"] = restantes
+            if total:
+                frac = (total - restantes) / total
+                progress(0.8 * frac, f"Copiando base de datos… {frac:.0%}")
+
+        progress(0.0, "Copiando base de datos…")
+        try:
+            src.backup(dst, pages=paginas, progress=paso)
+        except _Reiniciada:
+            print("[DEBUG] Snapshot reiniciado por escrituras; copiando en un solo paso")
+            src.backup(dst, pages=-1)
+        # La copia hereda el modo WAL del original: que sea un único archivo autónomo
+        dst.execute("PRAGMA journal_mode = DELETE")
+
+        progress(0.8, "Verificando integridad…")
+        problemas = integridad(dst)
+        if problemas:
+            raise SnapshotError("La copia de la base de datos no pasó la verificación de integridad: "
+                                + "; ".join(problemas[:5]))
+        n_paginas = dst.execute("PRAGMA page_count").fetchone()[0]
+    except BaseException:
+        dst.close()
+        src.close()
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    dst.close()
+    src.close()
+    os.replace(tmp, dest)
+
+    rep = {"path": dest, "bytes": os.path.getsize(dest), "paginas": n_paginas,
+           "segundos": time.perf_counter() - t0}
+    progress(1.0, "Copia verificada")
+    print(f"[DEBUG] Snapshot de la BD: {rep['bytes'] / 1e6:.1f} MB en {rep['segundos']:.1f} s -> {dest}")
+    return rep
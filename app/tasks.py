@@ -0,0 +1,180 @@
+# tasks.py
+"""
+Tareas en segundo plano (PDF, backup, exportes, importación) para no congelar la
+ventana: un pool de hilos, progreso, cancelación y una lista de tareas recientes.
+
+    runner = TaskRunner()
+    runner.subscribe(lambda job: ...)           # se llama en cada cambio (desde otro hilo)
+    job = runner.submit("Backup", backup_now, paths, on_done=..., on_error=...)
+
+Con pasar_job=True la función recibe el Job como primer argumento (fn(job, *args))
+y avisa el avance con job.progress(frac, msg). job.progress() es también el punto
+de cancelación: si pidieron cancelar, lanza TareaCancelada y la tarea termina ahí.
+"""
+import time
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+EN_COLA, CORRIENDO, OK, ERROR, CANCELADA = "en cola", "corriendo", "ok", "error", "cancelada"
+
+class TareaCancelada(Exception):
+    """La tarea se detuvo porque el usuario la canceló."""
+
+class Job:
+    """Una tarea del TaskRunner: estado, progreso (0..1, o None si no se sabe) y resultado."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, titulo: str, runner):
+        self.id = next(self._ids)
+        self.titulo = titulo
+        self.estado = EN_COLA
+        self.progreso = None
+        self.mensaje = ""
+        self.resultado = None
+        self.error = None
+        self.creada = time.time()
+        self.inicio = None
+        self.fin = None
+        self._runner = runner
+        self._cancel = threading.Event()
+        self._future = None
+
+    @property
+    def terminada(self) -> bool:
+        return self.estado in (OK, ERROR, CANCELADA)
+
+    @property
+    def cancelada(self) -> bool:
+        return self._cancel.is_set()
+
+    def progress(self, frac=None, msg: str | None = None):
+        """Avance de la tarea (frac 0..1 o None); lanza TareaCancelada si la cancelaron."""
+        if self._cancel.is_set():
+            raise TareaCancelada()
+        if frac is not None:
+            self.progreso = max(0.0, min(1.0, float(frac)))
+        if msg is not None:
+            self.mensaje = msg
+        self._runner._changed(self)
+
+    def check(self):
+        """Punto de cancelación sin avisar progreso."""
+        if self._cancel.is_set():
+            raise TareaCancelada()
+
+    def cancel(self):
+        """Pide cancelar: si todavía no arrancó no corre; si está corriendo, para en el próximo progress()."""
+        if self.terminada:
+            return
+        self._cancel.set()
+        if self._future is not None and self._future.cancel():
+            self._finish(CANCELADA, mensaje="Cancelada")
+        else:
+            self.mensaje = "Cancelando…"
+            self._runner._changed(self)
+
+    def _finish(self, estado, resultado=None, error=None, mensaje=None):
+        self.estado = estado
+        self.resultado = resultado
+        self.error = error
+        self.fin = time.time()
+        if mensaje is not None:
+            self.mensaje = mensaje
+        if estado == OK:
+            self.progreso = 1.0
+        self._runner._changed(self)
+
+    def __repr__(self):
+        return f"<Job {self.id} {self.titulo!r} {self.estado}>"
+
+class TaskRunner:
+    """
+    Pool de hilos para las acciones pesadas. Las tareas corren de a `max_workers`;
+    las que esperan quedan "en cola". Guarda las últimas `historial` terminadas.
+    """
+
+    def __init__(self, max_workers: int = 2, historial: int = 20):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tarea")
+        self._lock = threading.Lock()
+        self._activas = []
+        self._terminadas = deque(maxlen=historial)
+        self._listeners = []
+
+    # ----- suscripción -----
+    def subscribe(self, cb):
+        """cb(job) en cada cambio de cualquier tarea (corre en el hilo de la tarea)."""
+        self._listeners.append(cb)
+
+    def unsubscribe(self, cb):
+        if cb in self._listeners:
+            self._listeners.remove(cb)
+
+    def _changed(self, job: Job):
+        if job.terminada:
+            with self._lock:
+                if job in self._activas:
+                    self._activas.remove(job)
+                    self._terminadas.appendleft(job)
+        for cb in list(self._listeners):
+            try:
+                cb(job)
+            except Exception as ex:
+                print("[DEBUG] Error notificando tarea:", ex)
+
+    # ----- tareas -----
+    def submit(self, titulo: str, fn, *args, on_done=None, on_error=None,
+               pasar_job: bool = False, **kwargs) -> Job:
+        """
+        Encola fn(*args, **kwargs) (o fn(job, *args, **kwargs) si pasar_job).
+        on_done(resultado) / on_error(excepción) se llaman en el hilo de la tarea
+        al terminar; una tarea cancelada no llama a ninguno.
+        """
+        job = Job(titulo, self)
+        with self._lock:
+            self._activas.append(job)
+
+        def run():
+            if job.cancelada:
+                if not job.terminada:
+                    job._finish(CANCELADA, mensaje="Cancelada")
+                return
+            job.estado = CORRIENDO
+            job.inicio = time.time()
+            self._changed(job)
+            try:
+                res = fn(job, *args, **kwargs) if pasar_job else fn(*args, **kwargs)
+            except TareaCancelada:
+                job._finish(CANCELADA, mensaje="Cancelada")
+                return
+            except Exception as ex:
+                print(f"[DEBUG] Tarea {titulo!r} falló:", ex)
+                job._finish(ERROR, error=ex, mensaje=str(ex))
+                if on_error:
+                    on_error(ex)
+                return
+            job._finish(OK, resultado=res)
+            if on_done:
+                on_done(res)
+
+        job._future = self._pool.submit(run)
+        self._changed(job)
+        return job
+
+    def jobs(self) -> list:
+        """Activas (en orden de llegada) y después las terminadas (más recientes primero)."""
+        with self._lock:
+            return list(self._activas) + list(self._terminadas)
+
+    def activas(self) -> list:
+        with self._lock:
+            return list(self._activas)
+
+    def shutdown(self, cancelar: bool = True):
+        """Cierra el pool; con cancelar=True cancela lo pendiente y pide parar lo que corre."""
+        if cancelar:
+            for job in self.activas():
+                job.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=cancelar)
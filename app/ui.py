@@ -1,12 +1,20 @@
 # ui.py
 import os
 import time
-import shutil
+import sqlite3
+import threading
 import datetime as dt
 import flet as ft
 
-from db import init_db
-from backup_drive import can_backup, backup_now
+from db import (
+    open_database,
+    buscar_texto, buscar_nombre, listar_pagina, obtener_historia, listar_consultas,
+    obtener_fila_lista, row_key, filtros_lista,
+)
+from backup_drive import can_backup
+from tasks import TaskRunner, CORRIENDO, EN_COLA, ERROR, CANCELADA
+from scheduler import iniciar_scheduler
+from snapshot import integridad
 from actions import *
 
 # --- Constantes y columnas de la BD (mismo orden que en db.py) ---
@@ -41,6 +49,308 @@ def _open_folder(path: str):
     except Exception:
         pass
 
+# ---------- Lista de pacientes (virtualizada) ----------
+# (índice en la fila de db.LIST_COLUMNS, columna, peso de ancho)
+LIST_VIEW_COLUMNS = (
+    (1, "nombre", 3), (2, "dni", 2), (3, "edad", 1), (4, "obra_social", 2),
+    (5, "numero_beneficio", 2), (6, "telefono", 2), (7, "motivo_consulta", 3),
+)
+ROW_HEIGHT = 44
+
+class PatientList:
+    """
+    Lista de pacientes virtualizada (reemplaza a ft.DataTable, que crea 7 celdas y 7
+    lambdas por paciente y manda todo al cliente en cada page.update()):
+    - Los datos son tuplas en memoria; los controles son sólo una ventana fija de
+      WINDOW filas, entre dos espaciadores que ocupan la altura del resto.
+    - Al desplazarse se reciclan esas mismas filas: sólo cambian sus textos, y Flet
+      manda únicamente esas diferencias.
+    - Un único handler compartido por todas las filas (sin lambdas por celda).
+    """
+
+    WINDOW = 60    # filas con controles (bastante más que las que entran en pantalla)
+    BUFFER = 15    # filas de margen por encima de la primera visible
+
+    def __init__(self, on_select, on_scroll=None, on_sort=None):
+        self.on_select = on_select
+        self.on_scroll = on_scroll
+        self.on_sort = on_sort
+        self.items = []     # [(row, snippet, key), ...] en el orden de la lista
+        self.first = 0      # índice en items de la primera fila con controles
+        self._slots = []
+        self._top = ft.Container(height=0)
+        self._bottom = ft.Container(height=0)
+        # Encabezados: un clic ordena por esa columna, otro clic invierte el sentido
+        self._header_texts = {col: ft.Text(HEADERS[col], weight=ft.FontWeight.BOLD)
+                              for _, col, _ in LIST_VIEW_COLUMNS}
+        self.header = ft.Container(
+            ft.Row([
+                ft.Container(self._header_texts[col], expand=w, data=col, on_click=self._on_header_click)
+                for _, col, w in LIST_VIEW_COLUMNS
+            ], spacing=8),
+            padding=ft.padding.symmetric(horizontal=8), height=36,
+            border=ft.border.only(bottom=ft.BorderSide(1, ft.Colors.GREY_400)),
+        )
+        self.view = ft.ListView(
+            controls=[self._top, self._bottom], expand=True, spacing=0,
+            on_scroll=self._on_scroll, on_scroll_interval=50,
+        )
+
+    def __len__(self):
+        return len(self.items)
+
+    # ----- controles -----
+    def _new_slot(self):
+        texts = [ft.Text("", expand=w, no_wrap=True, overflow=ft.TextOverflow.ELLIPSIS)
+                 for _, _, w in LIST_VIEW_COLUMNS]
+        snippet = ft.Text("", size=11, color=ft.Colors.GREY_700, italic=True, visible=False,
+                          no_wrap=True, overflow=ft.TextOverflow.ELLIPSIS)
+        # La primera columna lleva el nombre y, en búsquedas por texto, el fragmento encontrado
+        first = ft.Column([texts[0], snippet], spacing=0, tight=True, expand=texts[0].expand)
+        texts[0].expand = None
+        return ft.Container(
+            ft.Row([first] + texts[1:], spacing=8),
+            height=ROW_HEIGHT, padding=ft.padding.symmetric(horizontal=8),
+            border=ft.border.only(bottom=ft.BorderSide(1, ft.Colors.GREY_300)),
+            on_click=self._on_click, ink=True,
+        )
+
+    def _fill(self, slot, item):
+        r, snippet, key = item
+        first, *others = slot.content.controls
+        name_txt, snip_txt = first.controls
+        for txt, (i, _, _) in zip([name_txt] + others, LIST_VIEW_COLUMNS):
+            txt.value = str(r[i] or "")
+        snip_txt.value = snippet or ""
+        snip_txt.visible = bool(snippet)
+        slot.data = r[0]
+        slot.visible = True
+
+    def _render(self):
+        """Vuelca items[first:first+WINDOW] en las filas recicladas y ajusta los espaciadores."""
+        n = len(self.items)
+        self.first = max(0, min(self.first, n - self.WINDOW))
+        shown = min(self.WINDOW, n - self.first)
+        while len(self._slots) < shown:
+            slot = self._new_slot()
+            self._slots.append(slot)
+            self.view.controls.insert(len(self._slots), slot)
+        for i, slot in enumerate(self._slots):
+            if i < shown:
+                self._fill(slot, self.items[self.first + i])
+            else:
+                slot.visible = False
+                slot.data = None
+        self._top.height = self.first * ROW_HEIGHT
+        self._bottom.height = (n - self.first - shown) * ROW_HEIGHT
+
+    # ----- datos -----
+    def set_rows(self, rows, snippets=None, keys=None, append=False):
+        items = [(r, snippets[n] if snippets else None, keys[n] if keys else None)
+                 for n, r in enumerate(rows)]
+        if append:
+            self.items.extend(items)
+        else:
+            self.items = items
+            self.first = 0
+            if self.view.page:
+                self.view.scroll_to(offset=0)
+        self._render()
+
+    def index_of(self, row_id):
+        for i, (r, _, _) in enumerate(self.items):
+            if r[0] == row_id:
+                return i
+        return None
+
+    def insert(self, idx: int, r, snippet=None, key=None):
+        self.items.insert(idx, (r, snippet, key))
+        self._render()
+
+    def set_sort(self, col, desc=False):
+        """Marca en el encabezado la columna de orden (▲ ascendente, ▼ descendente)."""
+        for c, txt in self._header_texts.items():
+            txt.value = HEADERS[c] + ((" ▼" if desc else " ▲") if c == col else "")
+
+    def sort_loaded(self, key_fn, desc=False):
+        """Reordena en memoria lo ya cargado (p.ej. resultados por relevancia)."""
+        self.items.sort(key=lambda it: key_fn(it[0]), reverse=desc)
+        self._render()
+
+    def insert_sorted(self, r, key, desc=False):
+        """Inserta según la clave de orden (las filas sin clave no se comparan)."""
+        pos = len(self.items)
+        for i, (_, _, k) in enumerate(self.items):
+            if k is not None and (k < key if desc else k > key):
+                pos = i
+                break
+        self.insert(pos, r, key=key)
+
+    def pop(self, idx: int):
+        self.items.pop(idx)
+        self._render()
+
+    # ----- eventos -----
+    def _on_scroll(self, e):
+        first = max(0, int(e.pixels // ROW_HEIGHT) - self.BUFFER)
+        if first != self.first:
+            self.first = first
+            self._render()
+            self.view.update()
+        if self.on_scroll:
+            self.on_scroll(e)
+
+    def _on_click(self, e):
+        if e.control.data is not None:
+            self.on_select(e.control.data)
+
+    def _on_header_click(self, e):
+        if self.on_sort:
+            self.on_sort(e.control.data)
+
+# ---------- Búsqueda en vivo ----------
+class DebouncedSearch:
+    """
+    Búsqueda mientras se escribe, sin congelar la UI:
+    - cada tecla llama a trigger(); la consulta corre `delay` segundos después de la
+      última tecla, en un hilo aparte;
+    - cada trigger() sube un número de generación: si llega una tecla nueva, la consulta
+      en curso se corta con conn.interrupt() y sus resultados viejos se descartan.
+
+    run(conn, *args) hace la consulta con la conexión dedicada y devuelve el resultado;
+    apply(result) lo muestra (sólo si sigue siendo el de la última generación), con
+    `lock` tomado: el mismo candado que protege el estado de la UI que apply modifica.
+    on_error(ex) recibe cualquier otro error de la consulta o de apply (el hilo del
+    timer no tiene a quién avisarle).
+    """
+
+    def __init__(self, get_conn, run, apply, delay: float = 0.3, on_error=None, lock=None):
+        self.get_conn = get_conn
+        self.run = run
+        self.apply = apply
+        self.on_error = on_error
+        self.apply_lock = lock or threading.Lock()
+        self.delay = delay
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._query_lock = threading.Lock()   # una consulta a la vez en la conexión dedicada
+        self._timer = None
+        self._running = None                  # conexión con una consulta en curso
+
+    def trigger(self, *args):
+        """`args` son los parámetros de la búsqueda, leídos en el hilo del evento."""
+        with self._lock:
+            self.generation += 1
+            gen = self.generation
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._running is not None:
+                self._running.interrupt()     # la consulta vieja termina con "interrupted"
+            self._timer = threading.Timer(self.delay, self._work, args=(gen, args))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        with self._lock:
+            self.generation += 1
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._running is not None:
+                self._running.interrupt()
+
+    def _work(self, gen: int, args: tuple):
+        try:
+            with self._query_lock:
+                if gen != self.generation:
+                    return
+                conn = self.get_conn()
+                with self._lock:
+                    self._running = conn
+                try:
+                    result = self.run(conn, *args)
+                except sqlite3.OperationalError as ex:
+                    if "interrupted" in str(ex):
+                        return
+                    raise
+                finally:
+                    with self._lock:
+                        self._running = None
+            # La generación se vuelve a mirar con el candado de la UI tomado: un cancel()
+            # posterior espera a que apply termine, y uno anterior descarta el resultado
+            with self.apply_lock:
+                with self._lock:
+                    if gen != self.generation:
+                        return
+                self.apply(result)
+        except Exception as ex:
+            print("[DEBUG] Error en la búsqueda en vivo:", repr(ex))
+            if self.on_error:
+                self.on_error(ex)
+
+# ---------- Tareas en segundo plano ----------
+class TasksBar:
+    """
+    Estado de las tareas del TaskRunner (PDF, backup, exportes, importación):
+    una barra con la tarea en curso y un botón que abre la lista de tareas
+    (en curso, en cola y terminadas), con "Cancelar" en las que no terminaron.
+    """
+
+    _ESTADOS = {EN_COLA: "En cola", CORRIENDO: "En curso", ERROR: "Error", CANCELADA: "Cancelada"}
+
+    def __init__(self, page: ft.Page, runner: TaskRunner):
+        self.page = page
+        self.runner = runner
+        self.bar = ft.ProgressBar(width=160, visible=False)
+        self.text = ft.Text("", size=12, color=ft.Colors.GREY_700, no_wrap=True,
+                            overflow=ft.TextOverflow.ELLIPSIS, expand=True)
+        self.button = ft.TextButton("Tareas", on_click=lambda e: self.open())
+        self.view = ft.Row([self.bar, self.text, self.button], spacing=8, expand=True)
+        self._list = ft.Column(spacing=10, scroll=ft.ScrollMode.AUTO, width=460, height=360)
+        self._dialog = ft.AlertDialog(
+            title=ft.Text("Tareas"), content=self._list,
+            actions=[ft.TextButton("Cerrar", on_click=lambda e: self.page.close(self._dialog))],
+        )
+        runner.subscribe(self._on_change)
+
+    def _on_change(self, job):
+        self.refresh()
+        self.page.update()
+
+    def refresh(self):
+        activas = self.runner.activas()
+        corriendo = [j for j in activas if j.estado == CORRIENDO]
+        self.bar.visible = bool(activas)
+        if corriendo:
+            job = corriendo[0]
+            self.bar.value = job.progreso   # None = indeterminada
+            self.text.value = f"{job.titulo}: {job.mensaje}" if job.mensaje else job.titulo
+        else:
+            self.bar.value = None
+            self.text.value = f"{len(activas)} en cola" if activas else ""
+        self.button.text = f"Tareas ({len(activas)})" if activas else "Tareas"
+        if self._dialog.open:
+            self._fill()
+
+    def _fill(self):
+        self._list.controls.clear()
+        for job in self.runner.jobs():
+            estado = self._ESTADOS.get(job.estado, "Terminada")
+            fila = [ft.Text(f"{job.titulo} — {estado}", weight=ft.FontWeight.BOLD, size=13)]
+            if not job.terminada:
+                fila.append(ft.ProgressBar(value=job.progreso))
+            if job.mensaje:
+                fila.append(ft.Text(job.mensaje, size=12, selectable=True,
+                                    color=ft.Colors.RED_700 if job.estado == ERROR else None))
+            if not job.terminada and not job.cancelada:
+                fila.append(ft.TextButton("Cancelar", data=job, on_click=lambda e: e.control.data.cancel()))
+            self._list.controls.append(ft.Column(fila, spacing=2, tight=True))
+        if not self._list.controls:
+            self._list.controls.append(ft.Text("No hay tareas."))
+
+    def open(self):
+        self._fill()
+        self.page.open(self._dialog)
+
 def make_app(page: ft.Page, conn, cur, paths):
     # ---------- Setup ----------
     page.title = "Consultorio Gerontológico Integral - Dra. Zulma Cabrera"
@@ -48,9 +358,41 @@ def make_app(page: ft.Page, conn, cur, paths):
     page.theme_mode = "light"
     page.bgcolor = "#F4F1ED"
 
-    # Guardamos conn/cur en sesión para poder reabrir tras importar BD
+    # Guardamos conn/cur en sesión (Importar BD ya no los reabre: reemplaza el contenido)
     page.session.set("conn", conn)
     page.session.set("cur", cur)
+    page.session.set("db", open_database(paths["DB_NAME"]).session(page.session_id))
+
+    # Cada sesión (ventana o pestaña web) tiene sus conexiones, y dentro de la sesión
+    # cada hilo del pool de Flet usa la suya. Lecturas (tabla, búsquedas, PDFs) van por
+    # la conexión de sólo lectura; escrituras por _db().transaction() (serializadas).
+    def _db():
+        sess = page.session.get("db")
+        if sess is None:
+            sess = open_database(paths["DB_NAME"]).session(page.session_id)
+            page.session.set("db", sess)
+        return sess
+
+    def _read_cur():
+        return _db().reader().cursor()
+
+    # PDF, backup, exportes e importaciones corren acá, no en el hilo del evento
+    runner = TaskRunner()
+    page.session.set("tasks", runner)
+    tasks_bar = TasksBar(page, runner)
+
+    # Backup automático: en su propio hilo, con la ventana ya abierta
+    scheduler = iniciar_scheduler(paths)
+
+    def on_backup_auto(evento, estado):
+        try:
+            if evento == "ok":
+                _toast(page, "Copia de seguridad automática subida a Google Drive")
+            elif evento == "error":
+                _toast(page, f"Falló el backup automático (se reintenta más tarde): {estado.get('ultimo_error')}")
+        except Exception as ex:
+            print("[DEBUG] No se pudo avisar el backup automático:", ex)
+    scheduler.subscribe(on_backup_auto)
 
     # ---------- FORM (izquierda) ----------
     tf_nombre   = ft.TextField(label="Nombre",    expand=True)
@@ -67,7 +409,13 @@ def make_app(page: ft.Page, conn, cur, paths):
     ta_ant_fam  = ft.TextField(label="Antecedentes familiares", multiline=True, min_lines=3, max_lines=5)
     ta_examen   = ft.TextField(label="Examen físico",           multiline=True, min_lines=3, max_lines=5)
     ta_diag     = ft.TextField(label="Diagnóstico presuntivo",  multiline=True, min_lines=3, max_lines=5)
-    ta_evol     = ft.TextField(label="Evolución / seguimiento", multiline=True, min_lines=3, max_lines=5)
+    ta_evol     = ft.TextField(label="Nueva evolución / seguimiento", multiline=True, min_lines=3, max_lines=5,
+                               helper_text="Se agrega como visita nueva al guardar o actualizar")
+
+    # Visitas anteriores de la historia seleccionada (más recientes primero, de a páginas)
+    visitas_col = ft.Column(spacing=4)
+    visitas_state = {"historia_id": None, "after": None}
+    btn_mas_visitas = ft.TextButton("Ver visitas anteriores", visible=False)
 
     # Para saber qué fila está seleccionada actualmente
     selected_row_values = {"values": None}  # dict mutable para cerrar sobre él
@@ -77,8 +425,31 @@ def make_app(page: ft.Page, conn, cur, paths):
                   ta_ant_pers, ta_ant_fam, ta_examen, ta_diag, ta_evol]:
             w.value = ""
         selected_row_values["values"] = None
+        visitas_col.controls.clear()
+        visitas_state.update(historia_id=None, after=None)
+        btn_mas_visitas.visible = False
+        page.update()
+
+    def load_visitas(historia_id=None):
+        if historia_id is not None:
+            visitas_col.controls.clear()
+            visitas_state.update(historia_id=historia_id, after=None)
+        elif visitas_state["historia_id"] is None:
+            return
+        rows, visitas_state["after"] = listar_consultas(
+            _read_cur(), visitas_state["historia_id"],
+            visitas_state["after"], 10, newest_first=True
+        )
+        for _id, fecha, notas in rows:
+            visitas_col.controls.append(ft.Column([
+                ft.Text(fecha, size=12, weight=ft.FontWeight.BOLD),
+                ft.Text(notas, size=12, selectable=True),
+            ], spacing=0, tight=True))
+        btn_mas_visitas.visible = visitas_state["after"] is not None
         page.update()
 
+    btn_mas_visitas.on_click = lambda e: load_visitas()
+
     def get_form_data():
         return {
             "nombre": tf_nombre.value.strip(),
@@ -98,17 +469,12 @@ def make_app(page: ft.Page, conn, cur, paths):
         }
 
     # ---------- TABLA (derecha) ----------
-    table_columns = [
-        ft.DataColumn(ft.Text(HEADERS["nombre"])),
-        ft.DataColumn(ft.Text(HEADERS["dni"])),
-        ft.DataColumn(ft.Text(HEADERS["edad"])),
-        ft.DataColumn(ft.Text(HEADERS["obra_social"])),
-        ft.DataColumn(ft.Text(HEADERS["numero_beneficio"])),
-        ft.DataColumn(ft.Text(HEADERS["telefono"])),
-        ft.DataColumn(ft.Text(HEADERS["motivo_consulta"])),
-    ]
-
-    def load_to_form(values):
+    def load_to_form(row_id):
+        # La lista sólo trae columnas cortas: la historia completa se lee al abrirla
+        values = obtener_historia(_read_cur(), row_id)
+        if values is None:
+            _toast(page, "La historia ya no existe.")
+            return
         tf_nombre.value = values[1] or ""
         tf_dni.value    = values[2] or ""
         tf_edad.value   = str(values[3] or "")
@@ -121,62 +487,208 @@ def make_app(page: ft.Page, conn, cur, paths):
         ta_ant_fam.value  = values[10] or ""
         ta_examen.value   = values[11] or ""
         ta_diag.value     = values[12] or ""
-        ta_evol.value     = values[13] or ""
+        ta_evol.value     = ""  # la evolución nueva se escribe vacía; las previas van en visitas_col
         tf_motivo.value   = values[14] or ""
         selected_row_values["values"] = values
-        page.update()
+        load_visitas(values[0])
 
-    table = ft.DataTable(
-        columns=table_columns,
-        rows=[],
-        heading_row_height=36,
-        data_row_max_height=64,
-        show_checkbox_column=False,
-    )
+    table = PatientList(on_select=lambda row_id: load_to_form(row_id),
+                        on_scroll=lambda e: on_table_scroll(e),
+                        on_sort=lambda col: on_sort(col))
 
-    def table_set_rows(rows):
-        table.rows = []
-        visible_indexes = [1, 2, 3, 5, 6, 7, 14 ]
-        def on_cell_tap(e, values):
-            load_to_form(values)
-        for r in rows:
-            cells = [
-                ft.DataCell(
-                    ft.Text(str(r[i] or "")),
-                    on_tap=lambda e, v=r: on_cell_tap(e, v)
-                )
-                for i in visible_indexes
-            ]
-            table.rows.append(ft.DataRow(cells=cells))
+    def _update_status():
+        status_txt.value = f"{len(table)} historias" + ("" if paging["after"] is None else " (deslizá para ver más)")
+
+    def table_set_rows(rows, snippets=None, append=False):
+        keys = None if snippets else [row_key(paging["order"], r) for r in rows]
+        table.set_rows(rows, snippets, keys, append=append)
+        _update_status()
         page.update()
 
+    # Estado de la paginación keyset de la tabla ("ranking" = resultados por relevancia, sin páginas)
+    paging = {"after": None, "filtros": {}, "loading": False, "order": "id", "desc": False, "mode": "lista"}
+    # La búsqueda en vivo aplica sus resultados desde otro hilo: todo acceso a `paging`
+    # (y a la tabla que describe) va con este candado
+    paging_lock = threading.RLock()
+    page_size = paths.get("PAGE_SIZE", 200)
+    status_txt = ft.Text("", size=12, color=ft.Colors.GREY_700)
+
+    def load_page(reset=False):
+        with paging_lock:
+            if paging["loading"] or (not reset and paging["after"] is None):
+                return
+            paging["loading"] = True
+            try:
+                _cur = _read_cur()
+                if reset:
+                    paging["mode"] = "lista"
+                after = None if reset else paging["after"]
+                rows, paging["after"] = listar_pagina(
+                    _cur, paging["order"], after, page_size,
+                    filtros=paging["filtros"], desc=paging["desc"]
+                )
+                table_set_rows(rows, append=not reset)
+            finally:
+                paging["loading"] = False
+
+    def on_table_scroll(e: ft.OnScrollEvent):
+        # Cerca del final → traemos la página siguiente
+        if e.max_scroll_extent and e.pixels >= e.max_scroll_extent - 300:
+            load_page()
+
     def refresh_table():
-        _cur = page.session.get("cur") or cur
-        _cur.execute("SELECT * FROM historias")
-        table_set_rows(_cur.fetchall())
+        live_search.cancel()  # que una búsqueda en vivo atrasada no pise la recarga
+        load_page(reset=True)
+
+    def after_change(row_id, kind):
+        """
+        Aplica en la tabla sólo el cambio de `row_id` ("insert"/"update"/"delete"),
+        respetando filtro, orden y scroll, en vez de recargar todo.
+        """
+        with paging_lock:
+            _after_change(row_id, kind)
+
+    def _after_change(row_id, kind):
+        idx = table.index_of(row_id)
+        if idx is not None:
+            table.pop(idx)
+        if kind == "delete":
+            _update_status(); page.update()
+            return
 
-    def after_refresh():
-        refresh_table()
+        r = obtener_fila_lista(_read_cur(), row_id, filtros=paging["filtros"])
+        if r is None:
+            pass  # ya no pasa el filtro actual
+        elif paging["mode"] == "ranking":
+            # Resultados por relevancia: sólo se reemplaza en su lugar (las altas no se agregan)
+            if idx is not None:
+                table.insert(idx, r)
+        else:
+            key = row_key(paging["order"], r)
+            desc = paging["desc"]
+            last = table.items[-1][2] if len(table) else None
+            # Si cae después de la última fila cargada, llegará con la próxima página
+            if paging["after"] is None or last is None or (key >= last if desc else key <= last):
+                table.insert_sorted(r, key, desc)
+        _update_status()
+        page.update()
 
     # ---------- BÚSQUEDA ----------
     q_field = ft.TextField(label="Buscar", width=260)
     crit_dd = ft.Dropdown(
         label="criterio",
         value="nombre",
-        options=[ft.dropdown.Option("nombre"), ft.dropdown.Option("dni")],
+        options=[ft.dropdown.Option("nombre"), ft.dropdown.Option("dni"), ft.dropdown.Option("texto")],
         width=140
     )
+    # Filtros combinados (se suman al buscador; todos con AND)
+    f_obra = ft.TextField(label="Obra social", width=150, dense=True)
+    f_edad_min = ft.TextField(label="Edad desde", width=100, dense=True)
+    f_edad_max = ft.TextField(label="Edad hasta", width=100, dense=True)
+    f_desde = ft.TextField(label="Alta desde", hint_text="AAAA-MM-DD", width=140, dense=True)
+    f_hasta = ft.TextField(label="Alta hasta", hint_text="AAAA-MM-DD", width=140, dense=True)
+    filter_fields = {"obra_social": f_obra, "edad_min": f_edad_min, "edad_max": f_edad_max,
+                     "creado_desde": f_desde, "creado_hasta": f_hasta}
+
+    def _run_filter(_cur, crit, q, extra, order, desc):
+        """Consulta del filtro (sin tocar la UI): puede correr en otro hilo."""
+        try:
+            filtros = filtros_lista(crit, q, extra)
+            if q and not extra and crit == "texto":
+                # Búsqueda en todo el texto clínico (índice FTS5, ordenada por relevancia)
+                return ("ranking", filtros, buscar_texto(_cur, q), None)
+            if q and not extra and crit == "nombre":
+                # Aproximada (trigramas): sin acentos y tolerante a errores de tipeo
+                found = buscar_nombre(_cur, q, limit=page_size)
+                return ("ranking", filtros, [(r, f"similitud {s:.0%}") for r, s in found], None)
+            rows, after = listar_pagina(_cur, order, None, page_size, filtros=filtros, desc=desc)
+            return ("lista", filtros, rows, after)
+        except ValueError as ex:
+            return ("error", None, str(ex), None)
+
+    def _apply_filter_result(result):
+        mode, filtros, rows, after = result
+        if mode == "error":
+            _toast(page, rows)
+            return
+        with paging_lock:
+            if mode == "ranking":
+                paging.update(after=None, mode="ranking", filtros={})
+                table_set_rows([r for r, _ in rows], [s for _, s in rows])
+            else:
+                paging.update(after=after, mode="lista", filtros=filtros)
+                table_set_rows(rows)
+
+    def _filter_args():
+        extra = {k: (tf.value or "").strip() for k, tf in filter_fields.items() if (tf.value or "").strip()}
+        with paging_lock:
+            order, desc = paging["order"], paging["desc"]
+        return (crit_dd.value or "nombre"), (q_field.value or "").strip(), extra, order, desc
+
     def apply_filter(_=None):
-        _cur = page.session.get("cur") or cur
-        q = (q_field.value or "").strip()
-        crit = crit_dd.value or "nombre"
-        if q:
-            _cur.execute(f"SELECT * FROM historias WHERE {crit} LIKE ?", (f"%{q}%",))
-        else:
-            _cur.execute("SELECT * FROM historias")
-        table_set_rows(_cur.fetchall())
+        live_search.cancel()
+        _apply_filter_result(_run_filter(_read_cur(), *_filter_args()))
+
+    def on_sort(col):
+        with paging_lock:
+            desc = (not paging["desc"]) if paging["order"] == col else False
+            paging.update(order=col, desc=desc)
+            table.set_sort(col, desc)
+            if paging["mode"] == "ranking":
+                # Los resultados por relevancia ya están todos: se ordenan en memoria
+                table.sort_loaded(lambda r: row_key(col, r), desc)
+                page.update()
+            else:
+                refresh_table()
+
+    def clear_filters(_=None):
+        for tf in filter_fields.values():
+            tf.value = ""
+        apply_filter()
+
+    # Búsqueda mientras se escribe: consulta en segundo plano, cancelable
+    search_conn = {"conn": None}
+    def _search_conn():
+        if search_conn["conn"] is None:
+            search_conn["conn"] = _db().dedicated_reader()
+        return search_conn["conn"]
+
+    def _search_error(ex):
+        if isinstance(ex, sqlite3.Error):
+            # p.ej. conexión cerrada: se descarta (cerrándola) y la próxima búsqueda abre otra
+            conn, search_conn["conn"] = search_conn["conn"], None
+            if conn is not None:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+        _toast(page, f"Error en la búsqueda: {ex}")
+
+    live_search = DebouncedSearch(
+        get_conn=_search_conn,
+        run=lambda c, *args: _run_filter(c.cursor(), *args),
+        apply=_apply_filter_result,
+        on_error=_search_error,
+        lock=paging_lock,
+    )
+
+    def on_query_change(_=None):
+        live_search.trigger(*_filter_args())
+
+    def show_all(_=None):
+        live_search.cancel()
+        q_field.value = ""
+        for tf in filter_fields.values():
+            tf.value = ""
+        with paging_lock:
+            paging["filtros"] = {}
+        refresh_table()
 
     q_field.on_submit = apply_filter
+    for tf in filter_fields.values():
+        tf.on_submit = apply_filter
+    q_field.on_change = on_query_change
+    crit_dd.on_change = on_query_change
 
 
     # ---------- MENÚ ÚNICO (BD + PDFs + Backup) ----------
@@ -184,41 +696,47 @@ def make_app(page: ft.Page, conn, cur, paths):
     open_db_picker  = ft.FilePicker()
     save_db_picker  = ft.FilePicker()
     pick_pdf_dir    = ft.FilePicker()  # usaremos get_directory_path()
-    page.overlay.extend([open_db_picker, save_db_picker, pick_pdf_dir])
+    import_pac_picker = ft.FilePicker()
+    export_csv_picker = ft.FilePicker()
+    page.overlay.extend([open_db_picker, save_db_picker, pick_pdf_dir, import_pac_picker, export_csv_picker])
+
+    def _importar_bd(src: str):
+        # Se reemplaza el contenido con la API de backup (Database.reemplazar_con), sin cerrar
+        # ni pisar el archivo: las demás sesiones, búsquedas y backups en curso siguen andando
+        uri = "file:" + src.replace("?", "%3f").replace("#", "%23") + "?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            problemas = integridad(conn)
+        except sqlite3.DatabaseError as ex:
+            raise ValueError(f"El archivo no es una base de datos SQLite ({ex})") from None
+        finally:
+            conn.close()
+        if problemas:
+            raise ValueError("La base elegida está dañada: " + "; ".join(problemas[:5]))
+        open_database(paths["DB_NAME"]).reemplazar_con(src)
 
     def _on_import_result(e: ft.FilePickerResultEvent):
         if not e.files:
             return
+        if runner.activas():
+            _toast(page, "Hay tareas en curso: esperá a que terminen (o cancelalas) antes de reemplazar la BD.")
+            return
         src = e.files[0].path
-        try:
-            os.makedirs(os.path.dirname(paths["DB_NAME"]), exist_ok=True)
-            # Cerrar conexión actual
-            old_conn = page.session.get("conn")
-            if old_conn:
-                try:
-                    old_conn.commit()
-                    old_conn.close()
-                except:
-                    pass
-            # Copiar BD
-            shutil.copy2(src, paths["DB_NAME"])
-            # Re-abrir
-            new_conn, new_cur = init_db(paths["DB_NAME"])
-            page.session.set("conn", new_conn)
-            page.session.set("cur", new_cur)
+        if os.path.exists(paths["DB_NAME"]) and os.path.samefile(src, paths["DB_NAME"]):
+            _toast(page, "Ese archivo ya es la base de datos actual.")
+            return
+
+        def listo(_):
             refresh_table()
             _toast(page, "Base de datos importada correctamente.")
-        except Exception as ex:
-            _toast(page, f"Error importando BD: {ex}")
+
+        runner.submit("Importar BD", _importar_bd, src, on_done=listo,
+                      on_error=lambda ex: _toast(page, f"Error importando BD: {ex}"))
 
     def _on_export_result(e: ft.FilePickerResultEvent):
         if not e.path:
             return
-        try:
-            shutil.copy2(paths["DB_NAME"], e.path)
-            _toast(page, "Copia de seguridad exportada.")
-        except Exception as ex:
-            _toast(page, f"Error exportando BD: {ex}")
+        exportar_bd_action(runner, _db(), e.path, page)
 
     def _on_pdf_dir_result(e: ft.FilePickerResultEvent):
         if not e.path:
@@ -230,7 +748,13 @@ def make_app(page: ft.Page, conn, cur, paths):
         except Exception as ex:
             _toast(page, f"No se pudo actualizar la carpeta de PDFs: {ex}")
 
+    def _on_import_pacientes_result(e: ft.FilePickerResultEvent):
+        if not e.files:
+            return
+        importar_pacientes_action(runner, _db(), e.files[0].path, refresh_table, page)
+
     open_db_picker.on_result = _on_import_result
+    import_pac_picker.on_result = _on_import_pacientes_result
     save_db_picker.on_result = _on_export_result
     pick_pdf_dir.on_result   = _on_pdf_dir_result
 
@@ -249,6 +773,53 @@ def make_app(page: ft.Page, conn, cur, paths):
             dialog_title="Guardar copia de la base de datos"
         )
 
+    def do_import_pacientes(_: ft.ControlEvent):
+        import_pac_picker.pick_files(
+            allow_multiple=False,
+            allowed_extensions=["csv", "jsonl"],
+            dialog_title="Importar pacientes (CSV con ';' o JSONL)"
+        )
+
+    def do_export_csv(_: ft.ControlEvent):
+        export_csv(runner, _db(), page, export_csv_picker)
+
+    def _alcance_listado():
+        """
+        Qué historias abarca "el listado": con filtro, todas las que lo cumplen (no sólo
+        las páginas cargadas); con resultados por relevancia, las que se están mostrando.
+        None (y un aviso) si no hay ninguna.
+        """
+        with paging_lock:
+            if paging["mode"] != "ranking":
+                return {"filtros": dict(paging["filtros"])}
+            ids = [r[0] for r, _, _ in table.items]
+        if not ids:
+            _toast(page, "No hay historias en el listado.")
+            return None
+        return {"ids": ids}
+
+    def do_export_listado(_: ft.ControlEvent):
+        alcance = _alcance_listado()
+        if alcance is not None:
+            export_csv(runner, _db(), page, export_csv_picker, **alcance)
+
+    def _pdfs_listado(accion):
+        alcance = _alcance_listado()
+        if alcance is not None:
+            accion(runner, _db(), paths, page, **alcance)
+
+    def do_pdfs_listado(_: ft.ControlEvent):
+        _pdfs_listado(generar_pdfs_lote_action)
+
+    def do_reporte_listado(_: ft.ControlEvent):
+        _pdfs_listado(generar_reporte_action)
+
+    def do_restaurar_backup(_: ft.ControlEvent):
+        if runner.activas():
+            _toast(page, "Hay tareas en curso: esperá a que terminen (o cancelalas) antes de reemplazar la BD.")
+            return
+        restaurar_backup_action(runner, paths, page, refresh_table)
+
     def do_select_pdf_dir(_: ft.ControlEvent):
         pick_pdf_dir.get_directory_path(
             dialog_title="Seleccionar carpeta para guardar PDFs"
@@ -260,7 +831,7 @@ def make_app(page: ft.Page, conn, cur, paths):
 
     def do_backup_now(_: ft.ControlEvent):
         if can_backup(paths):
-            backup_now_action(paths, page)
+            backup_now_action(runner, paths, page)
         else:
             _toast(page, "Backup no disponible: falta PyDrive2 o client_secrets.json")
 
@@ -269,11 +840,17 @@ def make_app(page: ft.Page, conn, cur, paths):
         items=[
             ft.PopupMenuItem(text="Importar BD…",        on_click=do_import),
             ft.PopupMenuItem(text="Exportar BD…",        on_click=do_export),
+            ft.PopupMenuItem(text="Importar pacientes (CSV/JSONL)…", on_click=do_import_pacientes),
+            ft.PopupMenuItem(text="Exportar pacientes (CSV/JSONL/XLSX)…", on_click=do_export_csv),
+            ft.PopupMenuItem(text="Exportar listado actual…", on_click=do_export_listado),
             ft.PopupMenuItem(),  # separador
+            ft.PopupMenuItem(text="Generar PDFs del listado", on_click=do_pdfs_listado),
+            ft.PopupMenuItem(text="PDF único del listado (con índice)", on_click=do_reporte_listado),
             ft.PopupMenuItem(text="Seleccionar carpeta de PDFs…", on_click=do_select_pdf_dir),
             ft.PopupMenuItem(text="Abrir carpeta de PDFs",        on_click=do_open_pdf_dir),
             ft.PopupMenuItem(),  # separador
             ft.PopupMenuItem(text="Backup ahora", on_click=do_backup_now, disabled=not can_backup(paths)),
+            ft.PopupMenuItem(text="Restaurar backup…", on_click=do_restaurar_backup, disabled=not can_backup(paths)),
         ],
         tooltip="Opciones",
     )
@@ -290,22 +867,22 @@ def make_app(page: ft.Page, conn, cur, paths):
         controls=[
             tf_nombre, tf_dni, tf_edad, tf_dom, tf_obra, tf_benef, tf_tel, tf_email, tf_motivo,
             ta_ant_pers, ta_ant_fam, ta_examen, ta_diag, ta_evol,
+            ft.Text("Visitas anteriores", weight=ft.FontWeight.BOLD),
+            visitas_col, btn_mas_visitas,
             ft.Row([
                 ft.ElevatedButton(
                     "Guardar", bgcolor="#B0E0A8",
                     on_click=lambda e: guardar(
-                        page.session.get("cur") or cur,
-                        page.session.get("conn") or conn,
-                        get_form_data, clear_form, after_refresh, page
+                        _db(),
+                        get_form_data, clear_form, after_change, page
                     ),
                     expand=1
                 ),
                 ft.ElevatedButton(
                     "Actualizar",
                     on_click=lambda e: actualizar(
-                        page.session.get("cur") or cur,
-                        page.session.get("conn") or conn,
-                        selected_row_values, get_form_data, clear_form, after_refresh, page
+                        _db(),
+                        selected_row_values, get_form_data, clear_form, after_change, page
                     ),
                     expand=1
                 ),
@@ -315,15 +892,14 @@ def make_app(page: ft.Page, conn, cur, paths):
                     "Borrar",
                     on_click=lambda e: accionBorrar(
                         page, selected_row_values,
-                        page.session.get("cur") or cur,
-                        page.session.get("conn") or conn,
-                        clear_form, after_refresh
+                        _db(),
+                        clear_form, after_change
                     ),
                     expand=1
                 ),
                 ft.ElevatedButton(
                     "Generar PDF",
-                    on_click=lambda e: generar_pdf_action(paths, selected_row_values, page),
+                    on_click=lambda e: generar_pdf_action(runner, paths, selected_row_values, page, _db()),
                     expand=1
                 ),
             ], spacing=10),
@@ -341,15 +917,17 @@ def make_app(page: ft.Page, conn, cur, paths):
         controls=[
             ft.Row([q_field, crit_dd,
                     ft.FilledButton("Buscar", on_click=apply_filter),
-                    ft.FilledButton("Actualizar", on_click=lambda e: refresh_table()),
+                    ft.FilledButton("Actualizar", on_click=show_all),
                     ], spacing=10),
+            ft.Row([f_obra, f_edad_min, f_edad_max, f_desde, f_hasta,
+                    ft.TextButton("Quitar filtros", on_click=clear_filters),
+                    ], spacing=10, wrap=True),
+            table.header,
             ft.Container(
-                content=ft.ListView(
-                    controls=[table],
-                    expand=True,
-                ),
+                content=table.view,
                 expand=True,
-            )
+            ),
+            ft.Row([status_txt, tasks_bar.view], spacing=16),
         ],
         expand=True,
         spacing=8,
@@ -370,10 +948,22 @@ def make_app(page: ft.Page, conn, cur, paths):
 
     # Cerrar conexión al salir (la actual en sesión)
     def on_close(e):
+        runner.shutdown()
+        # El scheduler es del proceso: otras ventanas lo siguen usando (se para al salir)
+        scheduler.unsubscribe(on_backup_auto)
         try:
-            _conn = page.session.get("conn") or conn
-            _conn.commit(); _conn.close()
+            # Sólo las conexiones de esta sesión: las otras ventanas siguen usando la BD
+            _db().close_all()
         except:
             pass
         page.window_destroy()
     page.on_close = on_close
+
+    # En modo web, cerrar la pestaña desconecta la sesión: liberar sus conexiones
+    def on_disconnect(e):
+        runner.shutdown()
+        scheduler.unsubscribe(on_backup_auto)
+        sess = page.session.get("db")
+        if sess is not None:
+            sess.close_all()
+    page.on_disconnect = on_disconnect
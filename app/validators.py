@@ -1,5 +1,6 @@
 # validators.py
 import re
+import unicodedata
 
 EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
@@ -9,7 +10,7 @@ def validar_campos(data: dict):
     if not data.get('dni'):
         return False, "El DNI es obligatorio."
 
-    dni_clean = re.sub(r"[^\d]", "", data['dni'])
+    dni_clean = normalizar_dni(data['dni'])
     if not dni_clean.isdigit() or len(dni_clean) < 7:
         return False, "El DNI debe ser numérico (mínimo 7 dígitos)."
 
@@ -29,3 +30,14 @@ def validar_campos(data: dict):
         return False, "El email no tiene un formato válido."
 
     return True, ""
+
+# ------------------------- normalización -------------------------
+def normalizar_dni(dni) -> str:
+    """Deja sólo los dígitos: "12.345.678" -> "12345678"."""
+    return re.sub(r"[^\d]", "", str(dni or ""))
+
+def normalizar_nombre(nombre) -> str:
+    """Minúsculas, sin acentos y con espacios simples: "  González  Ana" -> "gonzalez ana"."""
+    s = unicodedata.normalize("NFKD", str(nombre or ""))
+    s = "".join(ch for ch in s if not unicodedata.combining(ch))
+    return " ".join(s.casefold().split())
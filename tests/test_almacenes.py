@@ -0,0 +1,146 @@
+# test_almacenes.py
+"""Reintentos de los almacenes de backup (almacenes.ConReintentos, es_transitorio, DriveStore.put)."""
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from almacenes import EnMemoria, ConReintentos, es_transitorio
+from backup_drive import DriveStore
+
+def _con_reintentos(almacen, **kw):
+    esperas = []
+    return ConReintentos(almacen, dormir=esperas.append, **kw), esperas
+
+def test_errores_transitorios_se_reintentan():
+    mem = EnMemoria(fallas=0.5, semilla=7)
+    store, esperas = _con_reintentos(mem, intentos=50, espera=1.0, espera_max=8.0)
+    for i in range(20):
+        store.put(f"chunks/{i}", b"x" * i)
+    assert [store.get(f"chunks/{i}") for i in range(20)] == [b"x" * i for i in range(20)]
+    assert mem.ops["fallas"] > 0
+    assert store.reintentos == mem.ops["fallas"] == len(esperas)
+    assert max(esperas) <= 8.0
+
+def test_error_permanente_no_se_reintenta():
+    mem = EnMemoria()
+    store, esperas = _con_reintentos(mem)
+    with pytest.raises(KeyError):
+        store.get("chunks/no-esta")
+    assert mem.ops["get"] == 1 and esperas == [] and store.reintentos == 0
+
+def test_respeta_la_cantidad_de_intentos():
+    mem = EnMemoria(fallas=1.0)
+    store, esperas = _con_reintentos(mem, intentos=4, espera=0.5, espera_max=1.5)
+    with pytest.raises(ConnectionError):
+        store.put("chunks/a", b"a")
+    assert mem.ops["put"] == 4
+    assert esperas == [0.5, 1.0, 1.5]
+    assert "chunks/a" not in mem.objetos
+
+class _Resp:
+    def __init__(self, status):
+        self.status = status
+
+class HttpError(Exception):
+    """Como googleapiclient.errors.HttpError: resp.status y el JSON en content."""
+
+    def __init__(self, status, reason=None):
+        super().__init__(f"HTTP {status}")
+        self.resp = _Resp(status)
+        errores = [{"reason": reason}] if reason else []
+        self.content = json.dumps({"error": {"code": status, "errors": errores}}).encode("utf-8")
+
+class ApiRequestError(IOError):
+    """Como pydrive2.files.ApiRequestError: sin resp, con el "error" ya leído."""
+
+    def __init__(self, status, reason):
+        super().__init__(f"HTTP {status}")
+        self.error = {"code": status, "errors": [{"reason": reason}]}
+
+@pytest.mark.parametrize("ex, esperado", [
+    (ConnectionError("reset"), True),
+    (TimeoutError("timeout"), True),
+    (HttpError(500), True),
+    (HttpError(503, "backendError"), True),
+    (HttpError(429, "rateLimitExceeded"), True),
+    (HttpError(408), True),
+    (HttpError(403, "rateLimitExceeded"), True),
+    (HttpError(403, "userRateLimitExceeded"), True),
+    (HttpError(403, "insufficientPermissions"), False),
+    (HttpError(403, "dailyLimitExceeded"), False),
+    (HttpError(403), False),
+    (HttpError(404, "notFound"), False),
+    (ApiRequestError(403, "userRateLimitExceeded"), True),
+    (ApiRequestError(403, "storageQuotaExceeded"), False),
+    (ApiRequestError(502, "badGateway"), True),
+    (KeyError("x"), False),
+    (ValueError("x"), False),
+])
+def test_es_transitorio(ex, esperado):
+    assert es_transitorio(ex) is esperado
+
+# ------------------------- DriveStore con un Drive falso -------------------------
+class _Lista:
+    def __init__(self, archivos):
+        self._archivos = archivos
+
+    def GetList(self):
+        return self._archivos
+
+class _Archivo(dict):
+    def __init__(self, drive, meta):
+        super().__init__(meta)
+        self._drive = drive
+        self.content = None
+
+    def Upload(self):
+        self._drive.subir(self)
+
+class DriveFalso:
+    """Una carpeta de Drive: títulos repetidos permitidos; `timeouts` subidas llegan pero fallan."""
+
+    def __init__(self, timeouts=0):
+        self.archivos = {}     # id -> {"title", "data"}
+        self.timeouts = timeouts
+        self.creados = 0
+
+    def CreateFile(self, meta):
+        return _Archivo(self, meta)
+
+    def ListFile(self, params):
+        q = params["q"]
+        return _Lista([{"id": i, "title": a["title"]} for i, a in self.archivos.items()
+                       if "title=" not in q or f"title='{a['title']}'" in q])
+
+    def subir(self, f):
+        if "id" not in f:
+            self.creados += 1
+            f["id"] = f"id{self.creados}"
+            self.archivos[f["id"]] = {"title": f["title"]}
+        self.archivos[f["id"]]["data"] = f.content.getvalue()
+        if self.timeouts:
+            self.timeouts -= 1
+            raise TimeoutError("la subida llegó pero no la respuesta")
+
+    def titulos(self):
+        return sorted(a["title"] for a in self.archivos.values())
+
+def test_put_reintentado_despues_de_un_timeout_no_duplica():
+    drive = DriveFalso(timeouts=2)
+    store, esperas = _con_reintentos(DriveStore(drive, "carpeta"))
+    store.put("chunks/abc", b"datos")
+    assert drive.titulos() == ["chunks/abc"]
+    assert len(esperas) == 2
+    assert drive.archivos["id1"]["data"] == b"datos"
+
+def test_put_de_un_titulo_existente_lo_reemplaza():
+    drive = DriveFalso()
+    store = DriveStore(drive, "carpeta")
+    store.put("snapshots/1.json", b"v1")
+    store.put("snapshots/1.json", b"v2")
+    assert drive.titulos() == ["snapshots/1.json"]
+    assert drive.archivos["id1"]["data"] == b"v2"
@@ -0,0 +1,64 @@
+# test_catalogo.py
+"""Retención de backups (catalogo.podar): los bloques recién subidos no se borran."""
+import os
+import sys
+import json
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from almacenes import EnMemoria, CarpetaLocal
+from catalogo import podar, GRACIA_H
+
+POL = {"diarios": 1, "semanales": 0, "mensuales": 0}
+HORA = 3600
+
+def _snapshot(store, snap_id, chunks):
+    store.put(f"snapshots/{snap_id}.json", json.dumps({"id": snap_id, "chunks": chunks}).encode("utf-8"))
+    for h in chunks:
+        store.put(f"chunks/{h}", h.encode("utf-8"))
+
+def _envejecer(store, nombre, horas):
+    if isinstance(store, EnMemoria):
+        store.fechas[nombre] = time.time() - horas * HORA
+    else:
+        t = time.time() - horas * HORA
+        os.utime(store._path(nombre), (t, t))
+
+@pytest.fixture(params=["memoria", "carpeta"])
+def store(request, tmp_path):
+    return EnMemoria() if request.param == "memoria" else CarpetaLocal(str(tmp_path / "repo"))
+
+def test_no_borra_bloques_de_un_backup_en_curso(store, tmp_path):
+    # Dos backups del mismo día: la retención diaria conserva sólo el último
+    _snapshot(store, "20240510_080000", ["viejo", "comun"])
+    _snapshot(store, "20240510_200000", ["comun", "nuevo"])
+    for nombre in store.listar():
+        _envejecer(store, nombre, 3 * GRACIA_H)
+    # Bloques de un backup que otra PC está subiendo: todavía sin manifiesto
+    store.put("chunks/en_curso", b"x")
+    _envejecer(store, "chunks/en_curso", GRACIA_H - 1)
+    store.put("chunks/recien", b"y")
+
+    rep = podar({"BASE_DIR": str(tmp_path)}, store, POL)
+    assert rep["borrados"] == ["20240510_080000"]
+    assert rep["chunks_borrados"] == 1 and rep["chunks_recientes"] == 2
+    assert store.listar("chunks/") == ["chunks/comun", "chunks/en_curso", "chunks/nuevo", "chunks/recien"]
+
+    # Pasada la gracia (backup abandonado), sí se borran
+    _envejecer(store, "chunks/en_curso", GRACIA_H + 1)
+    rep = podar({"BASE_DIR": str(tmp_path)}, store, POL)
+    assert rep["chunks_borrados"] == 1
+    assert store.listar("chunks/") == ["chunks/comun", "chunks/nuevo", "chunks/recien"]
+
+def test_simular_no_borra(tmp_path):
+    store = EnMemoria()
+    _snapshot(store, "20240510_080000", ["a"])
+    _snapshot(store, "20240510_200000", ["b"])
+    for nombre in store.listar():
+        _envejecer(store, nombre, 3 * GRACIA_H)
+    rep = podar({"BASE_DIR": str(tmp_path)}, store, POL, simular=True)
+    assert rep["borrados"] == ["20240510_080000"] and rep["chunks_borrados"] == 1
+    assert len(store.listar()) == 4
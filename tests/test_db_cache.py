@@ -0,0 +1,42 @@
+# test_db_cache.py
+"""Cache LRU de historias (db.obtener_historia): por archivo y sin filas viejas."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from db import (open_database, close_database, insertar_historia, actualizar_historia, obtener_historia,
+                historias_cache, _cache_key, DATA_COLUMNS)
+
+@pytest.fixture
+def dos_bds(tmp_path):
+    paths = [str(tmp_path / "a.db"), str(tmp_path / "b.db")]
+    dbs = [open_database(p) for p in paths]
+    for database, nombre, dni in zip(dbs, ("Ana de A", "Beto de B"), ("11111111", "22222222")):
+        with database.transaction() as cur:
+            insertar_historia(cur, {"nombre": nombre, "dni": dni})
+    yield dbs
+    for p in paths:
+        close_database(p)
+
+def test_mismo_id_en_dos_bds_no_comparte_cache(dos_bds):
+    a, b = dos_bds
+    assert obtener_historia(a.reader().cursor(), 1)[1] == "Ana de A"
+    assert obtener_historia(b.reader().cursor(), 1)[1] == "Beto de B"
+    assert obtener_historia(a.reader().cursor(), 1)[1] == "Ana de A"
+
+def test_actualizar_invalida_y_no_vuelve_la_fila_vieja(dos_bds):
+    a, _ = dos_bds
+    cur = a.reader().cursor()
+    key = _cache_key(cur, 1)
+    # Una lectura empezó antes de que otra sesión actualizara la historia
+    gen = historias_cache.generation()
+    vieja = obtener_historia(cur, 1)
+    data = {c: None for c in DATA_COLUMNS}
+    data.update(nombre="Ana editada", dni="11111111")
+    with a.session("otra").transaction() as w:
+        actualizar_historia(w, 1, data)
+    historias_cache.put(key, vieja, gen)   # el put atrasado se descarta
+    assert obtener_historia(cur, 1)[1] == "Ana editada"
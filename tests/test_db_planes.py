@@ -0,0 +1,81 @@
+# test_db_planes.py
+"""Planes de la lista paginada (db.listar_pagina): cada orden/filtro va por su índice."""
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from db import open_database, close_database, listar_pagina, explicar_pagina, contar_historias
+from bench import PLANES, _bd_sintetica
+
+# Índice que tiene que usar cada combinación de PLANES (en el mismo orden)
+ESPERADOS = (
+    "INTEGER PRIMARY KEY",
+    "idx_historias_nombre_norm",
+    "idx_historias_dni_orden",
+    "idx_historias_edad",
+    "idx_historias_obra_social_orden",
+    "idx_historias_obra_social",
+    "idx_historias_obra_social_orden",
+    "idx_historias_edad",
+    "idx_historias_dni_norm_todas",
+    "idx_historias_created_at",
+    "historias_fts",
+)
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("planes") / "planes.db")
+    _bd_sintetica(path, 2000)
+    yield open_database(path)
+    close_database(path)
+
+@pytest.fixture
+def cur(database):
+    return database.reader().cursor()
+
+def test_esperados_cubre_planes():
+    assert len(ESPERADOS) == len(PLANES)
+
+@pytest.mark.parametrize("order, filtros, desc, indice",
+                         [p + (e,) for p, e in zip(PLANES, ESPERADOS)],
+                         ids=[f"{o}{' desc' if d else ''}-{'+'.join(f) or 'todas'}" for o, f, d in PLANES])
+def test_plan_usa_el_indice(cur, order, filtros, desc, indice):
+    # Primera página y la siguiente (con el cursor keyset, si hay más de una)
+    _, after = listar_pagina(cur, order, None, 10, filtros=filtros, desc=desc)
+    for pagina in (None, after):
+        plan = explicar_pagina(cur, order, filtros=filtros, desc=desc, after=pagina)
+        scan = any(p.startswith("SCAN historias") and "INDEX" not in p for p in plan)
+        assert not (scan and any("TEMP B-TREE FOR ORDER BY" in p for p in plan)), plan
+    assert any(indice in p for p in plan), plan
+
+@pytest.mark.parametrize("kwargs", [
+    {"order": "domicilio"},
+    {"order": "id; DROP TABLE historias"},
+    {"filtros": {"domicilio": "Calle 1"}},
+    {"crit": "email", "q": "p1@mail.com"},
+])
+def test_orden_o_filtro_fuera_de_la_lista(cur, kwargs):
+    with pytest.raises(ValueError):
+        listar_pagina(cur, **kwargs)
+
+@pytest.mark.skipif(not hasattr(time, "tzset"), reason="time.tzset sólo existe en Unix")
+def test_filtro_de_fechas_en_hora_local(database, cur, monkeypatch):
+    # created_at está en UTC: las 2 h UTC del 31 son todavía el 30 en Buenos Aires
+    with database.transaction() as w:
+        w.execute("SELECT created_at FROM historias WHERE id = 1")
+        antes = w.fetchone()[0]
+        w.execute("UPDATE historias SET created_at = '2024-01-31 02:00:00' WHERE id = 1")
+    monkeypatch.setenv("TZ", "America/Argentina/Buenos_Aires")
+    time.tzset()
+    try:
+        assert contar_historias(cur, filtros={"creado_desde": "2024-01-30", "creado_hasta": "2024-01-30"}) == 1
+        assert contar_historias(cur, filtros={"creado_desde": "2024-01-31", "creado_hasta": "2024-12-31"}) == 0
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+        with database.transaction() as w:
+            w.execute("UPDATE historias SET created_at = ? WHERE id = 1", (antes,))
@@ -0,0 +1,62 @@
+# test_exporter.py
+"""Exportar (exporter.py) y volver a importar (importer.py) no pierde ni duplica visitas."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from db import open_database, close_database, insertar_historia, agregar_consulta, iter_consultas
+from exporter import exportar
+from importer import importar_pacientes
+
+VISITAS = [
+    ("2024-01-02 10:30", "Primera consulta.\nTA 130/80"),
+    ("2024-02-03", "Control: sigue bien"),
+    ("2024-03-04 09:05", "Ajuste de medicación"),
+]
+
+@pytest.fixture
+def origen(tmp_path):
+    path = str(tmp_path / "origen.db")
+    database = open_database(path)
+    with database.transaction() as cur:
+        row_id = insertar_historia(cur, {"nombre": "Ana Núñez", "dni": "20.123.456", "edad": "81"})
+        for fecha, notas in VISITAS:
+            agregar_consulta(cur, row_id, notas, fecha)
+        insertar_historia(cur, {"nombre": "Beto Pérez", "dni": "30123456"})
+    yield database
+    close_database(path)
+
+def _visitas(database, dni_norm):
+    cur = database.reader().cursor()
+    cur.execute("SELECT id FROM historias WHERE dni_norm = ?", (dni_norm,))
+    return [(fecha, notas) for _, fecha, notas in iter_consultas(cur, cur.fetchone()[0])]
+
+@pytest.mark.parametrize("formato", ["csv", "jsonl"])
+def test_exportar_e_importar_conserva_visitas(origen, tmp_path, formato):
+    archivo = str(tmp_path / f"historias.{formato}")
+    rep = exportar(origen.reader().cursor(), archivo)
+    assert rep["filas"] == 2
+
+    destino_path = str(tmp_path / "destino.db")
+    destino = open_database(destino_path)
+    try:
+        imp = importar_pacientes(destino, archivo)
+        assert imp["errores"] == [] and imp["insertadas"] == 2
+        assert _visitas(destino, "20123456") == VISITAS
+        assert _visitas(destino, "30123456") == []
+
+        # Reimportar el mismo archivo (o reintentar un lote) no duplica visitas
+        importar_pacientes(destino, archivo)
+        assert _visitas(destino, "20123456") == VISITAS
+    finally:
+        close_database(destino_path)
+
+def test_reimportar_sobre_el_origen_no_duplica(origen, tmp_path):
+    archivo = str(tmp_path / "historias.jsonl")
+    exportar(origen.reader().cursor(), archivo)
+    imp = importar_pacientes(origen, archivo)
+    assert imp["actualizadas"] == 2
+    assert _visitas(origen, "20123456") == VISITAS
@@ -0,0 +1,128 @@
+# test_scheduler.py
+"""Backup automático (scheduler.BackupScheduler) con reloj falso: tick() hace una revisión."""
+import os
+import sys
+import json
+import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+from paths import save_config
+from scheduler import (BackupScheduler, espera_reintento, en_silencio, ESTADO_NAME,
+                       REINTENTO_BASE_S, REINTENTO_MAX_S)
+
+def _ts(*args) -> float:
+    """Timestamp de una hora local (en_silencio mira la hora local)."""
+    return datetime.datetime(*args).timestamp()
+
+class Reloj:
+    def __init__(self, t: float):
+        self.t = t
+
+    def __call__(self) -> float:
+        return self.t
+
+class Backup:
+    """backup_fn falso: cuenta las llamadas y falla mientras `falla` sea True."""
+
+    def __init__(self):
+        self.llamadas = 0
+        self.falla = False
+
+    def __call__(self, paths, progress=None):
+        self.llamadas += 1
+        if self.falla:
+            raise OSError("sin conexión")
+        return {"id": f"backup-{self.llamadas}"}
+
+@pytest.fixture
+def armar(tmp_path):
+    def armar(config=None, t=_ts(2024, 5, 10, 12, 0)):
+        save_config(str(tmp_path), config or {})
+        reloj, backup = Reloj(t), Backup()
+        sched = BackupScheduler({"BASE_DIR": str(tmp_path)}, backup_fn=backup,
+                                disponible=lambda paths: True, clock=reloj)
+        return sched, reloj, backup
+    return armar
+
+def test_respeta_el_intervalo(armar):
+    sched, reloj, backup = armar({"backup_intervalo_horas": 24})
+    assert sched.tick() == {"id": "backup-1"}
+    reloj.t += 23 * 3600
+    assert sched.tick() is None
+    reloj.t += 3600
+    assert sched.tick() == {"id": "backup-2"}
+    assert backup.llamadas == 2 and sched.estado()["ultimo_id"] == "backup-2"
+
+def test_backup_manual_cuenta_como_ultimo(armar):
+    hoy = datetime.date(2024, 5, 10)
+    sched, reloj, backup = armar({"backup_intervalo_horas": 48, "last_backup": hoy.isoformat()})
+    assert sched.tick() is None
+    reloj.t = _ts(2024, 5, 12, 0, 0)
+    assert sched.tick() is not None and backup.llamadas == 1
+
+@pytest.mark.parametrize("hora, silencio, esperado", [
+    (23.0, [22, 6], True),
+    (0.0, [22, 6], True),
+    (5.99, [22, 6], True),
+    (6.0, [22, 6], False),
+    (12.0, [22, 6], False),
+    (21.99, [22, 6], False),
+    (8.0, [8, 20], True),
+    (20.0, [8, 20], False),
+    (3.0, [5, 5], False),
+    (3.0, None, False),
+])
+def test_en_silencio(hora, silencio, esperado):
+    assert en_silencio(hora, silencio) is esperado
+
+def test_silencio_que_cruza_la_medianoche_posterga_el_backup(armar):
+    sched, reloj, backup = armar({"backup_silencio": [22, 6]}, t=_ts(2024, 5, 10, 23, 0))
+    assert sched.tick() is None
+    reloj.t = _ts(2024, 5, 11, 3, 30)
+    assert sched.tick() is None
+    reloj.t = _ts(2024, 5, 11, 6, 0)
+    assert sched.tick() is not None
+    assert backup.llamadas == 1
+
+def test_espera_reintento_crece_y_tiene_tope():
+    assert espera_reintento(0) == 0
+    assert [espera_reintento(n) for n in (1, 2, 3, 4)] == [REINTENTO_BASE_S * m for m in (1, 2, 4, 8)]
+    assert espera_reintento(50) == REINTENTO_MAX_S
+
+def test_reintenta_con_espera_exponencial(armar):
+    sched, reloj, backup = armar()
+    backup.falla = True
+    for fallos in (1, 2, 3):
+        assert isinstance(sched.tick(), OSError)
+        assert sched.estado()["fallos"] == fallos
+        espera = espera_reintento(fallos)
+        reloj.t += espera - 1
+        assert sched.tick() is None            # todavía no
+        reloj.t += 1
+    assert backup.llamadas == 3
+
+    backup.falla = False
+    assert sched.tick() is not None
+    estado = sched.estado()
+    assert estado["fallos"] == 0 and estado["ultimo_error"] is None
+
+def test_backup_interrumpido_cuenta_como_fallido(tmp_path, armar):
+    t = _ts(2024, 5, 10, 12, 0)
+    with open(tmp_path / ESTADO_NAME, "w", encoding="utf-8") as f:
+        json.dump({"ultimo_ok": t - 7 * 86400, "ultimo_intento": t - 7 * 86400, "fallos": 0,
+                   "ultimo_error": None, "en_curso_desde": t}, f)
+
+    sched, reloj, backup = armar(t=t + 60)
+    estado = sched.estado()
+    assert "en_curso_desde" not in estado
+    assert estado["fallos"] == 1 and estado["ultimo_intento"] == t
+    assert estado["proximo"] == t + espera_reintento(1)
+    with open(tmp_path / ESTADO_NAME, encoding="utf-8") as f:
+        assert "en_curso_desde" not in json.load(f)
+
+    assert sched.tick() is None                # esperando el reintento
+    reloj.t = t + espera_reintento(1)
+    assert sched.tick() is not None and sched.estado()["fallos"] == 0